@@ -0,0 +1,66 @@
+######## Drawing of detections and overlays #########
+#
+# Kept out of the detection loop so that a headless Pi never draws anything. When
+# annotated frames are wanted without a monitor, SnapshotWriter saves one now and
+# then instead of every frame.
+
+import glob
+import os
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+def draw_detections(frame, detections):
+    # detections holds (xmin, ymin, xmax, ymax, object_name, score) tuples in pixels
+    for xmin, ymin, xmax, ymax, object_name, score in detections:
+        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (10, 255, 0), 2)
+
+        # Draw label
+        label = '%s: %d%%' % (object_name, int(score * 100))  # Example: 'person: 72%'
+        labelSize, baseLine = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)  # Get font size
+        label_ymin = max(ymin, labelSize[1] + 10)  # Make sure not to draw label too close to top of window
+        cv2.rectangle(frame, (xmin, label_ymin - labelSize[1] - 10), (xmin + labelSize[0], label_ymin + baseLine - 10), (255, 255, 255), cv2.FILLED)  # Draw white box to put label text in
+        cv2.putText(frame, label, (xmin, label_ymin - 7), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)  # Draw label text
+
+def draw_overlay(frame, vehicle_count, frame_rate):
+    # Display the vehicle passed count in the top right corner of the frame
+    cv2.putText(frame, '#vehicles: {}'.format(vehicle_count), (frame.shape[1] - 300, 50),
+                cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 0), 2, cv2.LINE_AA)
+
+    # Draw frame rate in the corner of the frame
+    cv2.putText(frame, 'FPS: {0:.2f}'.format(frame_rate), (30, 50),
+                cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 0), 2, cv2.LINE_AA)
+
+def draw_counting_area(frame, line=None, zone=None):
+    # Show where vehicles are counted
+    if line is not None:
+        (x1, y1), (x2, y2) = line
+        cv2.line(frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 0, 255), 2)
+    if zone is not None:
+        cv2.polylines(frame, [np.asarray(zone, dtype=np.int32)], True, (0, 0, 255), 2)
+
+class SnapshotWriter:
+    """Saves at most one annotated frame as a JPEG every interval seconds"""
+    def __init__(self, folder, interval=60, keep=100, quality=80):
+        self.folder = folder
+        self.interval = interval
+        self.keep = keep
+        self.quality = quality
+        self.last_write = None
+        os.makedirs(folder, exist_ok=True)
+
+    def due(self):
+        # Cheap enough to call every frame
+        return self.last_write is None or time.monotonic() - self.last_write >= self.interval
+
+    def write(self, frame):
+        self.last_write = time.monotonic()
+        filename = datetime.now().strftime("snapshot_%Y%m%d_%H%M%S.jpg")
+        cv2.imwrite(os.path.join(self.folder, filename), frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+
+        # Only keep the newest snapshots so the SD card does not fill up
+        snapshots = sorted(glob.glob(os.path.join(self.folder, "snapshot_*.jpg")))
+        for old in snapshots[:-self.keep]:
+            os.remove(old)
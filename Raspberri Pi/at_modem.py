@@ -0,0 +1,170 @@
+######## Event-driven AT command driver for the SIM800 #########
+#
+# The old send_at_command wrote a command, slept for a fixed 1-20 s and then read
+# whatever had arrived. Here a reader thread streams the serial port line by
+# line, and a command returns as soon as its final result (OK or ERROR) arrives,
+# or the URC it waits for, such as +HTTPACTION:. The timeout is only a limit, so
+# a modem that answers in milliseconds is done in milliseconds.
+#
+# Lines that arrive while no command is running are unsolicited result codes
+# (URCs). They are kept in urcs and passed to any handler registered for them.
+
+import queue
+import threading
+import time
+from collections import deque
+
+import serial
+
+# Final result codes that end a command
+FINAL_OK = ('OK', 'SHUT OK')
+FINAL_ERROR = ('ERROR', '+CME ERROR', '+CMS ERROR')
+
+# Prompts the modem sends when it waits for data, without a line ending for '>'
+PROMPTS = ('>', 'DOWNLOAD')
+
+class ATResponse:
+    """Result of one AT command.
+
+    status is 'OK', 'ERROR' or 'TIMEOUT'. lines holds everything the modem
+    answered, without the echo. urc is the expected URC line, if one was awaited.
+    """
+    def __init__(self, status, lines, urc=None, elapsed=0.0):
+        self.status = status
+        self.lines = lines
+        self.urc = urc
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.status == 'OK'
+
+    @property
+    def text(self):
+        # Like the response string of the old send_at_command
+        return '\r\n'.join(self.lines)
+
+    def value(self, prefix):
+        # The part after 'prefix:' of the first line starting with it, such as '0,1' of '+CREG: 0,1'
+        for line in self.lines + ([self.urc] if self.urc else []):
+            if line.startswith(prefix):
+                return line[len(prefix):].lstrip(':').strip()
+        return None
+
+    def __repr__(self):
+        return f"ATResponse({self.status!r}, {self.lines!r}, urc={self.urc!r}, elapsed={self.elapsed:.3f})"
+
+class ATModem:
+    """Sends AT commands one at a time and waits only as long as the modem needs.
+
+    serial_port can be any open pyserial port, such as the slave end of a
+    pseudo-terminal simulator, instead of port and baudrate.
+    """
+    def __init__(self, port='/dev/ttyS0', baudrate=115200, serial_port=None, verbose=False):
+        self.serial = serial_port or serial.Serial(port, baudrate, timeout=0.1)
+        self.verbose = verbose
+        self.lines = queue.Queue()
+        self.lock = threading.Lock()      # One command at a time
+        self.active = threading.Event()   # Set while a command waits for its answer
+        self.urcs = deque(maxlen=50)
+        self.urc_handlers = []
+        self.closing = threading.Event()
+        self.thread = threading.Thread(target=self.reader, daemon=True)
+        self.thread.start()
+
+    def on_urc(self, prefix, handler):
+        # Call handler(line) for every unsolicited line starting with prefix
+        self.urc_handlers.append((prefix, handler))
+
+    def reader(self):
+        buffer = b''
+        while not self.closing.is_set():
+            try:
+                data = self.serial.read(self.serial.in_waiting or 1)
+            except (serial.SerialException, OSError):
+                if self.closing.is_set():
+                    break
+                time.sleep(0.1)
+                continue
+            if not data:
+                continue
+            buffer += data
+            while True:
+                end = buffer.find(b'\n')
+                if end < 0:
+                    # A '>' prompt has no line ending
+                    if buffer.strip() == b'>':
+                        self.dispatch('>')
+                        buffer = b''
+                    break
+                line = buffer[:end].strip().decode(errors='replace')
+                buffer = buffer[end + 1:]
+                if line:
+                    self.dispatch(line)
+
+    def dispatch(self, line):
+        if self.verbose:
+            print(f"Modem: {line}")
+        if self.active.is_set():
+            self.lines.put(line)
+            return
+        self.urcs.append((time.time(), line))
+        for prefix, handler in self.urc_handlers:
+            if line.startswith(prefix):
+                handler(line)
+
+    def command(self, command, timeout=5, expect=None, data=None):
+        """Send command and wait for its final result, at most timeout seconds.
+
+        With expect, such as '+HTTPACTION:', the command also waits for the URC
+        starting with it, which the SIM800 sends some time after OK. data is
+        written when the modem prompts for it, as for AT+HTTPDATA.
+        """
+        with self.lock:
+            # Anything still queued belongs to no command
+            while not self.lines.empty():
+                self.urcs.append((time.time(), self.lines.get_nowait()))
+            self.active.set()
+            try:
+                return self.wait_for(command, timeout, expect, data)
+            finally:
+                self.active.clear()
+
+    def wait_for(self, command, timeout, expect, data):
+        if self.verbose:
+            print(f"Sending: {command}")
+        start = time.monotonic()
+        self.serial.write((command + '\r\n').encode())
+        lines = []
+        status = None
+        urc = None
+        while True:
+            remaining = start + timeout - time.monotonic()
+            try:
+                line = self.lines.get(timeout=max(remaining, 0)) if remaining > 0 else self.lines.get_nowait()
+            except queue.Empty:
+                return ATResponse('TIMEOUT', lines, urc, time.monotonic() - start)
+
+            if line == command:
+                continue  # Echo
+            if data is not None and line in PROMPTS:
+                self.serial.write(data)
+                data = None
+                continue
+            if expect is not None and line.startswith(expect):
+                urc = line
+            elif line in FINAL_OK:
+                status = 'OK'
+            elif line.startswith(FINAL_ERROR):
+                lines.append(line)
+                return ATResponse('ERROR', lines, urc, time.monotonic() - start)
+            else:
+                lines.append(line)
+
+            if status is not None and (expect is None or urc is not None):
+                return ATResponse(status, lines, urc, time.monotonic() - start)
+
+    def close(self):
+        self.closing.set()
+        self.thread.join(timeout=1)
+        self.serial.close()
@@ -0,0 +1,65 @@
+######## Benchmark: fixed-sleep AT commands against the event-driven driver #########
+#
+# Runs the AT commands of one sim800_log.py upload (without the power cycle)
+# against the pty SIM800 simulator. The old send_at_command always slept for its
+# delay, so its time is the sum of those delays however fast the modem is.
+# ATModem returns when the answer arrives.
+#
+# Usage: python3 benchmarks/bench_at_driver.py --http_delay 1.5 --bearer_delay 1.0
+
+import argparse
+import os
+import sys
+
+import serial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from at_modem import ATModem
+from fake_sim800 import FakeSIM800
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--delay', help='Seconds the simulated modem takes per answer', default=0.02)
+parser.add_argument('--http_delay', help='Seconds until +HTTPACTION arrives', default=1.5)
+parser.add_argument('--bearer_delay', help='Seconds AT+SAPBR=1,1 takes', default=1.0)
+parser.add_argument('--uploads', help='Uploads to time', default=3)
+args = parser.parse_args()
+
+url = 'https://script.google.com/macros/s/.../exec?date=18/10/2026&time=13:20&value=42'
+
+# (command, delay of the old sim800_log.py, timeout for ATModem, URC to wait for)
+upload = [('AT', 2, 1, None),
+          ('AT+CREG?', 0, 2, None),
+          ('AT+SAPBR=3,1,"CONTYPE","GPRS"', 3, 5, None),
+          ('AT+SAPBR=1,1', 5, 85, None),
+          ('AT+HTTPTERM', 1, 2, None),
+          ('AT+HTTPINIT', 2, 5, None),
+          ('AT+HTTPSSL=1', 1, 2, None),
+          (f'AT+HTTPPARA="URL","{url}"', 2, 2, None),
+          ('AT+HTTPACTION=0', 20, 60, '+HTTPACTION:'),
+          ('AT+HTTPTERM', 1, 2, None),
+          ('AT+SAPBR=0,1', 0, 5, None)]
+
+old_time = sum(delay for _, delay, _, _ in upload)
+
+simulator = FakeSIM800(delay=float(args.delay), http_delay=float(args.http_delay),
+                       bearer_delay=float(args.bearer_delay))
+modem = ATModem(serial_port=serial.Serial(simulator.port, 115200, timeout=0.1))
+
+times = []
+for _ in range(int(args.uploads)):
+    total = 0.0
+    for command, _, timeout, expect in upload:
+        response = modem.command(command, timeout, expect)
+        total += response.elapsed
+        if response.status == 'TIMEOUT':
+            print(f"{command} timed out")
+        if expect is not None:
+            result = response.urc
+    times.append(total)
+    print(f"Upload: {total:.2f} s, {result}")
+
+print(f"Fixed sleeps: {old_time:.1f} s per upload (plus 12 s of power-on sleeps)")
+print(f"ATModem:      {min(times):.2f} s per upload with a {args.http_delay} s HTTP round trip, "
+      f"{old_time / min(times):.0f}x faster")
+modem.close()
+simulator.close()
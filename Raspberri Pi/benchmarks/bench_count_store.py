@@ -0,0 +1,69 @@
+######## Benchmark: range queries on the count store against rescanning the events #########
+#
+# Fills a CountStore with --days of simulated count events and times range
+# queries of an interval, an hour and a day. It compares them with summing a
+# list of the raw events, which is what answering the same question without
+# rollups takes. Checks that both give the same counts, and prints the time per
+# added event, the memory of the store and the size of its file.
+#
+# Usage: python3 benchmarks/bench_count_store.py --days 7 --per_day 5000
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from count_store import CountStore
+from tracker import CountEvent
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--days', help='Days of counts to store', default=7)
+parser.add_argument('--per_day', help='Vehicles counted per day', default=5000)
+parser.add_argument('--classes', help='Classes in the labelmap', default=2)
+args = parser.parse_args()
+
+days = int(args.days)
+num_classes = int(args.classes)
+rng = np.random.default_rng(0)
+start = 1792281600  # A midnight
+times = np.sort(rng.uniform(start, start + days * 86400, days * int(args.per_day)))
+events = [CountEvent(i, int(rng.integers(num_classes)), int(rng.choice((-1, 0, 1))), float(t))
+          for i, t in enumerate(times)]
+
+path = os.path.join(tempfile.mkdtemp(), 'counts.npz')
+store = CountStore(num_classes, path)
+t1 = time.perf_counter()
+store.add_events(events)
+add_us = (time.perf_counter() - t1) / len(events) * 1e6
+t1 = time.perf_counter()
+store.save()
+save_ms = (time.perf_counter() - t1) * 1000
+memory = sum(counts.nbytes for counts in store.counts) + sum(buckets.nbytes for buckets in store.buckets)
+print(f"{len(events)} events: {add_us:.1f} us per add, save {save_ms:.1f} ms, "
+      f"{memory / 1024:.0f} KiB in memory, {os.path.getsize(path) / 1024:.0f} KiB on disk")
+
+last_day = start + (days - 1) * 86400
+for name, length in (('5 minutes', 300), ('1 hour', 3600), ('1 day', 86400)):
+    first = last_day + 12 * 3600 if length < 86400 else last_day
+    repeats = 200
+    t1 = time.perf_counter()
+    for _ in range(repeats):
+        stored = store.interval(first, first + length)
+    store_us = (time.perf_counter() - t1) / repeats * 1e6
+    t1 = time.perf_counter()
+    for _ in range(5):
+        selected = [event for event in events if first <= event.timestamp < first + length]
+        classes, directions = {}, {}
+        for event in selected:
+            classes[event.class_id] = classes.get(event.class_id, 0) + 1
+            if event.direction:
+                directions[event.direction] = directions.get(event.direction, 0) + 1
+        scanned = (len(selected), {'classes': classes, 'directions': directions})
+    scan_us = (time.perf_counter() - t1) / 5 * 1e6
+    assert stored == scanned, (stored, scanned)
+    print(f"{name:9s}: store {store_us:8.1f} us, rescanning the events {scan_us:9.1f} us, "
+          f"{scan_us / store_us:6.1f}x faster, {stored[0]} vehicles")
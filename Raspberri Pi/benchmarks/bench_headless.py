@@ -0,0 +1,72 @@
+######## Benchmark: cost of drawing and display in the detection loop #########
+#
+# Times the per-frame work that --headless removes (boxes, labels, overlays and,
+# when a display is available, cv2.imshow/cv2.waitKey) on a synthetic frame, and
+# turns it into the FPS of the whole loop for a given inference time.
+#
+# Usage: python3 benchmarks/bench_headless.py --detections 10 --invoke_ms 120
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from annotate import draw_detections, draw_overlay, SnapshotWriter
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--resolution', help='Frame size in WxH', default='1280x720')
+parser.add_argument('--detections', help='Detections drawn per frame', default=10)
+parser.add_argument('--invoke_ms', help='Inference time per frame in ms, used to estimate loop FPS', default=120)
+parser.add_argument('--frames', help='Frames to time', default=300)
+parser.add_argument('--snapshotinterval', help='Seconds between snapshots in the headless run', default=60)
+args = parser.parse_args()
+
+resW, resH = args.resolution.split('x')
+imW, imH = int(resW), int(resH)
+num_detections = int(args.detections)
+invoke_time = float(args.invoke_ms) / 1000
+num_frames = int(args.frames)
+show = bool(os.environ.get('DISPLAY'))
+
+rng = np.random.default_rng(0)
+frame = rng.integers(0, 255, (imH, imW, 3), dtype=np.uint8)
+detections = []
+for i in range(num_detections):
+    xmin, ymin = int(rng.integers(0, imW - 200)), int(rng.integers(0, imH - 150))
+    detections.append((xmin, ymin, xmin + 200, ymin + 150, 'car', 0.87))
+
+def time_loop(headless, snapshot_writer=None):
+    start = time.perf_counter()
+    for i in range(num_frames):
+        frame_rgb = frame.copy()  # The loop draws on a fresh frame every time
+        save_snapshot = snapshot_writer is not None and snapshot_writer.due()
+        if not headless or save_snapshot:
+            draw_detections(frame_rgb, detections)
+            draw_overlay(frame_rgb, 42, 7.5)
+            if save_snapshot:
+                snapshot_writer.write(frame_rgb)
+            if not headless and show:
+                cv2.imshow('Benchmark', frame_rgb)
+                cv2.waitKey(1)
+    return (time.perf_counter() - start) / num_frames
+
+# The frame copy is part of both runs so only the rendering differs
+tmp_dir = os.path.join('/tmp', 'bench_headless_snapshots')
+results = {
+    'display': time_loop(headless=False),
+    'headless': time_loop(headless=True),
+    'headless + snapshots': time_loop(headless=True, snapshot_writer=SnapshotWriter(tmp_dir, interval=float(args.snapshotinterval))),
+}
+if show:
+    cv2.destroyAllWindows()
+
+print(f"{imW}x{imH}, {num_detections} detections, imshow {'on' if show else 'off (no DISPLAY)'}, inference {invoke_time * 1000:.0f} ms")
+for name, per_frame in results.items():
+    fps = 1 / (invoke_time + per_frame)
+    print(f"{name:>22}: {per_frame * 1000:7.2f} ms/frame rendering, {fps:6.2f} FPS loop")
+gain = (1 / (invoke_time + results['headless'])) / (1 / (invoke_time + results['display'])) - 1
+print(f"Headless FPS gain: {gain * 100:.1f}%")
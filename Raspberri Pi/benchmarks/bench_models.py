@@ -0,0 +1,285 @@
+######## Benchmark: the detection models side by side #########
+#
+# Runs every model generation in Machine Learning/ (v1 to v5) on the same fixed
+# frame corpus, through the code count_vehicles.py uses: load_interpreter(),
+# Preprocessor and filter_ssd_detections(). An NCNN YOLO model, as run by
+# count_vehicles_yolo.py, can be added with --ncnnparam and --ncnnbin.
+#
+# Every model is measured in its own process, so the peak RSS belongs to that
+# model alone. model_rss_mb is what one loaded and warmed up model adds to the
+# process. For every thread count in --threads, the results hold:
+#   - load and warm-up (first invoke) time
+#   - p50/p95/p99 invoke latency
+#   - throughput of preprocessing, inference and post-processing together
+# Detection agreement is the mean F1 per frame, with boxes matched at IoU 0.5
+# and the same class, of every model against every other one. Everything is
+# written to --output as JSON, so results can be compared across model
+# releases.
+#
+# The corpus is the first --frames frames of --source, a video or a folder of
+# images. Without a source, seeded synthetic road frames are used. Those keep
+# the timings comparable from run to run, but detections on them mean little.
+# edgetpu.tflite models are skipped unless --edgetpu is given and a Coral is
+# attached.
+#
+# Usage: python3 benchmarks/bench_models.py --source clip.mp4 --frames 100 --threads 1,2,4 --output models.json
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from inference_pool import load_interpreter
+from model_registry import output_layout
+from postprocess import decode_yolo, filter_ssd_detections
+from preprocess import Preprocessor
+from tracker import iou_matrix
+
+DEFAULT_MODELS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Machine Learning')
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--models', help='Folder holding the model versions', default=DEFAULT_MODELS)
+parser.add_argument('--versions', help='Comma separated versions, all v* folders if not given', default=None)
+parser.add_argument('--graphs', help='Comma separated .tflite files to run from every version',
+                    default='detect_quant.tflite,edgetpu.tflite')
+parser.add_argument('--edgetpu', help='Run the edgetpu.tflite models on a Coral Edge TPU', action='store_true')
+parser.add_argument('--ncnnparam', help='NCNN .param file of a YOLO model to include', default=None)
+parser.add_argument('--ncnnbin', help='NCNN .bin file of that model', default=None)
+parser.add_argument('--source', help='Video file or folder of images to take the frames from', default=None)
+parser.add_argument('--frames', help='Frames in the corpus', default=50)
+parser.add_argument('--resolution', help='Frame size the corpus is resized to, WxH', default='1280x720')
+parser.add_argument('--threads', help='Comma separated interpreter thread counts', default='1,2,4')
+parser.add_argument('--threshold', help='Minimum confidence of the detections compared', default=0.5)
+parser.add_argument('--output', help='JSON file to write the results to', default='model_benchmark.json')
+parser.add_argument('--worker', help=argparse.SUPPRESS, default=None)
+args = parser.parse_args()
+
+imW, imH = (int(value) for value in args.resolution.split('x'))
+threshold = float(args.threshold)
+
+def tflite_runner(path, threads, use_TPU):
+    interpreter = load_interpreter(path, threads, use_TPU)
+    input_details = interpreter.get_input_details()
+    output_details = interpreter.get_output_details()
+    height, width = input_details[0]['shape'][1:3]
+    preprocessor = Preprocessor(width, height, input_details[0]['dtype'] == np.float32)
+    # The same output order as the counter, read from the graph's post-processing op
+    boxes_idx, classes_idx, scores_idx = output_layout(interpreter, output_details)
+    input_tensor = interpreter.tensor(input_details[0]['index'])
+
+    def preprocess(frame):
+        preprocessor.run(frame, input_tensor())
+
+    def detect():
+        interpreter.invoke()
+
+    def postprocess():
+        outputs = [interpreter.get_tensor(output['index']) for output in output_details]
+        return filter_ssd_detections(outputs[boxes_idx][0], outputs[classes_idx][0], outputs[scores_idx][0],
+                                     threshold, imW, imH)
+    return preprocess, detect, postprocess
+
+def ncnn_runner(param, weights, threads, num_classes, target_size=320):
+    import ncnn
+    net = ncnn.Net()
+    net.opt.num_threads = threads
+    net.load_param(param)
+    net.load_model(weights)
+    preprocessor = Preprocessor(target_size, target_size, letterbox=True)
+    state = {}
+
+    def preprocess(frame):
+        image = preprocessor.run(frame)[0]
+        state['input'] = ncnn.Mat.from_pixels(image, ncnn.Mat.PixelType.PIXEL_RGB, target_size, target_size)
+        state['input'].substract_mean_normalize((0.0, 0.0, 0.0), (1 / 255.0, 1 / 255.0, 1 / 255.0))
+
+    def detect():
+        extractor = net.create_extractor()
+        extractor.input('images', state['input'])
+        state['output'] = extractor.extract('output')[1]
+
+    def postprocess():
+        return decode_yolo(np.array(state['output']), num_classes, threshold, 0.45, preprocessor.frame_size,
+                           preprocessor.scale, preprocessor.pad, output_size=(imW, imH))
+    return preprocess, detect, postprocess
+
+def current_rss():
+    # Resident set size now, in kB (ru_maxrss only gives the peak)
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+
+def measure(spec, corpus):
+    # Runs in the worker process, one model at every thread count
+    results = {'threads': {}}
+    detections = None
+    baseline = current_rss()  # Before any model is loaded
+    loaded = []
+    for threads in spec['threads']:
+        started = time.perf_counter()
+        if spec['kind'] == 'ncnn':
+            preprocess, detect, postprocess = ncnn_runner(spec['param'], spec['bin'], threads, spec['num_classes'])
+        else:
+            preprocess, detect, postprocess = tflite_runner(spec['path'], threads, spec['kind'] == 'edgetpu')
+        loaded.append(detect)  # Kept until the end, so the RSS below covers one model per thread count
+        load_ms = (time.perf_counter() - started) * 1000
+
+        preprocess(corpus[0])
+        started = time.perf_counter()
+        detect()
+        warmup_ms = (time.perf_counter() - started) * 1000
+
+        latencies = []
+        frame_detections = []
+        started = time.perf_counter()
+        for frame in corpus:
+            preprocess(frame)
+            invoked = time.perf_counter()
+            detect()
+            latencies.append((time.perf_counter() - invoked) * 1000)
+            frame_detections.append(postprocess())
+        elapsed = time.perf_counter() - started
+
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        results['threads'][str(threads)] = {'load_ms': round(load_ms, 1), 'warmup_ms': round(warmup_ms, 1),
+                                            'p50_ms': round(p50, 2), 'p95_ms': round(p95, 2), 'p99_ms': round(p99, 2),
+                                            'fps': round(len(corpus) / elapsed, 2)}
+        if detections is None:
+            detections = [[[int(d['xmin']), int(d['ymin']), int(d['xmax']), int(d['ymax']), int(d['class_id']),
+                            round(float(d['score']), 3)] for d in frame] for frame in frame_detections]
+    results['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    results['model_rss_mb'] = round((current_rss() - baseline) / 1024 / len(loaded), 1)
+    results['detections'] = detections
+    return results
+
+def load_corpus(source, count):
+    # Frames resized to --resolution, from a video, a folder of images or a seeded synthetic road
+    frames = []
+    if source and os.path.isdir(source):
+        for path in sorted(glob.glob(os.path.join(source, '*')))[:count]:
+            image = cv2.imread(path)
+            if image is not None:
+                frames.append(cv2.resize(image, (imW, imH)))
+    elif source:
+        capture = cv2.VideoCapture(source)
+        while len(frames) < count:
+            ok, image = capture.read()
+            if not ok:
+                break
+            frames.append(cv2.resize(image, (imW, imH)))
+    else:
+        rng = np.random.default_rng(0)
+        road = cv2.resize(rng.integers(60, 120, (imH // 8, imW // 8, 3), dtype=np.uint8), (imW, imH))
+        for i in range(count):
+            frame = road.copy()
+            for _ in range(int(rng.integers(0, 4))):
+                x, y = int(rng.integers(0, imW - 200)), int(rng.integers(imH // 3, imH - 120))
+                colour = tuple(int(c) for c in rng.integers(0, 255, 3))
+                cv2.rectangle(frame, (x, y), (x + 200, y + 110), colour, -1)
+                cv2.circle(frame, (x + 45, y + 110), 22, (20, 20, 20), -1)
+                cv2.circle(frame, (x + 155, y + 110), 22, (20, 20, 20), -1)
+            frames.append(frame)
+    if not frames:
+        sys.exit(f"No frames could be read from {source}")
+    return np.stack(frames)
+
+def agreement(a, b):
+    # Mean F1 per frame of the detections of two models, frames where neither finds anything agree
+    scores = []
+    for frame_a, frame_b in zip(a, b):
+        if not frame_a and not frame_b:
+            scores.append(1.0)
+            continue
+        if not frame_a or not frame_b:
+            scores.append(0.0)
+            continue
+        boxes_a = np.array([d[:4] for d in frame_a], dtype=np.float32)
+        boxes_b = np.array([d[:4] for d in frame_b], dtype=np.float32)
+        same_class = np.array([d[4] for d in frame_a])[:, None] == np.array([d[4] for d in frame_b])[None, :]
+        overlap = np.where(same_class, iou_matrix(boxes_a, boxes_b), 0)
+        matched = 0
+        while overlap.size and overlap.max() >= 0.5:
+            i, j = np.unravel_index(overlap.argmax(), overlap.shape)
+            overlap[i, :] = 0
+            overlap[:, j] = 0
+            matched += 1
+        scores.append(2 * matched / (len(frame_a) + len(frame_b)))
+    return round(float(np.mean(scores)), 3)
+
+if args.worker:
+    spec = json.loads(args.worker)
+    print(json.dumps(measure(spec, np.load(spec['corpus'], mmap_mode='r'))))
+    sys.exit()
+
+corpus = load_corpus(args.source, int(args.frames))
+corpus_file = os.path.join(tempfile.mkdtemp(), 'corpus.npy')
+np.save(corpus_file, corpus)
+thread_counts = [int(value) for value in args.threads.split(',')]
+
+versions = args.versions.split(',') if args.versions else sorted(
+    os.path.basename(path) for path in glob.glob(os.path.join(args.models, 'v*')) if os.path.isdir(path))
+specs = []
+for version in versions:
+    with open(os.path.join(args.models, version, 'labelmap.txt')) as f:
+        num_classes = len([line for line in f if line.strip()])
+    for graph in args.graphs.split(','):
+        path = os.path.join(args.models, version, graph)
+        if os.path.exists(path):
+            kind = 'edgetpu' if 'edgetpu' in graph else 'tflite'
+            specs.append({'name': f"{version}/{graph}", 'kind': kind, 'path': path, 'num_classes': num_classes})
+if args.ncnnparam:
+    specs.append({'name': os.path.basename(args.ncnnparam), 'kind': 'ncnn', 'param': args.ncnnparam,
+                  'bin': args.ncnnbin, 'num_classes': num_classes})
+
+results = {'host': {'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count(),
+                    'python': platform.python_version(), 'numpy': np.__version__},
+           'corpus': {'source': args.source or 'synthetic', 'frames': len(corpus), 'resolution': args.resolution,
+                      'sha1': hashlib.sha1(corpus.tobytes()).hexdigest()},
+           'threshold': threshold, 'models': {}, 'agreement': {}}
+detections = {}
+for spec in specs:
+    if spec['kind'] == 'edgetpu' and not args.edgetpu:
+        results['models'][spec['name']] = {'skipped': 'Edge TPU model, run with --edgetpu on a Coral'}
+        print(f"{spec['name']:28s}: skipped, Edge TPU model")
+        continue
+    spec.update(corpus=corpus_file, threads=thread_counts)
+    worker = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', json.dumps(spec),
+                             '--resolution', args.resolution, '--threshold', str(threshold)],
+                            capture_output=True, text=True)
+    if worker.returncode != 0:
+        error = (worker.stderr.strip().splitlines() or ['no output'])[-1]
+        results['models'][spec['name']] = {'skipped': error}
+        print(f"{spec['name']:28s}: failed, {error}")
+        continue
+    result = json.loads(worker.stdout.strip().splitlines()[-1])
+    detections[spec['name']] = result.pop('detections')
+    result['detections_per_frame'] = round(sum(map(len, detections[spec['name']])) / len(corpus), 2)
+    results['models'][spec['name']] = result
+    for threads, timing in result['threads'].items():
+        print(f"{spec['name']:28s} {threads:>2s} threads: load {timing['load_ms']:7.1f} ms, warm-up {timing['warmup_ms']:7.1f} ms, "
+              f"p50 {timing['p50_ms']:7.2f} ms, p95 {timing['p95_ms']:7.2f} ms, p99 {timing['p99_ms']:7.2f} ms, "
+              f"{timing['fps']:6.2f} FPS")
+    print(f"{spec['name']:28s}: peak RSS {result['peak_rss_mb']} MB ({result['model_rss_mb']} MB for the model), {result['detections_per_frame']} detections per frame")
+
+names = list(detections)
+for name in names:
+    results['agreement'][name] = {other: agreement(detections[name], detections[other]) for other in names}
+if names:
+    print('Agreement (mean F1 per frame):')
+    print(' ' * 28 + ''.join(f"{other.split('/')[0]:>8s}" for other in names))
+    for name in names:
+        print(f"{name:28s}" + ''.join(f"{results['agreement'][name][other]:8.3f}" for other in names))
+
+with open(args.output, 'w') as f:
+    json.dump(results, f, indent=2)
+print(f"Results written to {args.output}")
@@ -0,0 +1,94 @@
+######## Benchmark: bytes on the wire per day for the GSM upload formats #########
+#
+# One day of 5-minute intervals (288 rows, with per class and per direction
+# counts) sent as:
+#   - one GET per interval with ?date=..&time=..&value=.. (the old scheme, totals only)
+#   - JSON batches as posted by wifi_log.send_batch
+#   - binary batches of payload.py, gzipped when smaller, posted in base64
+# The HTTP request line and headers the SIM800 sends are counted too, and
+# every request of every scheme pays --tls_bytes for a TLS handshake: the SIM800
+# opens a new TLS session for each HTTPACTION. Fewer requests is where batching
+# saves most. Checks that decode_batch() gives the rows back.
+#
+# Usage: python3 benchmarks/bench_payload.py --batch 1,12,48 --classes 2
+
+import argparse
+import base64
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from payload import decode_batch, encode_body
+from transports import sheet_rows
+from wifi_log import UPLOAD_URL, batch_body
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--batch', help='Comma separated intervals per request', default='1,12,48')
+parser.add_argument('--classes', help='Classes counted per row', default=2)
+parser.add_argument('--tls_bytes', help='Bytes of a TLS handshake, paid by every request', default=5000)
+args = parser.parse_args()
+
+num_classes = int(args.classes)
+tls_bytes = int(args.tls_bytes)
+path = UPLOAD_URL.split('script.google.com')[1]
+
+# A day of traffic: busy in the day, quiet at night
+rng = np.random.default_rng(0)
+start = 1792281600  # A midnight
+hours = np.arange(288) / 12
+rate = 2 + 30 * np.exp(-((hours - 8) ** 2) / 4) + 25 * np.exp(-((hours - 17) ** 2) / 5)
+rows = []
+for i in range(288):
+    classes = {c: int(n) for c, n in enumerate(rng.poisson(rate[i] * (0.9 if c == 0 else 0.1 / max(num_classes - 1, 1)))
+                                               for c in range(num_classes))}
+    total = sum(classes.values())
+    forward = int(rng.binomial(total, 0.5))
+    details = {'classes': classes, 'directions': {1: forward, -1: total - forward}}
+    rows.append((f"{rng.integers(1 << 63):032x}", start + 300 * i, total, details))
+
+def headers(method, url, body_length):
+    # What the SIM800 puts on the wire for an HTTPACTION
+    request = f"{method} {url} HTTP/1.1\r\nHost: script.google.com\r\nUser-Agent: SIMCOM_MODULE\r\n"
+    if method == 'POST':
+        request += f"Content-Type: application/json\r\nContent-Length: {body_length}\r\n"
+    return len(request + "\r\n")
+
+def old_scheme():
+    total = 0
+    for key, date, rpi_time, value, _ in sheet_rows(rows):
+        total += headers('GET', f"{path}?date={date}&time={rpi_time}&value={value}", 0) + tls_bytes
+    return total, 288
+
+def json_scheme(batch):
+    total = 0
+    for first in range(0, 288, batch):
+        body = json.dumps(batch_body(sheet_rows(rows[first:first + batch])), separators=(',', ':')).encode()
+        total += headers('POST', path, len(body)) + len(body) + tls_bytes
+    return total, -(-288 // batch)
+
+def binary_scheme(batch):
+    total = 0
+    for first in range(0, 288, batch):
+        chunk = rows[first:first + batch]
+        body = encode_body(chunk, num_classes)
+        decoded = decode_batch(base64.b64decode(body))
+        assert [(r['key'], r['timestamp'], r['total'], r['classes'], r['directions']) for r in decoded] == \
+               [(k, t, v, d['classes'], d['directions']) for k, t, v, d in chunk]
+        total += headers('POST', path, len(body)) + len(body) + tls_bytes
+    return total, -(-288 // batch)
+
+def without_tls(day_bytes, requests):
+    return day_bytes - requests * tls_bytes
+
+old_bytes, old_requests = old_scheme()
+print(f"{'GET per interval (totals only)':34s}: {old_bytes:7d} bytes/day in {old_requests:3d} requests, "
+      f"{without_tls(old_bytes, old_requests):6d} without TLS")
+for batch in (int(value) for value in args.batch.split(',')):
+    for name, scheme in (('JSON', json_scheme), ('binary', binary_scheme)):
+        day_bytes, requests = scheme(batch)
+        print(f"{name + f' batches of {batch}':34s}: {day_bytes:7d} bytes/day in {requests:3d} requests, "
+              f"{old_bytes / day_bytes:5.2f}x less than before, "
+              f"{without_tls(old_bytes, old_requests) / without_tls(day_bytes, requests):5.2f}x without TLS")
@@ -0,0 +1,67 @@
+######## Benchmark: per-index detection loop against postprocess.py #########
+#
+# The loop is the one count_vehicles.py used before postprocess.py. Both are run
+# on the same random SSD outputs for several numbers of candidate boxes.
+#
+# Usage: python3 benchmarks/bench_postprocess.py --candidates 10,100,500,2000
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from postprocess import filter_ssd_detections, label_names
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--candidates', help='Comma separated numbers of candidate boxes', default='10,100,500,2000')
+parser.add_argument('--threshold', help='Minimum confidence threshold', default=0.5)
+parser.add_argument('--repeats', help='Runs to average over', default=200)
+args = parser.parse_args()
+
+min_conf_threshold = float(args.threshold)
+repeats = int(args.repeats)
+imW, imH = 1280, 720
+labels = ['car', 'truck']
+
+def old_loop(boxes, classes, scores):
+    detected_objects = []
+    for i in range(len(scores)):
+        if (scores[i] > min_conf_threshold) and (scores[i] <= 1.0):
+            ymin = int(max(1, (boxes[i][0] * imH)))
+            xmin = int(max(1, (boxes[i][1] * imW)))
+            ymax = int(min(imH, (boxes[i][2] * imH)))
+            xmax = int(min(imW, (boxes[i][3] * imW)))
+            object_name = labels[int(classes[i])]
+            detected_objects.append((xmin, ymin, xmax, ymax, object_name, scores[i]))
+    return detected_objects
+
+def vectorized(boxes, classes, scores):
+    detections = filter_ssd_detections(boxes, classes, scores, min_conf_threshold, imW, imH)
+    return detections, label_names(detections, labels)
+
+def time_it(function, *function_args):
+    start = time.perf_counter()
+    for i in range(repeats):
+        function(*function_args)
+    return (time.perf_counter() - start) / repeats * 1000
+
+rng = np.random.default_rng(0)
+for count in [int(c) for c in args.candidates.split(',')]:
+    corners = np.sort(rng.random((count, 2, 2), dtype=np.float32), axis=1)
+    boxes = corners.reshape(count, 4)  # ymin, xmin, ymax, xmax
+    classes = rng.integers(0, len(labels), count).astype(np.float32)
+    scores = rng.random(count, dtype=np.float32)
+
+    # Both must agree before the timings mean anything
+    old = old_loop(boxes, classes, scores)
+    new, names = vectorized(boxes, classes, scores)
+    assert len(old) == len(new)
+    assert all((o[0], o[1], o[2], o[3], o[4]) == (d['xmin'], d['ymin'], d['xmax'], d['ymax'], n)
+               for o, d, n in zip(old, new, names))
+
+    old_ms = time_it(old_loop, boxes, classes, scores)
+    new_ms = time_it(vectorized, boxes, classes, scores)
+    print(f"{count:5d} candidates: loop {old_ms:7.3f} ms, vectorized {new_ms:6.3f} ms, {old_ms / new_ms:6.1f}x faster")
@@ -0,0 +1,65 @@
+######## Benchmark: frame preprocessing, old path against Preprocessor #########
+#
+# The old path is the one count_vehicles.py used before preprocess.py: copy,
+# cvtColor and resize at full resolution, expand_dims and float normalization.
+#
+# Usage: python3 benchmarks/bench_preprocess.py --resolution 1280x720 --size 320
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from preprocess import Preprocessor
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--resolution', help='Camera frame size in WxH', default='1280x720')
+parser.add_argument('--size', help='Model input width and height', default=320)
+parser.add_argument('--frames', help='Frames to time', default=500)
+args = parser.parse_args()
+
+resW, resH = args.resolution.split('x')
+imW, imH = int(resW), int(resH)
+size = int(args.size)
+num_frames = int(args.frames)
+
+input_mean = 127.5
+input_std = 127.5
+
+frame = np.random.default_rng(0).integers(0, 255, (imH, imW, 3), dtype=np.uint8)
+
+def old_path(floating_model):
+    frame1 = frame.copy()
+    frame_rgb = cv2.cvtColor(frame1, cv2.COLOR_BGR2RGB)
+    frame_resized = cv2.resize(frame_rgb, (size, size))
+    input_data = np.expand_dims(frame_resized, axis=0)
+    if floating_model:
+        input_data = (np.float32(input_data) - input_mean) / input_std
+    return input_data
+
+def time_it(function):
+    function()  # Warm up
+    start = time.perf_counter()
+    for i in range(num_frames):
+        function()
+    return (time.perf_counter() - start) / num_frames * 1000
+
+print(f"{imW}x{imH} -> {size}x{size}, {num_frames} frames")
+for floating_model in (False, True):
+    preprocessor = Preprocessor(size, size, floating_model, input_mean, input_std)
+    # Stands in for the interpreter's input tensor
+    tensor = np.empty((1, size, size, 3), dtype=np.float32 if floating_model else np.uint8)
+
+    if floating_model:
+        error = np.abs(preprocessor.run(frame) - old_path(True)).max()
+    else:
+        error = np.abs(preprocessor.run(frame).astype(int) - old_path(False)).max()
+
+    old_ms = time_it(lambda: old_path(floating_model))
+    new_ms = time_it(lambda: preprocessor.run(frame, tensor))
+    kind = 'float32' if floating_model else 'uint8'
+    print(f"{kind:>8}: old {old_ms:6.3f} ms, fused {new_ms:6.3f} ms, {old_ms / new_ms:5.1f}x faster, max difference {error}")
@@ -0,0 +1,115 @@
+######## Benchmark: flat-out detection loop against RateController over a simulated day #########
+#
+# A day of traffic in simulated time: vehicles arrive at random, many in the rush
+# hours and few at night, and stay in view for a few seconds. A vehicle is
+# counted when the detector runs on it at least --min_hits times while it is in
+# view, like the tracker's min_hits. Every detector run costs --detect_ms of CPU
+# time. The CPU heats up with its load and, at 80 degrees, the firmware throttles it
+# to 60% of its speed, which makes every run slower.
+#
+# The old loop runs the detector flat out, day and night. The controller gets
+# the same measured stage times, temperature and tracked vehicles that
+# count_vehicles.py --adaptive gives it. The benchmark prints the vehicles
+# missed, the share of the day the CPU was busy (which is what the battery pays
+# for), the time spent throttled and the hottest temperature.
+#
+# Usage: python3 benchmarks/bench_rate_control.py --hours 24 --detect_ms 80 --ambient 40
+
+import argparse
+import math
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from rate_control import RateController
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--hours', help='Hours of traffic to simulate', default=24)
+parser.add_argument('--peak_per_minute', help='Vehicles per minute in the rush hours', default=12)
+parser.add_argument('--detect_ms', help='CPU milliseconds of one detector run at full speed', default=80)
+parser.add_argument('--dwell', help='Seconds a vehicle is in view, the shortest and longest', default='1.5,5')
+parser.add_argument('--min_hits', help='Detector runs on a vehicle before it is counted', default=2)
+parser.add_argument('--ambient', help='Degrees inside the enclosure, the CPU heats up 45 degrees above it at full load',
+                    default=40)
+parser.add_argument('--idle_fps', help='Frame rate of the controller on an empty road', default=1)
+args = parser.parse_args()
+
+duration = float(args.hours) * 3600
+detect_cost = float(args.detect_ms) / 1000
+skip_cost = 0.002  # Reading and skipping a frame
+min_hits = int(args.min_hits)
+ambient = float(args.ambient)
+shortest, longest = (float(v) for v in args.dwell.split(','))
+rng = np.random.default_rng(0)
+
+def rate(t):
+    # Vehicles per second: two rush hours on a quiet base, almost nothing at night
+    hour = t / 3600 % 24
+    peaks = math.exp(-((hour - 7.5) / 1.2) ** 2) + math.exp(-((hour - 17) / 1.5) ** 2)
+    base = 0.15 if 6 <= hour <= 21 else 0.01
+    return float(args.peak_per_minute) / 60 * (base + peaks)
+
+# Arrivals by thinning a Poisson process at the peak rate
+arrivals, t = [], 0.0
+peak = float(args.peak_per_minute) / 60 * 1.2
+while t < duration:
+    t += rng.exponential(1 / peak)
+    if rng.random() < rate(t) / peak:
+        arrivals.append((t, t + rng.uniform(shortest, longest)))
+arrivals = np.array([arrival for arrival in arrivals if arrival[1] < duration])
+
+# The CPU temperature the controller reads
+cpu = {}
+
+def simulate(controller):
+    temperature = cpu['temperature'] = ambient + 10
+    busy_time = throttled = 0.0
+    hottest = temperature
+    hits = np.zeros(len(arrivals), dtype=np.int32)
+    first = 0  # Vehicles before this one have left the view
+    items = 0
+    t = 0.0
+    while t < duration:
+        # Vehicles in view, and those the tracker is following
+        while first < len(arrivals) and arrivals[first, 1] < t:
+            first += 1
+        last = np.searchsorted(arrivals[:, 0], t)
+        in_view = np.arange(first, last)[arrivals[first:last, 1] >= t]
+
+        speed = 0.6 if temperature >= 80 else 1.0
+        detect = controller is None or controller.should_detect(items)
+        cost = (detect_cost if detect else skip_cost) / speed
+        if detect:
+            hits[in_view] += 1
+        items += 1
+        busy_time += cost
+
+        if controller is None:
+            step = cost
+        else:
+            controller.update(t + cost, {'inference': (items, busy_time)}, bool(np.any(hits[in_view] > 0)))
+            step = max(cost, 1 / controller.fps)
+
+        # The CPU heats towards its load over about a minute
+        load = cost / step
+        target = ambient + 45 * load
+        temperature += (target - temperature) * (1 - math.exp(-step / 60))
+        cpu['temperature'] = temperature
+        hottest = max(hottest, temperature)
+        if speed < 1:
+            throttled += step
+        t += step
+
+    missed = int(np.sum(hits < min_hits))
+    return missed, busy_time / duration, throttled / duration, hottest
+
+print(f"{len(arrivals)} vehicles in {float(args.hours):.0f} hours, {detect_cost * 1000:.0f} ms per detector run, "
+      f"{ambient:.0f} degrees ambient")
+for name, controller in (('Flat out', None),
+                         ('RateController', RateController(active_fps=10, idle_fps=float(args.idle_fps),
+                                                           temperature=lambda: cpu['temperature']))):
+    missed, busy, throttled, hottest = simulate(controller)
+    print(f"{name:15s}: {missed:5d} missed ({missed / len(arrivals):6.2%}), CPU busy {busy:6.1%}, "
+          f"throttled {throttled:6.1%} of the day, hottest {hottest:.1f} degrees")
@@ -0,0 +1,61 @@
+######## Benchmark: SIM800 setup per upload against a warm session #########
+#
+# Against the pty SIM800 simulator, compares uploads that set up the bearer and
+# HTTP service every time (as sim800_log.py did, apart from its power cycle)
+# with SIM800Modem keeping them open. The last uploads find the bearer dropped
+# by the network, to show that the modem re-attaches and the upload still goes
+# through.
+#
+# Usage: python3 benchmarks/bench_sim800_session.py --uploads 5 --bearer_delay 2
+
+import argparse
+import os
+import sys
+import time
+
+import serial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fake_sim800 import FakeSIM800
+from sim800_modem import SIM800Modem
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--uploads', help='Uploads to time per mode', default=5)
+parser.add_argument('--http_delay', help='Seconds until +HTTPACTION arrives', default=1.5)
+parser.add_argument('--bearer_delay', help='Seconds AT+SAPBR=1,1 takes', default=2.0)
+args = parser.parse_args()
+
+num_uploads = int(args.uploads)
+url = 'https://script.google.com/macros/s/.../exec?date=18/10/2026&time=13:20&value=42'
+
+def run(keep_session):
+    simulator = FakeSIM800(http_delay=float(args.http_delay), bearer_delay=float(args.bearer_delay))
+    modem = SIM800Modem(pwx_pin=None, sleep_mode=0, serial_port=serial.Serial(simulator.port, 115200, timeout=0.1))
+    modem.attach()
+    elapsed = 0.0
+    commands = 0
+    for upload in range(num_uploads):
+        if not keep_session:
+            # Tear down like the old script did after every upload
+            modem.command('AT+HTTPTERM', 2)
+            modem.command('AT+SAPBR=0,1', 5)
+            modem.bearer_open = modem.http_ready = False
+        elif upload == num_uploads - 1:
+            simulator.drop_bearer = True
+        sent = len(simulator.commands)
+        received = len(simulator.requests)
+        start = time.perf_counter()
+        status = modem.request(url)
+        elapsed += time.perf_counter() - start
+        commands += len(simulator.commands) - sent
+        assert status == 200 and len(simulator.requests) == received + 1, status
+    stats = modem.stats()
+    modem.close()
+    simulator.close()
+    return elapsed / num_uploads, commands / num_uploads, stats
+
+for keep_session in (False, True):
+    seconds, commands, stats = run(keep_session)
+    name = 'warm session' if keep_session else 'setup per upload'
+    print(f"{name:16s}: {seconds:5.2f} s and {commands:4.1f} AT commands per upload, {stats['attaches']} attaches")
+print("The old script also slept 12 s for the power cycle before every upload")
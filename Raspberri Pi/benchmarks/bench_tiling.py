@@ -0,0 +1,126 @@
+######## Benchmark: recall and compute of the full frame against road regions and tiles #########
+#
+# Renders 1280x720 road scenes in perspective: vehicles near the horizon are a
+# few pixels high, the ones close to the camera large. A stand-in detector finds
+# a vehicle when it is big enough in the pixels of the model input (--min_pixels
+# for its smaller side), just like a real SSD misses cars that the resize has
+# shrunk to a handful of pixels. Vehicles cut off by a tile edge are found as
+# the part inside the tile. The tiles, their crops and the merge across tiles are
+# the code count_vehicles.py runs with --roi, --tiles and --tileregion. A road
+# region is too wide for one square model input, so it is split in two.
+#
+# Per layout it prints the recall (vehicles found at IoU 0.5), the duplicates
+# and pieces left after merging, the invokes per frame and the milliseconds per frame:
+# the real model's invoke time times the invokes, plus cropping and merging.
+#
+# Usage: python3 benchmarks/bench_tiling.py --frames 200 --model "../Machine Learning/v5/detect_quant.tflite"
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from inference_pool import load_interpreter
+from tiling import Tiler, make_tiles
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--frames', help='Number of scenes to render', default=200)
+parser.add_argument('--vehicles', help='Vehicles per scene', default=8)
+parser.add_argument('--min_pixels', help='Smallest side in model input pixels the stand-in detector finds', default=8)
+parser.add_argument('--model', help='TFLite model to time one invoke of, 300 ms (a Pi 4 at 320x320) if not given',
+                    default=None)
+args = parser.parse_args()
+
+frame_width, frame_height = 1280, 720
+model_size = (320, 320)
+min_pixels = float(args.min_pixels)
+horizon, bottom = 260, 620  # The road in the frame, the rest is sky and verges
+rng = np.random.default_rng(0)
+
+def iou(box, boxes):
+    width = np.clip(np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0]), 0, None)
+    height = np.clip(np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1]), 0, None)
+    intersection = width * height
+    areas = (box[2] - box[0]) * (box[3] - box[1]) + (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return intersection / (areas - intersection)
+
+def render():
+    # Vehicles sized by their distance: a car at the horizon is 6 pixels high, at the bottom 120
+    frame = np.full((frame_height, frame_width, 3), 90, dtype=np.uint8)
+    frame[:horizon] = (200, 170, 140)
+    truth = []
+    while len(truth) < int(args.vehicles):
+        y = horizon + (bottom - horizon) * rng.random() ** 1.5
+        depth = (y - horizon) / (bottom - horizon)
+        height = 6 + 114 * depth
+        width = height * rng.uniform(1.4, 2.2)
+        x = rng.uniform(0, frame_width - width)
+        box = (x, y - height, x + width, y)
+        # Every vehicle in full view, one that would hide another is left out
+        if truth and iou(box, np.array(truth)).max() > 0:
+            continue
+        cv2.rectangle(frame, (int(box[0]), int(box[1])), (int(box[2]), int(box[3])), (40, 40, 160), -1)
+        truth.append(box)
+    return frame, np.array(truth)
+
+def detect(truth, tile):
+    # Stand-in SSD outputs for one tile: boxes normalized to the tile, [ymin, xmin, ymax, xmax]
+    x1, y1, x2, y2 = tile[0] * frame_width, tile[1] * frame_height, tile[2] * frame_width, tile[3] * frame_height
+    seen = np.stack([np.maximum(truth[:, 0], x1), np.maximum(truth[:, 1], y1),
+                     np.minimum(truth[:, 2], x2), np.minimum(truth[:, 3], y2)], axis=1)
+    inside = (seen[:, 2] > seen[:, 0]) & (seen[:, 3] > seen[:, 1])
+    # Size in model pixels: the tile is resized to the model input on both axes
+    scale_x, scale_y = model_size[0] / (x2 - x1), model_size[1] / (y2 - y1)
+    found = inside & (np.minimum((seen[:, 2] - seen[:, 0]) * scale_x, (seen[:, 3] - seen[:, 1]) * scale_y) >= min_pixels)
+    seen = seen[found]
+    boxes = np.stack([(seen[:, 1] - y1) / (y2 - y1), (seen[:, 0] - x1) / (x2 - x1),
+                      (seen[:, 3] - y1) / (y2 - y1), (seen[:, 2] - x1) / (x2 - x1)], axis=1).astype(np.float32)
+    return boxes, np.zeros(len(boxes), dtype=np.float32), np.full(len(boxes), 0.9, dtype=np.float32)
+
+if args.model:
+    interpreter = load_interpreter(args.model)
+    details = interpreter.get_input_details()[0]
+    interpreter.set_tensor(details['index'], np.zeros(details['shape'], details['dtype']))
+    interpreter.invoke()
+    started = time.perf_counter()
+    for _ in range(5):
+        interpreter.invoke()
+    invoke_ms = (time.perf_counter() - started) / 5 * 1000
+else:
+    invoke_ms = 300.0
+print(f"Invoke: {invoke_ms:.0f} ms, stand-in detector finds vehicles of {min_pixels:.0f} model pixels and more")
+
+road = [(0, horizon - 40, frame_width, bottom + 20)]
+halves = [(0, horizon - 40, 660, bottom + 20), (620, horizon - 40, frame_width, bottom + 20)]
+layouts = [('Full frame, squashed', [(0, 0, 1, 1)]),
+           ('Road region', make_tiles(road, (frame_width, frame_height), model_size, overlap=0.15)),
+           ('Road in 2 regions', make_tiles(halves, (frame_width, frame_height), model_size, overlap=0.15)),
+           ('Frame in 2x1 tiles', make_tiles([], (frame_width, frame_height), model_size, 2, 1, 0.15)),
+           ('Road in 3x1 tiles', make_tiles(road, (frame_width, frame_height), model_size, 3, 1, 0.15)),
+           ('Road in 3x1 + region', make_tiles(road, (frame_width, frame_height), model_size, 3, 1, 0.15,
+                                               region_pass=True)),
+           ('Road in 4x2 tiles', make_tiles(road, (frame_width, frame_height), model_size, 4, 2, 0.15))]
+
+scenes = [render() for _ in range(int(args.frames))]
+for name, tiles in layouts:
+    tiler = Tiler(tiles, *model_size)
+    found = duplicates = total = 0
+    tiler_time = 0.0
+    for frame, truth in scenes:
+        started = time.perf_counter()
+        tiler.run(frame)
+        boxes, classes, scores = tiler.merge([detect(truth, tile) for tile in tiler.tiles], 0.5)
+        tiler_time += time.perf_counter() - started
+
+        # Back to pixels, [x1, y1, x2, y2]
+        detected = boxes[:, [1, 0, 3, 2]] * [frame_width, frame_height, frame_width, frame_height]
+        found += sum(len(detected) and iou(box, detected).max() >= 0.5 for box in truth)
+        duplicates += sum(iou(box, truth).max() < 0.5 for box in detected)
+        total += len(truth)
+    ms = invoke_ms * len(tiles) + tiler_time / len(scenes) * 1000
+    print(f"{name:22s}: recall {found / total:6.1%}, {duplicates / len(scenes):4.2f} wrong boxes per frame, "
+          f"{len(tiles)} invokes, {ms:6.0f} ms per frame")
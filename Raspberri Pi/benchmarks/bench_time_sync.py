@@ -0,0 +1,134 @@
+######## Benchmark: blocking time setup against ClockSync #########
+#
+# Local stand-ins for the time sources, all running --skew seconds ahead of this
+# machine:
+#   - an SNTP server
+#   - a worldtimeapi.org lookalike that answers after --http_delay
+#   - a web server whose only time is its Date header
+#   - a "dead" server that accepts connections and never answers, like
+#     worldtimeapi.org on a bad day
+#   - the SIM800 simulator, whose AT+CCLK? clock is --skew ahead as well
+#
+# The old way tries one source after the other, each until it answers or times
+# out. wifi_setup.py had no timeout at all, so a dead server there blocked the
+# counter for good. ClockSync asks all sources at once. The benchmark prints
+# how long each way takes until the counter can start, and how far the
+# measured offset is from the skew.
+#
+# Usage: python3 benchmarks/bench_time_sync.py --skew 3600 --http_delay 0.3
+
+import argparse
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import serial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fake_sim800 import FakeSIM800
+from sim800_modem import SIM800Modem
+from time_sync import NTP_EPOCH, ClockSync, http_date_time, modem_time, ntp_time, worldtime_time
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--skew', help='Seconds the time sources are ahead of this machine', default=3600)
+parser.add_argument('--http_delay', help='Seconds the worldtimeapi stand-in takes to answer', default=0.3)
+parser.add_argument('--timeout', help='Seconds the old way waits for each source', default=5)
+args = parser.parse_args()
+
+skew = float(args.skew)
+http_delay = float(args.http_delay)
+timeout = float(args.timeout)
+
+def serve_ntp(sock):
+    while True:
+        data, address = sock.recvfrom(48)
+        received = time.time() + skew + NTP_EPOCH
+        sent = time.time() + skew + NTP_EPOCH
+        answer = bytearray(48)
+        answer[0], answer[1] = 0x1c, 2  # Version 3, server, stratum 2
+        answer[32:48] = struct.pack('!IIII', int(received), int(received % 1 * 2 ** 32),
+                                    int(sent), int(sent % 1 * 2 ** 32))
+        sock.sendto(bytes(answer), address)
+
+class TimeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def answer(self, body=b''):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/dead':
+            time.sleep(3600)
+        time.sleep(http_delay)
+        now = datetime.fromtimestamp(time.time() + skew, timezone.utc)
+        self.answer(json.dumps({'datetime': now.isoformat()}).encode())
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Date', formatdate(time.time() + skew, usegmt=True))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def date_time_string(self, timestamp=None):
+        return formatdate(time.time() + skew, usegmt=True)
+
+    def log_message(self, *args):
+        pass
+
+ntp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+ntp_socket.bind(('127.0.0.1', 0))
+threading.Thread(target=serve_ntp, args=(ntp_socket,), daemon=True).start()
+ntp_port = ntp_socket.getsockname()[1]
+
+server = ThreadingHTTPServer(('127.0.0.1', 0), TimeHandler)
+server.daemon_threads = True
+threading.Thread(target=server.serve_forever, daemon=True).start()
+base = f"http://127.0.0.1:{server.server_address[1]}"
+
+simulator = FakeSIM800()
+simulator.clock_skew = skew
+modem = SIM800Modem(pwx_pin=None, sleep_mode=0, serial_port=serial.Serial(simulator.port, 115200, timeout=0.1))
+
+sources = [('worldtimeapi (dead)', lambda: worldtime_time(f"{base}/dead", timeout=timeout)),
+           ('worldtimeapi', lambda: worldtime_time(f"{base}/api/ip", timeout=timeout)),
+           ('http_date', lambda: http_date_time(base, timeout=timeout)),
+           ('ntp', lambda: ntp_time('127.0.0.1', timeout=timeout, port=ntp_port)),
+           ('sim800', lambda: modem_time(modem))]
+
+def error_ms(offset):
+    return abs(offset - (time.time() - time.monotonic() + skew)) * 1000
+
+# Old way: the sources in order of preference, each until it answers or times out
+started = time.monotonic()
+for name, source in sources:
+    try:
+        sample = source()
+        break
+    except Exception:
+        continue
+print(f"One after the other: {time.monotonic() - started:6.2f} s until the counter can start, "
+      f"{sample.source}, off by {error_ms(sample.offset):6.1f} ms")
+
+started = time.monotonic()
+clock = ClockSync(sources)
+clock.wait()
+first = time.monotonic() - started
+first_source, first_offset = clock.best.source, clock.best.offset
+print(f"ClockSync          : {first:6.2f} s until the counter can start, "
+      f"{first_source}, off by {error_ms(first_offset):6.1f} ms")
+time.sleep(max(http_delay, 1) + 0.5)
+print(f"ClockSync settled  : {clock.best.source}, off by {error_ms(clock.offset()):6.1f} ms, "
+      f"uncertainty {clock.best.uncertainty * 1000:.1f} ms, system clock error {clock.stats()['system_clock_error']} s")
+print("Sources that failed:", clock.failures or 'none', "(the dead one is still waiting for its timeout)")
+simulator.close()
@@ -0,0 +1,49 @@
+######## Benchmark: tracker cost per frame #########
+#
+# Moves a number of synthetic vehicles across the frame, with some detections
+# missing now and then, and times IoUTracker.update() per frame.
+#
+# Usage: python3 benchmarks/bench_tracker.py --objects 30
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from postprocess import make_detections
+from tracker import IoUTracker
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--objects', help='Vehicles in view at the same time', default=30)
+parser.add_argument('--frames', help='Frames to time', default=1000)
+parser.add_argument('--missrate', help='Chance that a vehicle is not detected in a frame', default=0.1)
+args = parser.parse_args()
+
+num_objects = int(args.objects)
+num_frames = int(args.frames)
+miss_rate = float(args.missrate)
+imW, imH = 1280, 720
+
+rng = np.random.default_rng(0)
+positions = np.stack([rng.uniform(0, imW, num_objects), rng.uniform(0, imH - 60, num_objects)], axis=1)
+speeds = rng.uniform(2, 8, num_objects)
+
+tracker = IoUTracker(line=((imW / 2, 0), (imW / 2, imH)))
+elapsed = 0
+for frame in range(num_frames):
+    # Vehicles wrap around so the number in view stays the same
+    x = (positions[:, 0] + speeds * frame) % imW
+    y = positions[:, 1]
+    seen = rng.random(num_objects) > miss_rate
+    detections = make_detections(x[seen], y[seen], x[seen] + 80, y[seen] + 50,
+                                 np.ones(seen.sum()), np.zeros(seen.sum()))
+
+    start = time.perf_counter()
+    tracker.update(detections, frame)
+    elapsed += time.perf_counter() - start
+
+print(f"{num_objects} objects, {num_frames} frames: {elapsed / num_frames * 1000:.3f} ms per frame, "
+      f"{len(tracker)} tracks, {tracker.total_count} counted")
@@ -0,0 +1,88 @@
+######## Benchmark: WiFi/GSM failover of the upload transports #########
+#
+# Sends a batch every --interval seconds through a TransportRouter holding a
+# WiFiTransport (to a local stand-in for the Apps Script) and a SIM800Transport
+# (to the pty SIM800 simulator). Halfway through, WiFi goes down for a while:
+# the batches fail over to GSM and go back to WiFi once a probe finds it up
+# again. Prints the link every batch took and the per-transport statistics.
+#
+# Usage: python3 benchmarks/bench_transports.py --batches 30 --outage 10,20
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import serial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fake_sim800 import FakeSIM800
+from sim800_modem import SIM800Modem
+from transports import SIM800Transport, TransportError, TransportRouter, WiFiTransport
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Acknowledges the keys of the rows like google_sheet.gs
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    down = False
+    rows = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if StandInHandler.down:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        StandInHandler.rows += len(body['rows'])
+        answer = json.dumps({'ok': True, 'keys': [row['key'] for row in body['rows']]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+    def log_message(self, *args):
+        pass
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--batches', help='Batches to send', default=30)
+parser.add_argument('--outage', help='First and last batch during which WiFi is down', default='10,20')
+parser.add_argument('--interval', help='Seconds between batches', default=0.05)
+parser.add_argument('--http_delay', help='Seconds the simulated GSM request takes', default=0.3)
+parser.add_argument('--payload', help='GSM payload, json or binary', default='binary')
+args = parser.parse_args()
+
+outage_start, outage_end = (int(value) for value in args.outage.split(','))
+
+server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+url = f"http://127.0.0.1:{server.server_address[1]}/exec"
+
+simulator = FakeSIM800(http_delay=float(args.http_delay), bearer_delay=0.2)
+modem = SIM800Modem(pwx_pin=None, sleep_mode=0, serial_port=serial.Serial(simulator.port, 115200, timeout=0.1))
+router = TransportRouter([WiFiTransport(url), SIM800Transport(modem, url, payload=args.payload, num_classes=2)], probe_interval=0.2)
+
+links = []
+for batch in range(int(args.batches)):
+    StandInHandler.down = outage_start <= batch < outage_end
+    rows = [(f"{batch}-{i}", int(time.time()) + 300 * (3 * batch + i), i, None) for i in range(3)]
+    try:
+        links.append(router.send(rows))
+    except TransportError:
+        links.append('lost')
+    time.sleep(float(args.interval))
+
+print(' '.join(link[0].upper() for link in links), '(W = WiFi, G = GSM, L = lost)')
+print(f"Rows at the stand-in over WiFi: {StandInHandler.rows}, over GSM: {3 * len(simulator.requests)}, "
+      f"failovers: {router.failovers}")
+for name, stats in router.stats().items():
+    if isinstance(stats, dict):
+        print(f"{name:5s}: success rate {stats['success_rate']:.2f}, p50 {stats['p50_ms']:.1f} ms, "
+              f"p95 {stats['p95_ms']:.1f} ms, p99 {stats['p99_ms']:.1f} ms")
+router.close()
+simulator.close()
+server.shutdown()
@@ -0,0 +1,179 @@
+######## Benchmark: upload subprocess against the in-process Uploader #########
+#
+# Both paths send counts to a local stand-in for the Apps Script endpoint, which
+# records every row it gets. The old path starts python3 for every upload like
+# count_vehicles.py did (new interpreter, requests import, `date` shell and a new
+# connection); the Uploader reuses one thread and one kept-alive connection.
+#
+# --outage fails that many requests to the stand-in while counts keep coming, like
+# a WiFi outage. The outbox holds them and the Uploader replays them in batches,
+# and the stand-in checks that every count arrives exactly once.
+#
+# Usage: python3 benchmarks/bench_uploader.py --uploads 20 --outage 5
+#        python3 benchmarks/bench_uploader.py --serve 8080   (stand-in only, for --uploadurl)
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+pi_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, pi_folder)
+from uploader import Uploader
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Answers like google_sheet.gs and keeps the rows it was sent, rows are
+    # deduplicated by key and the answer lists the keys that are stored. A
+    # failed request gets a 503 or, like a script error in Apps Script, an
+    # error page with status 200.
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    rows = []
+    keys = set()
+    duplicates = 0
+    requests = 0
+    fail_next = 0
+    error_pages = 0
+    connections = set()
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        self.store([{key: values[0] for key, values in query.items()}])
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.store(body['rows'])
+
+    def store(self, rows):
+        if StandInHandler.fail_next > 0:
+            StandInHandler.fail_next -= 1
+            if StandInHandler.fail_next % 2:
+                StandInHandler.error_pages += 1
+                self.reply(200, b'<html><body>TypeError: Cannot read properties of undefined</body></html>',
+                           'text/html')
+            else:
+                self.reply(503, b'Unavailable', 'text/plain')
+            return
+        for row in rows:
+            if row.get('key') in self.keys:
+                StandInHandler.duplicates += 1
+                continue
+            self.keys.add(row.get('key'))
+            self.rows.append(row)
+        answer = {'ok': True, 'keys': [row.get('key', '') for row in rows]}
+        self.reply(200, json.dumps(answer).encode(), 'application/json')
+
+    def reply(self, status, body, content_type):
+        StandInHandler.requests += 1
+        self.connections.add(self.client_address)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--uploads', help='Uploads to time per path', default=20)
+parser.add_argument('--outage', help='Requests the stand-in fails during the outage run', default=5)
+parser.add_argument('--serve', help='Only run the stand-in on this port and print the rows it gets', default=None)
+args = parser.parse_args()
+
+if args.serve:
+    server = ThreadingHTTPServer(('', int(args.serve)), StandInHandler)
+    print(f"Stand-in listening on http://localhost:{args.serve}/exec")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        seen = 0
+        while True:
+            time.sleep(1)
+            for row in StandInHandler.rows[seen:]:
+                print(row)
+            seen = len(StandInHandler.rows)
+    except KeyboardInterrupt:
+        server.shutdown()
+    sys.exit()
+
+server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+url = f"http://127.0.0.1:{server.server_address[1]}/exec"
+num_uploads = int(args.uploads)
+
+# The old upload: a new python3 per count, `date` in a shell and a new connection
+old_script = f"""
+import subprocess, sys
+sys.path.insert(0, {pi_folder!r})
+from wifi_log import send_http_request
+current_time = subprocess.check_output("date +'%d/%m/%Y %H:%M'", shell=True).decode().strip()
+date, rpi_time = current_time.split(" ")
+send_http_request(int(sys.argv[1]), date, rpi_time, url={url!r})
+"""
+
+def time_subprocess():
+    cpu_start = os.times()
+    start = time.perf_counter()
+    for count in range(num_uploads):
+        subprocess.run([sys.executable, '-c', old_script, str(count)], check=True)
+    elapsed = time.perf_counter() - start
+    cpu_end = os.times()
+    cpu = (cpu_end.children_user + cpu_end.children_system) - (cpu_start.children_user + cpu_start.children_system)
+    return elapsed, cpu
+
+def time_uploader():
+    uploader = Uploader(url, os.path.join(temp_folder, 'outbox_timed.db'))
+    cpu_start = os.times()
+    start = time.perf_counter()
+    for count in range(num_uploads):
+        uploader.submit(count)
+        # One at a time, like one upload every 5 minutes
+        while uploader.stats()['sent'] + uploader.stats()['failed'] <= count:
+            time.sleep(0.0005)
+    elapsed = time.perf_counter() - start
+    cpu_end = os.times()
+    stats = uploader.stats()
+    uploader.close()
+    cpu = (cpu_end.user + cpu_end.system) - (cpu_start.user + cpu_start.system)
+    return elapsed, cpu, stats
+
+def run_outage():
+    # Counts keep coming while the stand-in fails, then the link comes back
+    uploader = Uploader(url, os.path.join(temp_folder, 'outbox_outage.db'), retry_min=0.05, retry_max=0.4)
+    StandInHandler.fail_next = int(args.outage)
+    first_row = len(StandInHandler.rows)
+    for count in range(num_uploads):
+        uploader.submit(1000 + count)
+        time.sleep(0.02)
+    peak = uploader.stats()
+    while uploader.stats()['pending']:
+        time.sleep(0.01)
+    stats = uploader.stats()
+    uploader.close()
+    received = [int(row['value']) for row in StandInHandler.rows[first_row:]]
+    return peak, stats, received
+
+temp_folder = tempfile.mkdtemp()
+
+elapsed, cpu = time_subprocess()
+print(f"subprocess: {elapsed / num_uploads * 1000:7.1f} ms and {cpu / num_uploads * 1000:6.1f} ms CPU per upload")
+
+StandInHandler.connections.clear()
+elapsed, cpu, stats = time_uploader()
+print(f"Uploader:   {elapsed / num_uploads * 1000:7.1f} ms and {cpu / num_uploads * 1000:6.1f} ms CPU per upload, "
+      f"{len(StandInHandler.connections)} connection(s), {stats['failed']} failed")
+print(f"Rows received by the stand-in: {len(StandInHandler.rows)}, last {StandInHandler.rows[-1]}")
+
+peak, stats, received = run_outage()
+print(f"Outage: {args.outage} failed requests ({StandInHandler.error_pages} error pages with status 200), at most {peak['pending']} counts pending "
+      f"(oldest {peak['oldest_pending_age']:.2f} s), replayed in {stats['batches']} batches at "
+      f"{stats['rows_per_second']:.0f} rows/s")
+exactly_once = sorted(received) == list(range(1000, 1000 + num_uploads))
+print(f"Every count received exactly once: {exactly_once}, duplicates dropped by key: {StandInHandler.duplicates}")
+server.shutdown()
@@ -0,0 +1,176 @@
+######## SIM800 simulator on a pseudo-terminal #########
+#
+# Answers the AT commands the Pi scripts use, with configurable delays, on the
+# master end of a pty. Open the slave end (FakeSIM800.port) with pyserial, or
+# hand ATModem an open port, to run the modem code without a modem:
+#
+#   modem = FakeSIM800(http_delay=1.5)
+#   at = ATModem(serial_port=serial.Serial(modem.port, 115200, timeout=0.1))
+
+import base64
+import json
+import os
+import re
+import threading
+import time
+import tty
+from urllib.parse import parse_qs, urlparse
+
+from payload import decode_batch
+
+class FakeSIM800:
+    """Simulated modem. delay is the time per answer, http_delay the time until
+    +HTTPACTION arrives and bearer_delay the time AT+SAPBR=1,1 takes.
+
+    requests keeps (method, url, body) of every HTTPACTION, bytes_in the bytes
+    the Pi sent to the modem. Like Apps Script, a POST is answered with a 302
+    unless AT+HTTPPARA="REDIR",1 has the module follow it, and the answer that
+    AT+HTTPREAD gives lists the keys of the rows, as google_sheet.gs does.
+    """
+    def __init__(self, delay=0.02, http_delay=1.5, bearer_delay=1.0, echo=True):
+        self.delay = delay
+        self.http_delay = http_delay
+        self.bearer_delay = bearer_delay
+        self.echo = echo
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self.slave = slave
+
+        self.url = None
+        self.data = b''
+        self.bearer_open = False
+        self.http_open = False
+        self.sleep_mode = 0
+        self.redirect = False
+        self.answer = ''
+        self.requests = []
+        self.bytes_in = 0
+        self.commands = []
+        self.fail_http = 0          # Next HTTPACTIONs that answer 601 (network error)
+        self.drop_bearer = False    # Next HTTPACTION finds the bearer gone
+        self.clock_skew = 0         # Seconds the network time of AT+CCLK? is ahead
+
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def send(self, text):
+        os.write(self.master, text.encode())
+
+    def reply(self, *lines, delay=None):
+        time.sleep(self.delay if delay is None else delay)
+        self.send(''.join(f"\r\n{line}\r\n" for line in lines))
+
+    def read_bytes(self, count):
+        data = b''
+        while len(data) < count:
+            chunk = os.read(self.master, count - len(data))
+            self.bytes_in += len(chunk)
+            data += chunk
+        return data
+
+    def serve(self):
+        buffer = b''
+        while self.running:
+            try:
+                chunk = os.read(self.master, 1024)
+            except OSError:
+                break
+            self.bytes_in += len(chunk)
+            buffer += chunk
+            while b'\r' in buffer:
+                line, _, buffer = buffer.partition(b'\r')
+                buffer = buffer.lstrip(b'\n')
+                command = line.decode(errors='replace').strip()
+                if command:
+                    buffer = self.handle(command, buffer)
+
+    def handle(self, command, buffer):
+        self.commands.append(command)
+        if self.echo:
+            self.send(command + '\r\n')
+        if command == 'ATE0':
+            self.echo = False
+            self.reply('OK')
+        elif command in ('AT', 'AT+HTTPSSL=1', 'AT+CFUN=1') or command.startswith('AT+SAPBR=3,'):
+            self.reply('OK')
+        elif command == 'AT+CREG?':
+            self.reply('+CREG: 0,1', 'OK')
+        elif command == 'AT+CSQ':
+            self.reply('+CSQ: 18,0', 'OK')
+        elif command == 'AT+CCLK?':
+            now = time.gmtime(time.time() + self.clock_skew)
+            self.reply(time.strftime('+CCLK: "%y/%m/%d,%H:%M:%S+00"', now), 'OK')
+        elif command == 'AT+SAPBR=1,1':
+            self.bearer_open = True
+            self.reply('OK', delay=self.bearer_delay)
+        elif command == 'AT+SAPBR=0,1':
+            self.bearer_open = False
+            self.reply('OK')
+        elif command == 'AT+SAPBR=2,1':
+            self.reply('+SAPBR: 1,1,"10.0.0.2"' if self.bearer_open else '+SAPBR: 1,3,"0.0.0.0"', 'OK')
+        elif command == 'AT+HTTPINIT':
+            if self.http_open:
+                self.reply('ERROR')
+            else:
+                self.http_open = True
+                self.reply('OK')
+        elif command == 'AT+HTTPTERM':
+            was_open, self.http_open = self.http_open, False
+            self.reply('OK' if was_open else 'ERROR')
+        elif command.startswith('AT+HTTPPARA='):
+            match = re.match(r'AT\+HTTPPARA="(\w+)","?(.*?)"?$', command)
+            if match and match.group(1) == 'URL':
+                self.url = match.group(2)
+            if match and match.group(1) == 'REDIR':
+                self.redirect = match.group(2) == '1'
+            self.reply('OK' if self.http_open else 'ERROR')
+        elif command.startswith('AT+HTTPDATA='):
+            size = int(command.split('=')[1].split(',')[0])
+            self.reply('DOWNLOAD')
+            self.data = buffer + self.read_bytes(max(size - len(buffer), 0))
+            buffer, self.data = self.data[size:], self.data[:size]
+            self.reply('OK')
+        elif command.startswith('AT+HTTPACTION='):
+            self.http_action(int(command.split('=')[1]))
+        elif command == 'AT+HTTPREAD':
+            self.reply(f'+HTTPREAD: {len(self.answer)}', self.answer, 'OK')
+        elif command.startswith('AT+CSCLK='):
+            self.sleep_mode = int(command.split('=')[1])
+            self.reply('OK')
+        else:
+            self.reply('ERROR')
+        return buffer
+
+    def http_action(self, method):
+        if not self.http_open:
+            self.reply('ERROR')
+            return
+        self.reply('OK')
+        if self.drop_bearer:
+            self.drop_bearer = False
+            self.bearer_open = False
+        if not self.bearer_open or self.fail_http > 0:
+            self.fail_http = max(self.fail_http - 1, 0)
+            self.reply(f'+HTTPACTION: {method},601,0', delay=self.http_delay)
+            return
+        self.requests.append(('GET' if method == 0 else 'POST', self.url, self.data if method == 1 else None))
+        if method == 1 and not self.redirect:
+            self.reply(f'+HTTPACTION: {method},302,0', delay=self.http_delay)
+            return
+        self.answer = json.dumps({'ok': True, 'keys': self.keys(method)})
+        self.reply(f'+HTTPACTION: {method},200,{len(self.answer)}', delay=self.http_delay)
+
+    def keys(self, method):
+        # The row keys of the request
+        if method == 0:
+            return parse_qs(urlparse(self.url).query).get('key', [''])
+        if self.data.startswith(b'{'):
+            return [row['key'] for row in json.loads(self.data)['rows']]
+        return [row['key'] for row in decode_batch(base64.b64decode(self.data))]
+
+    def close(self):
+        self.running = False
+        os.close(self.master)
+        os.close(self.slave)
@@ -0,0 +1,129 @@
+######## Time-bucketed vehicle counts #########
+#
+# Only one number per 5-minute interval used to be kept, and it was gone once
+# uploaded. CountStore keeps the counts per second, per class (the labelmap
+# index) and per direction. It rolls them up to 1-minute, 5-minute and hourly
+# buckets, so any later question about the traffic, such as an hour or a day,
+# reads a few slots instead of going over the events again. The events of every
+# closed interval are added here, late ones at the edge of the interval they
+# are uploaded with, and the interval upload is read back with interval().
+#
+# Every level is a fixed ring of numpy count arrays, so memory and the file on
+# disk stay the same size however long the counter runs. Older buckets are
+# overwritten as time goes on.
+
+import os
+import threading
+
+import numpy as np
+
+DIRECTIONS = (-1, 0, 1)  # CountEvent directions, 0 for vehicles counted leaving the zone
+
+# (seconds per bucket, buckets kept): an hour of seconds, a day of minutes,
+# a week of 5-minute intervals and 90 days of hours
+LEVELS = ((1, 3600), (60, 24 * 60), (300, 7 * 288), (3600, 90 * 24))
+
+class CountStore:
+    """Vehicle counts per time bucket, class and direction, at every resolution in levels.
+
+    add() updates all levels at once, so the rollups are always current.
+    query() and interval() sum the buckets of the coarsest level that matches
+    the range, and series() returns one row per bucket. Timestamps are wall
+    clock seconds. With a path the store is reloaded at start and written back
+    by save().
+    """
+    def __init__(self, num_classes, path=None, levels=LEVELS):
+        self.num_classes = max(num_classes, 1)
+        self.path = path
+        self.lock = threading.Lock()
+        self.resolutions = [resolution for resolution, _ in levels]
+        # counts[level][slot, class, direction], buckets[level][slot] is the bucket a slot holds, -1 if none
+        self.counts = [np.zeros((size, self.num_classes, len(DIRECTIONS)), dtype=np.int32) for _, size in levels]
+        self.buckets = [np.full(size, -1, dtype=np.int64) for _, size in levels]
+        if path and os.path.exists(path):
+            self.load()
+
+    def add(self, timestamp, class_id, direction, count=1):
+        if not 0 <= class_id < self.num_classes:
+            return
+        with self.lock:
+            for resolution, counts, buckets in zip(self.resolutions, self.counts, self.buckets):
+                bucket = int(timestamp // resolution)
+                slot = bucket % len(buckets)
+                if buckets[slot] != bucket:
+                    # The slot still holds a bucket that has dropped out of the history
+                    counts[slot] = 0
+                    buckets[slot] = bucket
+                counts[slot, class_id, direction + 1] += count
+
+    def add_events(self, events, wall_time=None):
+        # CountEvents, wall_time converts their timestamps to wall clock seconds
+        for event in events:
+            timestamp = wall_time(event.timestamp) if wall_time is not None else event.timestamp
+            self.add(timestamp, event.class_id, event.direction)
+
+    def level_for(self, start, end):
+        # Coarsest level with buckets that line up with the range and that still holds its start
+        for level in reversed(range(len(self.resolutions))):
+            resolution = self.resolutions[level]
+            covered = start >= (end // resolution - len(self.buckets[level])) * resolution
+            if start % resolution == 0 and end % resolution == 0 and covered:
+                return level
+        # Not aligned to any level: the finest one that goes back far enough, rounded to its buckets
+        for level in range(len(self.resolutions)):
+            if start >= (end // self.resolutions[level] - len(self.buckets[level])) * self.resolutions[level]:
+                return level
+        return len(self.resolutions) - 1
+
+    def series(self, start, end, resolution=None):
+        """Bucket start times and counts[bucket, class, direction] for [start, end)"""
+        with self.lock:
+            level = self.resolutions.index(resolution) if resolution else self.level_for(start, end)
+            resolution = self.resolutions[level]
+            wanted = np.arange(int(start // resolution), -int(-end // resolution), dtype=np.int64)
+            slots = wanted % len(self.buckets[level])
+            held = self.buckets[level][slots] == wanted
+            counts = np.where(held[:, None, None], self.counts[level][slots], 0)
+        return wanted * resolution, counts
+
+    def query(self, start, end, resolution=None):
+        """Counts[class, direction] summed over [start, end)"""
+        return self.series(start, end, resolution)[1].sum(axis=0)
+
+    def interval(self, start, end):
+        """Total and details dict ({'classes': {class_id: count}, 'directions': {1: count, -1: count}}) over a range of the history"""
+        # Interval ends computed from the monotonic clock are a hair off whole seconds
+        counts = self.query(round(start), round(end))
+        classes = {i: int(n) for i, n in enumerate(counts.sum(axis=1)) if n}
+        directions = {d: int(counts[:, d + 1].sum()) for d in (1, -1) if counts[:, d + 1].any()}
+        return int(counts.sum()), {'classes': classes, 'directions': directions}
+
+    def save(self):
+        # Written to a new file that replaces the old one, a power cut leaves one or the other
+        if not self.path:
+            return
+        arrays = {}
+        with self.lock:
+            for resolution, counts, buckets in zip(self.resolutions, self.counts, self.buckets):
+                arrays[f"counts_{resolution}"] = counts.copy()
+                arrays[f"buckets_{resolution}"] = buckets.copy()
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+    def load(self):
+        # Levels whose shape changed (another labelmap or history length) start empty
+        try:
+            saved = np.load(self.path)
+        except (OSError, ValueError) as e:
+            print(f"Count store {self.path} could not be read, starting empty: {e}")
+            return
+        with saved, self.lock:
+            for level, resolution in enumerate(self.resolutions):
+                counts, buckets = saved.get(f"counts_{resolution}"), saved.get(f"buckets_{resolution}")
+                if counts is not None and counts.shape == self.counts[level].shape:
+                    self.counts[level][:] = counts
+                    self.buckets[level][:] = buckets
@@ -23,64 +23,45 @@ import cv2
 import numpy as np
 import sys
 import time
-import threading
-import importlib.util
-
-from picamera2 import Picamera2
-from libcamera import Transform
-from datetime import datetime
-import subprocess
-
-class VideoStream:
-    """Camera object that controls video streaming from the Picamera"""
-    def __init__(self,resolution=(640,480),framerate=30):
-        self.camera = Picamera2()
-        
-        config = self.camera.create_still_configuration(main={"size": resolution},transform=Transform(vflip=False))
-        self.camera.configure(config)
-        
-        self.camera.start()
-        
-        #self.camera.set_controls({"AfMode": 1})\
-        self.camera.set_controls({"LensPosition": 0.0})
-        
-        self.frame = self.camera.capture_array()
-        
-        self.stopped = False
-
-    def start(self):
-        return self
-
-    def update(self):
-        pass
-
-    def read(self):
-        self.frame = self.camera.capture_array()
-        return self.frame
-
-    def stop(self):
-        self.camera.stop()
-
-def is_multiple_of_five():
-    current_minute = datetime.now().minute
-    return current_minute % 5 == 0
-
-def run_time_setup_script():
-    #subprocess.run(["python3", "/home/russouw/sim800_setup.py"])
-    subprocess.run(["python3", "/home/russouw/wifi_setup.py"])
-
-# Function to run the upload script
-def run_upload_script(vehicle_count):
-    #subprocess.run(["python3", "/home/russouw/sim800_log.py", str(vehicle_count)])
-    subprocess.run(["python3", "/home/russouw/wifi_log.py", str(vehicle_count)])
-
-run_time_setup_script()
+
+
+from frame_sources import open_frame_source
+from annotate import draw_detections, draw_overlay, draw_counting_area, SnapshotWriter
+from tracker import IoUTracker
+from pipeline import Pipeline
+from inference_pool import InferencePool
+from model_registry import DetectionModel, ModelVersion, find_model
+from model_swap import ModelSwapper
+from preprocess import Preprocessor
+from postprocess import DETECTION_DTYPE, filter_ssd_detections, drawable
+from tiling import Tiler, make_tiles
+from motion_gate import MotionGate
+from rate_control import RateController
+from uploader import Uploader
+from scheduler import IntervalScheduler
+from count_store import CountStore
+from transports import SIM800Transport, open_transports
+from time_sync import ClockSync, http_date_time, modem_time, ntp_time, worldtime_time
+from wifi_log import UPLOAD_URL
+
+def parse_points(text):
+    # 'x1,y1,x2,y2,...' to [(x1, y1), (x2, y2), ...]
+    values = [float(v) for v in text.split(',')]
+    return list(zip(values[0::2], values[1::2]))
+
+
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--modeldir', help='Folder the .tflite file is located in',
                     default='/home/russouw/v5')
-parser.add_argument('--graph', help='Name of the .tflite file, if different than detect.tflite',
-                    default='detect_quant.tflite')
+parser.add_argument('--model', help='Model version in --modelroot to use instead of --modeldir, such as v4 or latest',
+                    default=None)
+parser.add_argument('--modelroot', help='Folder holding the model versions for --model',
+                    default='/home/russouw')
+parser.add_argument('--graph', help='Name of the .tflite file, by default edgetpu.tflite with --edgetpu and detect_quant.tflite otherwise',
+                    default=None)
+parser.add_argument('--modelcontrol', help='File naming the model to run: a version in --modelroot, latest or a folder. Writing another name to it, or replacing the running graph file, switches models without restarting',
+                    default=None)
 parser.add_argument('--labels', help='Name of the labelmap file, if different than labelmap.txt',
                     default='labelmap.txt')
 parser.add_argument('--threshold', help='Minimum confidence threshold for displaying detected objects',
@@ -89,6 +70,68 @@ parser.add_argument('--resolution', help='Desired webcam resolution in WxH. If t
                     default='1280x720')
 parser.add_argument('--edgetpu', help='Use Coral Edge TPU Accelerator to speed up detection',
                     action='store_true')
+parser.add_argument('--source', help='Where frames come from: picamera, a video file, a folder of JPEGs or an MJPEG URL such as http://<esp32-ip>:81/stream',
+                    default='picamera')
+parser.add_argument('--bufferpolicy', help='What the capture thread does when detection falls behind: drop the oldest frame or block the source. Defaults to drop for live sources and block for recordings',
+                    choices=['drop', 'block'], default=None)
+parser.add_argument('--lores', help='Detect on a low resolution camera stream at the model input size, the full resolution is only captured for display and snapshots',
+                    action='store_true')
+parser.add_argument('--countline', help='Count vehicles crossing this line, x1,y1,x2,y2 in pixels of --resolution',
+                    default=None)
+parser.add_argument('--countzone', help='Count vehicles leaving this polygon, x1,y1,x2,y2,x3,y3,... in pixels of --resolution. Without a line or zone, vehicles are counted when they leave the view',
+                    default=None)
+parser.add_argument('--roi', help='Only detect in these road regions, x1,y1,x2,y2 in pixels of --resolution, several separated by ;. Each is cropped from the frame and grown to the model\'s aspect ratio, split in overlapping tiles if it is too wide for that',
+                    default=None)
+parser.add_argument('--tiles', help='Split every --roi (the whole frame without one) into CxR overlapping tiles, such as 2x1, for small distant vehicles',
+                    default=None)
+parser.add_argument('--tileoverlap', help='Fraction of a tile that overlaps its neighbours, also where a --roi too wide for the model\'s aspect ratio is split',
+                    default=0.15)
+parser.add_argument('--tileregion', help='With --tiles, also run the model on every whole --roi, which finds vehicles larger than the tile overlap for more invokes per frame',
+                    action='store_true')
+parser.add_argument('--threads', help='Number of CPU threads per interpreter, the TFLite default if not given',
+                    default=None)
+parser.add_argument('--workers', help='Number of interpreters to run frames on in parallel',
+                    default=1)
+parser.add_argument('--processes', help='Run the --workers interpreters in separate processes instead of threads',
+                    action='store_true')
+parser.add_argument('--pipeline', help='Run capture, preprocessing, inference and post-processing on separate threads',
+                    action='store_true')
+parser.add_argument('--motiongate', help='Only run the detector on frames with motion in the count zone (the whole frame without one)',
+                    action='store_true')
+parser.add_argument('--motionhold', help='Seconds the detector keeps running after the motion stops',
+                    default=3)
+parser.add_argument('--motionfraction', help='Fraction of the pixels that must change to count as motion',
+                    default=0.002)
+parser.add_argument('--adaptive', help='Adapt the frame rate, detector stride and tiles to the traffic, the measured load and the CPU temperature',
+                    action='store_true')
+parser.add_argument('--activefps', help='Frame rate --adaptive holds while there is traffic',
+                    default=10)
+parser.add_argument('--idlefps', help='Frame rate --adaptive drops to when the road is empty',
+                    default=1)
+parser.add_argument('--headless', help='Do not draw or display anything, for a Pi without a monitor',
+                    action='store_true')
+parser.add_argument('--uploadurl', help='URL the interval counts are sent to, such as a local stand-in for testing',
+                    default=UPLOAD_URL)
+parser.add_argument('--transport', help='How counts are uploaded: wifi, gsm (SIM800) or auto (WiFi, failing over to GSM)',
+                    choices=['wifi', 'gsm', 'auto'], default='wifi')
+parser.add_argument('--apn', help='APN of the SIM card for GSM uploads, if the network needs one',
+                    default=None)
+parser.add_argument('--gsmpayload', help='Upload body over GSM: json like WiFi, or the compact binary format of payload.py (needs a receiver that decodes it). '
+                    'The defaults, json with --uploaddelay 0, send more bytes per count than a GET did; binary with --uploaddelay 3600 '
+                    'sends about 11x less (benchmarks/bench_payload.py)',
+                    choices=['json', 'binary'], default='json')
+parser.add_argument('--uploaddelay', help='Seconds counts may wait to be sent together in one request, 0 sends every count right away',
+                    default=0)
+parser.add_argument('--outbox', help='SQLite file that keeps the counts until they are uploaded',
+                    default='/home/russouw/outbox.db')
+parser.add_argument('--countstore', help='File that keeps the per second, minute, 5-minute and hourly counts',
+                    default='/home/russouw/counts.npz')
+parser.add_argument('--uploadbatch', help='Most counts sent in one upload request when catching up after an outage',
+                    default=20)
+parser.add_argument('--snapshotdir', help='Folder to save an annotated frame to now and then, off by default',
+                    default=None)
+parser.add_argument('--snapshotinterval', help='Seconds between annotated frames saved to --snapshotdir',
+                    default=60)
 
 args = parser.parse_args()
 
@@ -99,185 +142,371 @@ min_conf_threshold = float(args.threshold)
 resW, resH = args.resolution.split('x')
 imW, imH = int(resW), int(resH)
 use_TPU = args.edgetpu
-
-# Import TensorFlow libraries
-# If tflite_runtime is installed, import interpreter from tflite_runtime, else import from regular tensorflow
-# If using Coral Edge TPU, import the load_delegate library
-pkg = importlib.util.find_spec('tflite_runtime')
-if pkg:
-    from tflite_runtime.interpreter import Interpreter
-    if use_TPU:
-        from tflite_runtime.interpreter import load_delegate
+FRAME_SOURCE = args.source
+buffer_policy = args.bufferpolicy
+use_lores = args.lores
+headless = args.headless
+use_pipeline = args.pipeline
+num_threads = int(args.threads) if args.threads else None
+num_workers = int(args.workers)
+use_processes = args.processes
+count_line = parse_points(args.countline) if args.countline else None
+count_zone = parse_points(args.countzone) if args.countzone else None
+rois = [tuple(float(v) for v in roi.split(',')) for roi in args.roi.split(';')] if args.roi else []
+tile_grid = tuple(int(v) for v in args.tiles.lower().split('x')) if args.tiles else None
+
+# The model folder with its labels and training settings, see model_registry.py
+if args.model:
+    model_version = find_model(args.modelroot, args.model)
 else:
-    from tensorflow.lite.python.interpreter import Interpreter
-    if use_TPU:
-        from tensorflow.lite.python.interpreter import load_delegate
-
-# If using Edge TPU, assign filename for Edge TPU model
-if use_TPU:
-    # If user has specified the name of the .tflite file, use that name, otherwise use default 'edgetpu.tflite'
-    if (GRAPH_NAME == 'detect.tflite'):
-        GRAPH_NAME = 'edgetpu.tflite'       
-
-# Get path to current working directory
-CWD_PATH = os.getcwd()
-
-# Path to .tflite file, which contains the model that is used for object detection
-PATH_TO_CKPT = os.path.join(CWD_PATH,MODEL_NAME,GRAPH_NAME)
-
-# Path to label map file
-PATH_TO_LABELS = os.path.join(CWD_PATH,MODEL_NAME,LABELMAP_NAME)
-
-# Load the label map
-with open(PATH_TO_LABELS, 'r') as f:
-    labels = [line.strip() for line in f.readlines()]
-
-# Have to do a weird fix for label map if using the COCO "starter model" from
-# https://www.tensorflow.org/lite/models/object_detection/overview
-# First label is '???', which has to be removed.
-if labels[0] == '???':
-    del(labels[0])
-
-# Load the Tensorflow Lite model.
-# If using Edge TPU, use special load_delegate argument
-if use_TPU:
-    interpreter = Interpreter(model_path=PATH_TO_CKPT,
-                              experimental_delegates=[load_delegate('libedgetpu.so.1.0')])
-    print(PATH_TO_CKPT)
-else:
-    interpreter = Interpreter(model_path=PATH_TO_CKPT)
-
-interpreter.allocate_tensors()
+    model_version = ModelVersion(os.path.join(os.getcwd(), MODEL_NAME), LABELMAP_NAME)
+labels = model_version.labels
 
-# Get model details
-input_details = interpreter.get_input_details()
-output_details = interpreter.get_output_details()
-height = input_details[0]['shape'][1]
-width = input_details[0]['shape'][2]
+# Load the Tensorflow Lite model, on the Edge TPU if asked for and one is attached
+model = DetectionModel(model_version, use_TPU, num_threads, GRAPH_NAME)
+use_TPU = model.use_TPU
+print(f"Model: {model.path}")
 
-floating_model = (input_details[0]['dtype'] == np.float32)
+# More interpreters to spread frames over. There is only one Edge TPU to share.
+if use_TPU and num_workers > 1:
+    print("Only one interpreter can use the Edge TPU, ignoring --workers")
+    num_workers = 1
 
 input_mean = 127.5
 input_std = 127.5
 
-# Check output layer name to determine if this model was created with TF2 or TF1,
-# because outputs are ordered differently for TF2 and TF1 models
-outname = output_details[0]['name']
-
-if ('StatefulPartitionedCall' in outname): # This is a TF2 model
-    boxes_idx, classes_idx, scores_idx = 1, 3, 0
-else: # This is a TF1 model
-    boxes_idx, classes_idx, scores_idx = 0, 1, 2
+# With --pipeline or --workers several frames are worked on at the same time, so
+# frames and input data get a buffer from a pool that is larger than the number
+# of frames that can be in flight.
+queue_size = 2
+buffered = use_pipeline or num_workers > 1
+pool_size = 4 * (queue_size + 1) + 2 * num_workers
+
+def make_engine(model, pool=True):
+    # What the detection loop runs a model with, one per model when models are switched.
+    # Without pool, the inference stage loads the model into the running workers when it first runs it.
+    preprocessor = Preprocessor(model.width, model.height, model.floating, input_mean, input_std)
+    engine = {'model': model,
+              'preprocessor': preprocessor,
+              # Frames are resized and converted straight into the interpreter's input tensor
+              'input_tensor': model.interpreter.tensor(model.input_index),
+              'inputs': [np.empty_like(preprocessor.input_data) for _ in range(pool_size if buffered else 0)],
+              'tiler': None,
+              'pool': None}
+    if rois or tile_grid:
+        # Every road region or tile is cut from the frame into its own model input
+        columns, rows = tile_grid or (1, 1)
+        tiles = make_tiles(rois, (imW, imH), (model.width, model.height), columns, rows, float(args.tileoverlap),
+                           region_pass=args.tileregion)
+        # Without the grid, for when --adaptive has no time for every tile
+        coarse_tiles = (make_tiles(rois, (imW, imH), (model.width, model.height), overlap=float(args.tileoverlap))
+                        if tile_grid else None)
+        engine['tiler'] = Tiler(tiles, model.width, model.height, model.floating, input_mean, input_std,
+                                coarse_tiles=coarse_tiles)
+        engine['inputs'] = [np.empty_like(engine['tiler'].input_data) for _ in range(pool_size)]
+    if num_workers > 1 and pool:
+        engine['pool'] = start_pool(model)
+    return engine
+
+def start_pool(model):
+    # A frame's tiles stay together on one worker, frames are spread over the workers
+    return InferencePool(model.make_interpreter, workers=num_workers, use_processes=use_processes)
+
+# Worker processes fork here, before any other thread of this script has started
+engine = make_engine(model)
+active_pool = engine['pool']
+
+# Measure the clock in the background while the camera warms up.
+# The system clock is left alone, the counts get their times from the measured offset.
+clock = ClockSync([ntp_time, worldtime_time, http_date_time])
+
+# The first invoke is slow, it runs while the camera and the uploads start
+model.start_warm_up()
+
+# Another model is loaded in the background when --modelcontrol names one, and
+# the detection loop switches to it between two frames
+swapper = None
+if args.modelcontrol:
+    swapper = ModelSwapper(args.modelcontrol, model, args.modelroot,
+                           lambda version: DetectionModel(version, use_TPU, num_threads,
+                                                          GRAPH_NAME if GRAPH_NAME in version.graphs else None),
+                           prepare=lambda model: make_engine(model, pool=False)).start()
 
 # Initialize frame rate calculation
 frame_rate_calc = 1
 freq = cv2.getTickFrequency()
 
-# Initialize video stream
-videostream = VideoStream(resolution=(imW, imH), framerate=30).start()
-time.sleep(1)
-
-print("Waiting for the next 5-minute interval...")
-while not is_multiple_of_five():
-    time.sleep(10)  # Check every 10 seconds
-
-print("Starting vehicle detection and upload process...")
-
-previous_vehicle_count = 0
-vehicle_passed_count = 0
-start_time = time.time()
-
-# Main loop for detection
-while True:
-    # Start timer (for calculating frame rate)
-    t1 = cv2.getTickCount()
+# Annotated frames are only saved if a folder was given
+snapshot_writer = None
+if args.snapshotdir:
+    snapshot_writer = SnapshotWriter(args.snapshotdir, interval=float(args.snapshotinterval))
+
+# Initialize video stream. Regions and tiles are cut from the full resolution frame.
+if use_lores and (rois or tile_grid):
+    print("--roi and --tiles crop the full resolution frame, ignoring --lores")
+    use_lores = False
+lores_size = (model.width, model.height) if use_lores else None
+videostream = open_frame_source(FRAME_SOURCE, resolution=(imW, imH), policy=buffer_policy, lores_size=lores_size).start()
+
+# Keeps the interval counts on disk and sends them from a background thread over --transport
+transport = open_transports(args.transport, args.uploadurl, args.apn, args.gsmpayload, len(labels))
+uploader = Uploader(args.uploadurl, args.outbox, max_batch=int(args.uploadbatch), batch_delay=float(args.uploaddelay),
+                    transport=transport)
+
+# The SIM800 knows the network time too, for when there is no WiFi
+for link in transport.transports:
+    if isinstance(link, SIM800Transport):
+        clock.add('sim800', lambda modem=link.modem: modem_time(modem))
+
+# Counts per second, class and direction with their rollups, the uploads are read from it
+count_store = CountStore(len(labels), args.countstore)
+
+def close_interval(start, end, events):
+    # Called by the scheduler's timer thread at the end of every 5-minute interval
+    # Every event the scheduler filed here goes into the store inside this interval: a late
+    # one at its last second instead of its own, as it is counted in this upload. The
+    # upload is then read back from the store.
+    first = round(start.timestamp())
+    last = max(round(end.timestamp()), first + 1)
+    count_store.add_events(events, lambda timestamp: min(max(scheduler.wall_time(timestamp), first), last - 1e-3))
+    count_store.save()
+    total, details = count_store.interval(first, last)
+
+    print(f"{end:%Y-%m-%d %H:%M:%S} - Uploading vehicle count: {total}")
+    print(f"Capture stats: {videostream.stats()}, FPS: {frame_rate_calc:.2f}")
+    print(f"Pipeline stats: {pipeline.report()}")
+    if motion_gate is not None:
+        print(f"Motion gate stats: {motion_gate.stats()}")
+    if swapper is not None:
+        print(f"Model stats: {swapper.stats()}")
+    if controller is not None:
+        print(f"Adaptive stats: {controller.stats()}")
+    print(f"Upload stats: {uploader.stats()}")
+
+    # Record the vehicle count for Google Sheets, the uploader sends it in the background
+    uploader.submit(total, when=end, details=details)
+
+# Only a live source needs the real time and the counting aligned to the 5-minute intervals,
+# recordings are replayed straight away. A time source that answers later still moves the intervals.
+if videostream.live and not clock.wait(30):
+    print("No time source has answered yet, using the system clock until one does")
+scheduler = IntervalScheduler(5 * 60, close_interval, offset=clock.offset())
+clock.subscribe(scheduler.set_offset)
+print(f"Clock: {clock.stats()}")
+
+tracker = IoUTracker(line=count_line, zone=count_zone)
+no_detections = np.empty(0, dtype=DETECTION_DTYPE)
+
+# Frames without motion skip preprocessing, inference and the tracker
+motion_gate = None
+if args.motiongate:
+    motion_gate = MotionGate(hold=float(args.motionhold), min_fraction=float(args.motionfraction),
+                             roi=count_zone, roi_size=(imW, imH))
+
+# Holds the frame rate while there is traffic and saves power when the road is empty
+controller = None
+if args.adaptive:
+    controller = RateController(active_fps=float(args.activefps), idle_fps=float(args.idlefps),
+                                coarse_tiles=tile_grid is not None, threaded=use_pipeline)
+    videostream.set_frame_rate(controller.fps)
+last_frame_tick = cv2.getTickCount()
+frame_interval = None  # Smoothed seconds between finished frames
+
+# Stages of the detection loop, see pipeline.py
+frame_pool = [np.empty_like(videostream.frame) for _ in range(pool_size if buffered else 0)]
+frame_count = 0
+
+def capture_stage():
+    global frame_count
+
+    # Only take a frame when the next one is due at the frame rate --adaptive has set
+    if controller is not None:
+        controller.pace()
 
     # Grab frame from video stream
     frame1 = videostream.read()
-
-    # Acquire frame and resize to expected shape [1xHxWx3]
-    frame = frame1.copy()
-    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    frame_resized = cv2.resize(frame_rgb, (width, height))
-    input_data = np.expand_dims(frame_resized, axis=0)
-
-    # Normalize pixel values if using a floating model (i.e., if the model is non-quantized)
-    if floating_model:
-        input_data = (np.float32(input_data) - input_mean) / input_std
+    if frame1 is None:  # A recorded source has run out of frames
+        return None
+
+    # The stream reuses this buffer on its next read, which in a pipeline
+    # happens while the frame is still being worked on
+    if buffered:
+        buffer = frame_pool[frame_count % pool_size]
+        np.copyto(buffer, frame1)
+        frame1 = buffer
+
+    # Vehicles are counted in the interval their frame was captured in
+    item = {'frame': frame1, 'seq': frame_count, 'time': time.monotonic()}
+    frame_count += 1
+    return item
+
+def preprocess_stage(item):
+    global engine
+
+    # A model switched to runs from this frame on, the frames before it finish on the old one
+    if swapper is not None:
+        engine = swapper.take() or engine
+    item['engine'] = engine
+
+    # A frame without motion, or one --adaptive skips, goes straight on to be shown, without detections
+    item['motion'] = motion_gate is None or motion_gate.update(item['frame'], item['time'])
+    item['detect'] = item['motion'] and (controller is None or controller.should_detect(item['seq']))
+    if not item['detect']:
+        return item
+
+    # Resize and colour convert the frame into the input tensor [1xHxWx3], normalizing
+    # pixel values if using a floating model (i.e., if the model is non-quantized).
+    if engine['tiler'] is not None:
+        # One input per tile, in a buffer of its own like with --pipeline
+        item['coarse'] = controller is not None and controller.coarse
+        item['input'] = engine['tiler'].run(item['frame'], engine['inputs'][item['seq'] % pool_size], item['coarse'])
+    elif buffered:
+        # The interpreter may still be busy with the previous frame
+        item['input'] = engine['preprocessor'].run(item['frame'], engine['inputs'][item['seq'] % pool_size])
+    else:
+        # The tensor view is not kept, the interpreter refuses to run while one is held.
+        engine['preprocessor'].run(item['frame'], engine['input_tensor']())
+    return item
+
+def inference_stage(item):
+    global active_pool
+
+    # With a pool the frame goes to the next free interpreter, and whatever frames
+    # have finished are passed on in the order they were captured
+    if active_pool is not None:
+        pool = item['engine']['pool']
+        if pool is None:
+            # The first frame for a new model: the running workers load it after the frames
+            # they already have, which finish on the old model. Nothing forks once threads run.
+            active_pool.reload(item['engine']['model'].interpreter_factory())
+            pool = item['engine']['pool'] = active_pool
+        if item['detect']:
+            tiled = item['engine']['tiler'] is not None
+            pool.submit(item['seq'], list(item['input']) if tiled else item['input'], item)
+        else:
+            pool.skip(item['seq'], item)
+        return [read_outputs(item, outputs) for item, outputs in pool.ready()]
+
+    if not item['detect']:
+        return item
 
     # Perform the actual detection by running the model with the image as input
-    interpreter.set_tensor(input_details[0]['index'], input_data)
-    interpreter.invoke()
-
-    # Retrieve detection results
-    boxes = interpreter.get_tensor(output_details[boxes_idx]['index'])[0]  # Bounding box coordinates of detected objects
-    classes = interpreter.get_tensor(output_details[classes_idx]['index'])[0]  # Class index of detected objects
-    scores = interpreter.get_tensor(output_details[scores_idx]['index'])[0]  # Confidence of detected objects
-    
-    # Count the number of vehicles in the current frame
-    current_vehicle_count = 0
-    detected_objects = []
-    
-    # Loop over all detections and count vehicles if confidence is above the minimum threshold
-    for i in range(len(scores)):
-        if (scores[i] > min_conf_threshold) and (scores[i] <= 1.0):
-            current_vehicle_count += 1
-
-            # Get bounding box coordinates and draw box
-            ymin = int(max(1, (boxes[i][0] * imH)))
-            xmin = int(max(1, (boxes[i][1] * imW)))
-            ymax = int(min(imH, (boxes[i][2] * imH)))
-            xmax = int(min(imW, (boxes[i][3] * imW)))
-            
-            cv2.rectangle(frame_rgb, (xmin, ymin), (xmax, ymax), (10, 255, 0), 2)
-
-            # Draw label
-            object_name = labels[int(classes[i])]  # Look up object name from "labels" array using class index
-            label = '%s: %d%%' % (object_name, int(scores[i] * 100))  # Example: 'person: 72%'
-            labelSize, baseLine = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)  # Get font size
-            label_ymin = max(ymin, labelSize[1] + 10)  # Make sure not to draw label too close to top of window
-            cv2.rectangle(frame_rgb, (xmin, label_ymin - labelSize[1] - 10), (xmin + labelSize[0], label_ymin + baseLine - 10), (255, 255, 255), cv2.FILLED)  # Draw white box to put label text in
-            cv2.putText(frame_rgb, label, (xmin, label_ymin - 7), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)  # Draw label text
-
-    # Check if the number of vehicles in the current frame is less than in the previous frame
-    if current_vehicle_count < previous_vehicle_count:
-        vehicle_passed_count += previous_vehicle_count - current_vehicle_count
-
-    # Update the previous vehicle count
-    previous_vehicle_count = current_vehicle_count
-
-    # Display the vehicle passed count in the top right corner of the frame
-    cv2.putText(frame_rgb, '#vehicles: {}'.format(vehicle_passed_count), (imW - 300, 50),
-                cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 0), 2, cv2.LINE_AA)
-
-    # Draw frame rate in the corner of the frame
-    cv2.putText(frame_rgb, 'FPS: {0:.2f}'.format(frame_rate_calc), (30, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 0), 2, cv2.LINE_AA)
-
-    # Display the frame
-    cv2.imshow('Object detector', frame_rgb)
-
-    # Calculate frame rate
+    model = item['engine']['model']
+    if item['engine']['tiler'] is not None:
+        # The model takes one image per invoke, the tiles run one after the other
+        return read_outputs(item, [invoke(model, tile_input) for tile_input in item['input']])
+    return read_outputs(item, invoke(model, item.get('input')))
+
+def invoke(model, input_data=None):
+    # Without input_data the preprocessor has already filled the input tensor
+    if input_data is not None:
+        model.interpreter.set_tensor(model.input_index, input_data)
+    model.interpreter.invoke()
+    return model.outputs()
+
+def inference_flush():
+    # Frames still in the pool when the source ends
+    if active_pool is None:
+        return []
+    return [read_outputs(item, outputs) for item, outputs in active_pool.drain()]
+
+def read_outputs(item, outputs):
+    if outputs is None:  # Skipped by the motion gate or --adaptive
+        return item
+    # Retrieve detection results, the model knows where boxes, classes and scores are in its outputs
+    model = item['engine']['model']
+    tiler = item['engine']['tiler']
+    if tiler is not None:
+        # The detections of every tile, in the frame and merged where tiles overlap
+        item['boxes'], item['classes'], item['scores'] = tiler.merge(
+            [(output[model.boxes_idx][0], output[model.classes_idx][0], output[model.scores_idx][0]) for output in outputs],
+            min_conf_threshold, item['coarse'])
+        return item
+    item['boxes'] = outputs[model.boxes_idx][0]  # Bounding box coordinates of detected objects
+    item['classes'] = outputs[model.classes_idx][0]  # Class index of detected objects
+    item['scores'] = outputs[model.scores_idx][0]  # Confidence of detected objects
+    return item
+
+def postprocess_stage(item):
+    global frame_rate_calc, last_frame_tick, frame_interval
+
+    if item['detect']:
+        # Keep the detections above the minimum confidence threshold, with boxes in pixels
+        detections = filter_ssd_detections(item['boxes'], item['classes'], item['scores'], min_conf_threshold, imW, imH)
+
+        # Follow every vehicle across frames and count it once, when it crosses the line or leaves the zone
+        scheduler.record(tracker.update(detections, item['time']))
+    else:
+        # Nothing moves or the frame is skipped, the tracks wait as they are for the next detection
+        detections = no_detections
+
+    # Frame rate, stride and tiles follow the traffic and the time the stages take
+    if controller is not None and controller.update(time.monotonic(), pipeline.counters(),
+                                                    len(tracker) > 0 or (motion_gate is not None and item['motion'])):
+        videostream.set_frame_rate(controller.fps)
+        print(f"Adaptive: {controller.stats()}")
+
+    # Only draw when the frame will be shown or saved
+    save_snapshot = snapshot_writer is not None and snapshot_writer.due()
+    if not headless or save_snapshot:
+        # Boxes are in full resolution pixels, also when detecting on the lores stream
+        full_frame = videostream.read_full() if use_lores else item['frame']
+        frame_rgb = cv2.cvtColor(full_frame, cv2.COLOR_BGR2RGB)
+        draw_detections(frame_rgb, drawable(detections, labels))
+        draw_counting_area(frame_rgb, count_line, count_zone)
+        draw_overlay(frame_rgb, scheduler.count(), frame_rate_calc)
+
+        if save_snapshot:
+            snapshot_writer.write(frame_rgb)
+
+        # Display the frame
+        if not headless:
+            cv2.imshow('Object detector', frame_rgb)
+
+    # Calculate frame rate from the time between finished frames, which with
+    # --pipeline is shorter than the time one frame spends in the pipeline.
+    # With --workers frames finish in bursts, so the time between them is smoothed.
     t2 = cv2.getTickCount()
-    time1 = (t2 - t1) / freq
-    frame_rate_calc = 1 / time1
-
-    # Check if 5 minutes have passed
-    if time.time() - start_time >= 5 * 60:  # 5 minutes
-        # Get current time and reset the timer
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"{current_time} - Uploading vehicle count: {vehicle_passed_count}")
-        
-        # Run the upload script to send the vehicle count to Google Sheets
-        upload_thread = threading.Thread(target=run_upload_script, args=(vehicle_passed_count,))
-        upload_thread.start()
-        
-        # Reset vehicle count and start time for the next 5-minute interval
-        vehicle_passed_count = 0
-        start_time = time.time()
+    time1 = (t2 - last_frame_tick) / freq
+    last_frame_tick = t2
+    frame_interval = time1 if frame_interval is None else 0.9 * frame_interval + 0.1 * time1
+    frame_rate_calc = 1 / max(frame_interval, 1e-6)
 
     # Add logic to break the loop if needed (e.g., press 'q')
-    if cv2.waitKey(1) == ord('q'):
-        break
+    if not headless and cv2.waitKey(1) == ord('q'):
+        pipeline.stop()
+
+pipeline = Pipeline([('capture', capture_stage),
+                     ('preprocess', preprocess_stage),
+                     ('inference', inference_stage, inference_flush),
+                     ('postprocess', postprocess_stage)],
+                    queue_size=queue_size, threaded=use_pipeline)
+
+# The scheduler closes intervals from its own thread, and close_interval needs
+# everything above, so it only starts now
+if videostream.live:
+    print("Waiting for the next 5-minute interval...")
+    scheduler.wait_for_boundary()
+scheduler.start()
+
+print("Starting vehicle detection and upload process...")
 
-cv2.destroyAllWindows()
-videostream.stop()
\ No newline at end of file
+# Main loop for detection, runs until the source ends or 'q' is pressed
+model.wait_ready()
+try:
+    pipeline.run()
+except KeyboardInterrupt:
+    pipeline.stop()
+
+print(f"Pipeline stats: {pipeline.report()}")
+
+# The interval that was running is uploaded with what was counted so far
+scheduler.stop()
+uploader.close()
+if swapper is not None:
+    swapper.stop()
+if active_pool is not None:
+    active_pool.close()
+if not headless:
+    cv2.destroyAllWindows()
+videostream.stop()
@@ -3,48 +3,26 @@ import argparse
 import cv2
 import numpy as np
 import time
-import threading
 import ncnn  # Import NCNN
-from datetime import datetime
-import subprocess
-from picamera2 import Picamera2
-from libcamera import Transform
 
-class VideoStream:
-    """Camera object that controls video streaming from the Picamera"""
-    def __init__(self, resolution=(640, 480), framerate=30):
-        self.camera = Picamera2()
-        config = self.camera.create_still_configuration(main={"size": resolution}, transform=Transform(vflip=False))
-        self.camera.configure(config)
-        self.camera.start()
-        self.camera.set_controls({"LensPosition": 0.0})
-        self.frame = self.camera.capture_array()
-        self.stopped = False
+from frame_sources import open_frame_source
+from annotate import draw_detections, draw_overlay, draw_counting_area, SnapshotWriter
+from tracker import IoUTracker
+from preprocess import Preprocessor
+from postprocess import DETECTION_DTYPE, decode_yolo, drawable
+from motion_gate import MotionGate
+from uploader import Uploader
+from scheduler import IntervalScheduler
+from count_store import CountStore
+from transports import SIM800Transport, open_transports
+from time_sync import ClockSync, http_date_time, modem_time, ntp_time, worldtime_time
+from wifi_log import UPLOAD_URL
+
+def parse_points(text):
+    # 'x1,y1,x2,y2,...' to [(x1, y1), (x2, y2), ...]
+    values = [float(v) for v in text.split(',')]
+    return list(zip(values[0::2], values[1::2]))
 
-    def start(self):
-        return self
-
-    def update(self):
-        pass
-
-    def read(self):
-        self.frame = self.camera.capture_array()
-        return self.frame
-
-    def stop(self):
-        self.camera.stop()
-
-def is_multiple_of_five():
-    current_minute = datetime.now().minute
-    return current_minute % 5 == 0
-
-def run_time_setup_script():
-    subprocess.run(["python3", "/home/russouw/wifi_setup.py"])
-
-def run_upload_script(vehicle_count):
-    subprocess.run(["python3", "/home/russouw/wifi_log.py", str(vehicle_count)])
-
-run_time_setup_script()
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--modeldir', help='Folder where the NCNN model files are located',
@@ -57,8 +35,54 @@ parser.add_argument('--labels', help='Name of the labelmap file',
                     default='labelmap.txt')
 parser.add_argument('--threshold', help='Minimum confidence threshold for displaying detected objects',
                     default=0.45)
+parser.add_argument('--iou', help='IoU above which overlapping boxes of the same class are suppressed',
+                    default=0.45)
+parser.add_argument('--yoloversion', help='Output layout of the model, guessed from the output shape by default',
+                    choices=['v5', 'v8'], default=None)
+parser.add_argument('--inputblob', help='Name of the input blob', default='images')
+parser.add_argument('--outputblob', help='Name of the output blob', default='output')
 parser.add_argument('--resolution', help='Desired camera resolution in WxH.',
                     default='1280x720')
+parser.add_argument('--source', help='Where frames come from: picamera, a video file, a folder of JPEGs or an MJPEG URL such as http://<esp32-ip>:81/stream',
+                    default='picamera')
+parser.add_argument('--bufferpolicy', help='What the capture thread does when detection falls behind: drop the oldest frame or block the source. Defaults to drop for live sources and block for recordings',
+                    choices=['drop', 'block'], default=None)
+parser.add_argument('--lores', help='Detect on a low resolution camera stream at the model input size, the full resolution is only captured for display and snapshots',
+                    action='store_true')
+parser.add_argument('--uploadurl', help='URL the interval counts are sent to, such as a local stand-in for testing',
+                    default=UPLOAD_URL)
+parser.add_argument('--transport', help='How counts are uploaded: wifi, gsm (SIM800) or auto (WiFi, failing over to GSM)',
+                    choices=['wifi', 'gsm', 'auto'], default='wifi')
+parser.add_argument('--apn', help='APN of the SIM card for GSM uploads, if the network needs one',
+                    default=None)
+parser.add_argument('--gsmpayload', help='Upload body over GSM: json like WiFi, or the compact binary format of payload.py (needs a receiver that decodes it). '
+                    'The defaults, json with --uploaddelay 0, send more bytes per count than a GET did; binary with --uploaddelay 3600 '
+                    'sends about 11x less (benchmarks/bench_payload.py)',
+                    choices=['json', 'binary'], default='json')
+parser.add_argument('--uploaddelay', help='Seconds counts may wait to be sent together in one request, 0 sends every count right away',
+                    default=0)
+parser.add_argument('--outbox', help='SQLite file that keeps the counts until they are uploaded',
+                    default='/home/russouw/outbox.db')
+parser.add_argument('--countstore', help='File that keeps the per second, minute, 5-minute and hourly counts',
+                    default='/home/russouw/counts.npz')
+parser.add_argument('--uploadbatch', help='Most counts sent in one upload request when catching up after an outage',
+                    default=20)
+parser.add_argument('--countline', help='Count vehicles crossing this line, x1,y1,x2,y2 in pixels of --resolution',
+                    default=None)
+parser.add_argument('--countzone', help='Count vehicles leaving this polygon, x1,y1,x2,y2,x3,y3,... in pixels of --resolution. Without a line or zone, vehicles are counted when they leave the view',
+                    default=None)
+parser.add_argument('--motiongate', help='Only run the detector on frames with motion in the count zone (the whole frame without one)',
+                    action='store_true')
+parser.add_argument('--motionhold', help='Seconds the detector keeps running after the motion stops',
+                    default=3)
+parser.add_argument('--motionfraction', help='Fraction of the pixels that must change to count as motion',
+                    default=0.002)
+parser.add_argument('--headless', help='Do not draw or display anything, for a Pi without a monitor',
+                    action='store_true')
+parser.add_argument('--snapshotdir', help='Folder to save an annotated frame to now and then, off by default',
+                    default=None)
+parser.add_argument('--snapshotinterval', help='Seconds between annotated frames saved to --snapshotdir',
+                    default=60)
 
 args = parser.parse_args()
 
@@ -67,8 +91,20 @@ PARAM_FILE = args.param
 BIN_FILE = args.bin
 LABELMAP_NAME = args.labels
 min_conf_threshold = float(args.threshold)
+iou_threshold = float(args.iou)
+yolo_version = args.yoloversion
 resW, resH = args.resolution.split('x')
 imW, imH = int(resW), int(resH)
+FRAME_SOURCE = args.source
+buffer_policy = args.bufferpolicy
+use_lores = args.lores
+headless = args.headless
+count_line = parse_points(args.countline) if args.countline else None
+count_zone = parse_points(args.countzone) if args.countzone else None
+
+# Measure the clock in the background while the model loads and the camera warms up.
+# The system clock is left alone, the counts get their times from the measured offset.
+clock = ClockSync([ntp_time, worldtime_time, http_date_time])
 
 # Path to model files
 PATH_TO_PARAM = os.path.join(MODEL_DIR, PARAM_FILE)
@@ -88,25 +124,81 @@ net.load_model(PATH_TO_BIN)
 target_size = 320  # Adjust based on your model input size (e.g., 320, 416, 640)
 mean_vals = (0.0, 0.0, 0.0)
 norm_vals = (1/255.0, 1/255.0, 1/255.0)
+# Letterboxed like the YOLO training images, NCNN does the normalization itself
+preprocessor = Preprocessor(target_size, target_size, letterbox=True)
 
 # Initialize frame rate calculation
 frame_rate_calc = 1
 freq = cv2.getTickFrequency()
 
-# Initialize video stream
-videostream = VideoStream(resolution=(imW, imH), framerate=30).start()
-time.sleep(1)
+# Annotated frames are only saved if a folder was given
+snapshot_writer = None
+if args.snapshotdir:
+    snapshot_writer = SnapshotWriter(args.snapshotdir, interval=float(args.snapshotinterval))
 
-print("Waiting for the next 5-minute interval...")
-while not is_multiple_of_five():
-    time.sleep(10)  # Check every 10 seconds
+# Initialize video stream
+lores_size = (target_size, target_size) if use_lores else None
+videostream = open_frame_source(FRAME_SOURCE, resolution=(imW, imH), policy=buffer_policy, lores_size=lores_size).start()
+
+# Keeps the interval counts on disk and sends them from a background thread over --transport
+transport = open_transports(args.transport, args.uploadurl, args.apn, args.gsmpayload, len(labels))
+uploader = Uploader(args.uploadurl, args.outbox, max_batch=int(args.uploadbatch), batch_delay=float(args.uploaddelay),
+                    transport=transport)
+
+# The SIM800 knows the network time too, for when there is no WiFi
+for link in transport.transports:
+    if isinstance(link, SIM800Transport):
+        clock.add('sim800', lambda modem=link.modem: modem_time(modem))
+
+# Counts per second, class and direction with their rollups, the uploads are read from it
+count_store = CountStore(len(labels), args.countstore)
+
+def close_interval(start, end, events):
+    # Called by the scheduler's timer thread at the end of every 5-minute interval
+    # Every event the scheduler filed here goes into the store inside this interval: a late
+    # one at its last second instead of its own, as it is counted in this upload. The
+    # upload is then read back from the store.
+    first = round(start.timestamp())
+    last = max(round(end.timestamp()), first + 1)
+    count_store.add_events(events, lambda timestamp: min(max(scheduler.wall_time(timestamp), first), last - 1e-3))
+    count_store.save()
+    total, details = count_store.interval(first, last)
+
+    print(f"{end:%Y-%m-%d %H:%M:%S} - Uploading vehicle count: {total}")
+    print(f"Capture stats: {videostream.stats()}, FPS: {frame_rate_calc:.2f}")
+    if motion_gate is not None:
+        print(f"Motion gate stats: {motion_gate.stats()}")
+    print(f"Upload stats: {uploader.stats()}")
+
+    # Record the vehicle count for Google Sheets, the uploader sends it in the background
+    uploader.submit(total, when=end, details=details)
+
+# Only a live source needs the real time and the counting aligned to the 5-minute intervals,
+# recordings are replayed straight away. A time source that answers later still moves the intervals.
+if videostream.live and not clock.wait(30):
+    print("No time source has answered yet, using the system clock until one does")
+scheduler = IntervalScheduler(5 * 60, close_interval, offset=clock.offset())
+clock.subscribe(scheduler.set_offset)
+print(f"Clock: {clock.stats()}")
+
+tracker = IoUTracker(line=count_line, zone=count_zone)
+no_detections = np.empty(0, dtype=DETECTION_DTYPE)
+
+# Frames without motion skip preprocessing, inference and the tracker
+motion_gate = None
+if args.motiongate:
+    motion_gate = MotionGate(hold=float(args.motionhold), min_fraction=float(args.motionfraction),
+                             roi=count_zone, roi_size=(imW, imH))
+
+# The scheduler closes intervals from its own thread, and close_interval needs
+# everything above, so it only starts now
+if videostream.live:
+    print("Waiting for the next 5-minute interval...")
+    scheduler.wait_for_boundary()
+scheduler.start()
 
 print("Starting vehicle detection and upload process...")
 
-previous_vehicle_count = 0
-vehicle_passed_count = 0
-start_time = time.time()
-
 # Main loop for detection
 while True:
     # Start timer (for calculating frame rate)
@@ -114,99 +206,67 @@ while True:
 
     # Grab frame from video stream
     frame = videostream.read()
+    if frame is None:  # A recorded source has run out of frames
+        break
+    capture_time = time.monotonic()  # Vehicles are counted in the interval their frame was captured in
 
-    # Resize and normalize the image for NCNN
-    img = cv2.resize(frame, (target_size, target_size))
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-    # Create ncnn Mat from image
-    mat_in = ncnn.Mat.from_pixels(img, ncnn.Mat.PixelType.PIXEL_RGB, target_size, target_size)
-    mat_in.substract_mean_normalize(mean_vals, norm_vals)
-
-    # Create extractor
-    ex = net.create_extractor()
-    ex.set_light_mode(True)
-    ex.input("images", mat_in)  # Adjust input blob name if necessary
-
-    # Run inference
-    ret, mat_out = ex.extract("output")  # Adjust output blob name if necessary
-
-    # Parse detection results
-    detections = []
-    for i in range(mat_out.h):
-        values = mat_out.row(i).numpy()
-        # Adjust indices based on your model's output format
-        class_id = int(values[0])
-        score = values[1]
-        x1 = int(values[2] * imW)
-        y1 = int(values[3] * imH)
-        x2 = int(values[4] * imW)
-        y2 = int(values[5] * imH)
-
-        if score > min_conf_threshold:
-            detections.append([x1, y1, x2, y2, score, class_id])
-
-    current_vehicle_count = 0
-
-    # Draw detections on the frame
-    for detection in detections:
-        x1, y1, x2, y2, score, class_id = detection
-        current_vehicle_count += 1
-
-        # Draw bounding box
-        cv2.rectangle(frame, (x1, y1), (x2, y2), (10, 255, 0), 2)
-
-        # Draw label
-        object_name = labels[class_id]  # Look up object name from "labels" array using class index
-        label_text = '%s: %.2f%%' % (object_name, score * 100)
-        labelSize, baseLine = cv2.getTextSize(label_text, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
-        label_ymin = max(y1, labelSize[1] + 10)
-        cv2.rectangle(frame, (x1, label_ymin - labelSize[1] - 10), (x1 + labelSize[0], label_ymin + baseLine - 10),
-                      (255, 255, 255), cv2.FILLED)
-        cv2.putText(frame, label_text, (x1, label_ymin - 7), cv2.FONT_HERSHEY_SIMPLEX, 0.7,
-                    (0, 0, 0), 2)
-
-    # Check if the number of vehicles in the current frame is less than in the previous frame
-    if current_vehicle_count < previous_vehicle_count:
-        vehicle_passed_count += previous_vehicle_count - current_vehicle_count
-
-    # Update the previous vehicle count
-    previous_vehicle_count = current_vehicle_count
-
-    # Display the vehicle passed count in the top right corner of the frame
-    cv2.putText(frame, '#vehicles: {}'.format(vehicle_passed_count), (imW - 300, 50),
-                cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 0), 2, cv2.LINE_AA)
-
-    # Draw frame rate in the corner of the frame
-    cv2.putText(frame, 'FPS: {0:.2f}'.format(frame_rate_calc), (30, 50),
-                cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 0), 2, cv2.LINE_AA)
-
-    # Display the frame
-    cv2.imshow('Object detector', frame)
+    if motion_gate is None or motion_gate.update(frame, capture_time):
+        # Resize and colour convert the image for NCNN into a reused buffer
+        img = preprocessor.run(frame)[0]
+
+        # Create ncnn Mat from image
+        mat_in = ncnn.Mat.from_pixels(img, ncnn.Mat.PixelType.PIXEL_RGB, target_size, target_size)
+        mat_in.substract_mean_normalize(mean_vals, norm_vals)
+
+        # Create extractor
+        ex = net.create_extractor()
+        ex.set_light_mode(True)
+        ex.input(args.inputblob, mat_in)
+
+        # Run inference
+        ret, mat_out = ex.extract(args.outputblob)
+
+        # Decode the raw YOLO head and map the boxes back through the letterbox to the camera resolution
+        detections = decode_yolo(np.array(mat_out), len(labels), min_conf_threshold, iou_threshold,
+                                 preprocessor.frame_size, preprocessor.scale, preprocessor.pad,
+                                 output_size=(imW, imH), version=yolo_version)
+
+        # Follow every vehicle across frames and count it once, when it crosses the line or leaves the zone
+        scheduler.record(tracker.update(detections, capture_time))
+    else:
+        # Nothing moves, the tracks wait as they are for the next frame with motion
+        detections = no_detections
+
+    # Only draw when the frame will be shown or saved
+    save_snapshot = snapshot_writer is not None and snapshot_writer.due()
+    if not headless or save_snapshot:
+        # Boxes are in full resolution pixels, also when detecting on the lores stream
+        frame = videostream.read_full()
+
+        draw_detections(frame, drawable(detections, labels))
+        draw_counting_area(frame, count_line, count_zone)
+        draw_overlay(frame, scheduler.count(), frame_rate_calc)
+
+        if save_snapshot:
+            snapshot_writer.write(frame)
+
+        # Display the frame
+        if not headless:
+            cv2.imshow('Object detector', frame)
 
     # Calculate frame rate
     t2 = cv2.getTickCount()
     time1 = (t2 - t1) / freq
     frame_rate_calc = 1 / time1
 
-    # Check if 5 minutes have passed
-    if time.time() - start_time >= 5 * 60:  # 5 minutes
-        # Get current time and reset the timer
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"{current_time} - Uploading vehicle count: {vehicle_passed_count}")
-
-        # Run the upload script to send the vehicle count to Google Sheets
-        upload_thread = threading.Thread(target=run_upload_script, args=(vehicle_passed_count,))
-        upload_thread.start()
-
-        # Reset vehicle count and start time for the next 5-minute interval
-        vehicle_passed_count = 0
-        start_time = time.time()
-
     # Break the loop if 'q' is pressed
-    if cv2.waitKey(1) == ord('q'):
+    if not headless and cv2.waitKey(1) == ord('q'):
         break
 
-cv2.destroyAllWindows()
+# The interval that was running is uploaded with what was counted so far
+scheduler.stop()
+uploader.close()
+if not headless:
+    cv2.destroyAllWindows()
 videostream.stop()
 
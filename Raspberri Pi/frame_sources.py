@@ -0,0 +1,200 @@
+######## Frame sources other than the Pi camera #########
+#
+# These let the counters replay recorded traffic (a video file or a folder of
+# JPEGs) or read the MJPEG /stream endpoint of the ESP32 camera web server in
+# ESP32/CameraWebServer_FireBeetle. They implement the same FrameSource
+# interface as VideoStream, so the detection loop does not know the difference.
+
+import glob
+import os
+import urllib.request
+
+import cv2
+import numpy as np
+
+from video_stream import FrameSource, VideoStream
+
+def fit_frame(frame, resolution):
+    # Resize a frame to the requested (width, height), if one was requested
+    if resolution is None or (frame.shape[1], frame.shape[0]) == tuple(resolution):
+        return frame
+    return cv2.resize(frame, tuple(resolution))
+
+class VideoFileSource(FrameSource):
+    """Frames read from a recorded video file with cv2.VideoCapture"""
+    live = False
+
+    def __init__(self, path, resolution=None, buffer_size=3, policy=None):
+        self.path = path
+        self.resolution = resolution
+        self.capture_device = cv2.VideoCapture(path)
+        if not self.capture_device.isOpened():
+            raise IOError(f"Could not open video file: {path}")
+
+        frame = self.capture()
+        if frame is None:
+            raise IOError(f"Video file has no frames: {path}")
+        self.resolution = (frame.shape[1], frame.shape[0])
+        self.init_buffer(frame, buffer_size, policy)
+
+    def capture(self):
+        ret, frame = self.capture_device.read()
+        if not ret:
+            return None
+        return fit_frame(frame, self.resolution)
+
+    def close(self):
+        self.capture_device.release()
+
+class ImageDirectorySource(FrameSource):
+    """Frames read in file name order from a folder of images"""
+    live = False
+
+    def __init__(self, path, resolution=None, pattern='*.jpg', buffer_size=3, policy=None):
+        self.files = sorted(glob.glob(os.path.join(path, pattern)))
+        if not self.files:
+            raise IOError(f"No images matching {pattern} in {path}")
+        self.resolution = resolution
+        self.index = 0
+
+        frame = self.capture()
+        if frame is None:
+            raise IOError(f"None of the images in {path} could be read")
+        self.resolution = (frame.shape[1], frame.shape[0])
+        self.init_buffer(frame, buffer_size, policy)
+
+    def capture(self):
+        # Skip any file that OpenCV cannot decode
+        while self.index < len(self.files):
+            frame = cv2.imread(self.files[self.index])
+            self.index += 1
+            if frame is not None:
+                return fit_frame(frame, self.resolution)
+        return None
+
+def read_exactly(stream, length):
+    # Read length bytes, returns None if the stream ends first
+    data = bytearray()
+    while len(data) < length:
+        chunk = stream.read(length - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+def iter_multipart(stream, boundary):
+    """Yield (headers, body) for every part of a multipart stream.
+
+    The stream is read a line or one part at a time, so an endless
+    multipart/x-mixed-replace response never has to fit in memory. Parts with a
+    Content-Length header are read directly, otherwise the body runs up to the
+    next boundary line.
+    """
+    delimiter = b'--' + boundary
+    terminator = delimiter + b'--'
+
+    # Skip anything in front of the first boundary
+    while True:
+        line = stream.readline()
+        if not line:
+            return
+        if line.strip() == delimiter:
+            break
+
+    while True:
+        headers = {}
+        while True:
+            line = stream.readline()
+            if not line:
+                return
+            line = line.strip()
+            if not line:
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'content-length' in headers:
+            body = read_exactly(stream, int(headers['content-length']))
+            if body is None:
+                return
+            yield headers, body
+
+            # Move on to the next boundary
+            while True:
+                line = stream.readline()
+                if not line:
+                    return
+                line = line.strip()
+                if line == delimiter:
+                    break
+                if line == terminator:
+                    return
+        else:
+            body = bytearray()
+            while True:
+                line = stream.readline()
+                if not line:
+                    return
+                if line.strip() in (delimiter, terminator):
+                    break
+                body += line
+            # The CRLF in front of the boundary belongs to the boundary
+            if body.endswith(b'\r\n'):
+                del body[-2:]
+            yield headers, bytes(body)
+            if line.strip() == terminator:
+                return
+
+def parse_boundary(content_type):
+    # Get the boundary out of a 'multipart/x-mixed-replace;boundary=...' header
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.lower() == 'boundary':
+            value = value.strip('"')
+            # Some servers include the leading dashes in the parameter
+            if value.startswith('--'):
+                value = value[2:]
+            return value.encode('latin-1')
+    raise ValueError(f"No boundary in content type: {content_type}")
+
+class MJPEGStreamSource(FrameSource):
+    """Frames decoded from an MJPEG stream, such as http://<esp32-ip>:81/stream"""
+    live = True
+
+    def __init__(self, url, resolution=None, timeout=10, buffer_size=3, policy=None):
+        self.url = url
+        self.resolution = resolution
+        self.response = urllib.request.urlopen(url, timeout=timeout)
+        boundary = parse_boundary(self.response.headers.get('Content-Type', ''))
+        self.parts = iter_multipart(self.response, boundary)
+
+        frame = self.capture()
+        if frame is None:
+            raise IOError(f"No JPEG frames received from {url}")
+        self.resolution = (frame.shape[1], frame.shape[0])
+        self.init_buffer(frame, buffer_size, policy)
+
+    def capture(self):
+        for headers, body in self.parts:
+            frame = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+            # Skip parts that are not valid images
+            if frame is not None:
+                return fit_frame(frame, self.resolution)
+        return None
+
+    def close(self):
+        self.response.close()
+
+def open_frame_source(source, resolution=None, buffer_size=3, policy=None, lores_size=None):
+    """Open the Pi camera ('picamera'), an MJPEG URL, an image folder or a video file.
+
+    lores_size only applies to the Pi camera, the other sources are resized by the
+    preprocessing step instead.
+    """
+    if source == 'picamera':
+        return VideoStream(resolution=resolution, buffer_size=buffer_size, policy=policy, lores_size=lores_size)
+    if source.startswith('http://') or source.startswith('https://'):
+        return MJPEGStreamSource(source, resolution, buffer_size=buffer_size, policy=policy)
+    if os.path.isdir(source):
+        return ImageDirectorySource(source, resolution, buffer_size=buffer_size, policy=policy)
+    return VideoFileSource(source, resolution, buffer_size=buffer_size, policy=policy)
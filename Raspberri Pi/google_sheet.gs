@@ -0,0 +1,167 @@
+// Apps Script web app behind wifi_log.UPLOAD_URL, bound to the vehicle count sheet
+//
+// Deploy it from the sheet (Extensions > Apps Script > Deploy > New deployment,
+// type web app, execute as me, access anyone) and put the /exec URL in
+// wifi_log.UPLOAD_URL or --uploadurl.
+//
+// doGet keeps the ?date=&time=&value= upload of wifi_log.send_http_request, and
+// stores nothing for a request without a numeric value, such as a HEAD or a
+// visit in a browser.
+// doPost takes the JSON batches of wifi_log.send_batch, and the binary batches
+// of payload.py that the SIM800 posts in base64 as text/plain. Every row has
+// the Pi's outbox key, whichever way it came, so a row sent over WiFi and again
+// over GSM is stored once. Binary rows have their date and time in the script's
+// time zone (File > Project settings), which has to be the Pi's. A row whose key is
+// already in the sheet is not appended again, so a batch that is sent twice
+// after a lost answer is harmless. Both answer with JSON listing the keys the
+// sheet holds now, and the Pi only marks those rows as sent. An error answers
+// ok false instead of an error page.
+
+var COLUMNS = 6;          // Date, time, value, key, classes, directions
+var KEY_COLUMN = 4;
+var RECENT_KEYS = 5000;   // Only recent rows are sent twice, older keys are not read
+var FLAG_DEFLATE = 1;     // Flags of payload.py
+var FLAG_GZIP = 2;
+var FLAG_HEX_KEYS = 4;
+
+function doGet(e) {
+  var p = e.parameter;
+  return answer(function () {
+    if (p.value === undefined || p.value === '' || isNaN(Number(p.value))) {
+      throw new Error('No value to store');
+    }
+    return store([{key: p.key || '', date: p.date, time: p.time, value: p.value}]);
+  });
+}
+
+function doPost(e) {
+  return answer(function () {
+    if (e.postData.type === 'text/plain') {
+      return store(decodeBatch(Utilities.base64Decode(e.postData.contents)));
+    }
+    return store(JSON.parse(e.postData.contents).rows);
+  });
+}
+
+function answer(run) {
+  var result;
+  try {
+    result = {ok: true, keys: run()};
+  } catch (error) {
+    result = {ok: false, error: String(error)};
+  }
+  return ContentService.createTextOutput(JSON.stringify(result)).setMimeType(ContentService.MimeType.JSON);
+}
+
+function store(rows) {
+  // Appends the rows with a new key and returns the keys of every row
+  var lock = LockService.getScriptLock();
+  lock.waitLock(30000);
+  try {
+    var sheet = SpreadsheetApp.getActiveSpreadsheet().getSheets()[0];
+    var seen = recentKeys(sheet);
+    var keys = [];
+    var values = [];
+    rows.forEach(function (row) {
+      var key = String(row.key || '');
+      if (!key || !seen[key]) {
+        values.push([row.date, row.time, Number(row.value), key,
+                     row.classes ? JSON.stringify(row.classes) : '',
+                     row.directions ? JSON.stringify(row.directions) : '']);
+        seen[key] = true;
+      }
+      keys.push(key);
+    });
+    if (values.length) {
+      sheet.getRange(sheet.getLastRow() + 1, 1, values.length, COLUMNS).setValues(values);
+    }
+    return keys;
+  } finally {
+    lock.releaseLock();
+  }
+}
+
+function recentKeys(sheet) {
+  var seen = {};
+  var last = sheet.getLastRow();
+  if (last < 1) {
+    return seen;
+  }
+  var first = Math.max(1, last - RECENT_KEYS + 1);
+  sheet.getRange(first, KEY_COLUMN, last - first + 1, 1).getValues().forEach(function (cell) {
+    if (cell[0] !== '') {
+      seen[String(cell[0])] = true;
+    }
+  });
+  return seen;
+}
+
+function decodeBatch(data) {
+  // Rows of a payload.py encode_batch(), like decode_batch() there
+  var bytes = data.map(function (b) { return b & 0xff; });   // Apps Script bytes are signed
+  if (bytes[0] !== 0x56 || bytes[1] !== 0x43) {
+    throw new Error('Not a vehicle count payload');
+  }
+  var version = bytes[2];
+  if (version !== 1 && version !== 2) {
+    throw new Error('Unsupported payload version ' + bytes[2]);
+  }
+  if (bytes[3] & FLAG_DEFLATE) {
+    throw new Error('Raw deflate cannot be inflated here, the Pi sends gzip');
+  }
+  var body = bytes.slice(4);
+  if (bytes[3] & FLAG_GZIP) {
+    var gzip = Utilities.newBlob(data.slice(4), 'application/x-gzip');
+    body = Utilities.ungzip(gzip).getBytes().map(function (b) { return b & 0xff; });
+  }
+
+  var position = 0;
+  function varint() {
+    // Multiplied, not shifted: a timestamp does not fit the 32 bit shifts
+    var value = 0;
+    var scale = 1;
+    while (true) {
+      var byte = body[position++];
+      value += (byte & 0x7f) * scale;
+      if (byte < 0x80) {
+        return value;
+      }
+      scale *= 128;
+    }
+  }
+
+  function key(timestamp) {
+    // Version 1 rows are keyed by their timestamp
+    if (version === 1) {
+      return String(timestamp);
+    }
+    var length = bytes[3] & FLAG_HEX_KEYS ? 16 : varint();
+    var raw = body.slice(position, position + length);
+    position += length;
+    if (bytes[3] & FLAG_HEX_KEYS) {
+      return raw.map(function (b) { return (b < 16 ? '0' : '') + b.toString(16); }).join('');
+    }
+    return Utilities.newBlob(raw.map(function (b) { return b > 127 ? b - 256 : b; })).getDataAsString();
+  }
+
+  var timeZone = Session.getScriptTimeZone();
+  var timestamp = varint();
+  var numClasses = varint();
+  var numRows = varint();
+  var rows = [];
+  for (var i = 0; i < numRows; i++) {
+    var delta = varint();
+    timestamp += delta % 2 === 0 ? delta / 2 : -(delta + 1) / 2;   // Zigzag
+    var total = varint();
+    var classes = {};
+    for (var c = 0; c < numClasses; c++) {
+      classes[c] = varint();
+    }
+    var directions = {'1': varint(), '-1': varint()};
+    var when = new Date(timestamp * 1000);
+    rows.push({key: key(timestamp), date: Utilities.formatDate(when, timeZone, 'dd/MM/yyyy'),
+               time: Utilities.formatDate(when, timeZone, 'HH:mm'), value: total,
+               classes: classes, directions: directions});
+  }
+  return rows;
+}
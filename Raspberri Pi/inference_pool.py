@@ -0,0 +1,163 @@
+######## Pool of TFLite interpreters for CPU inference #########
+#
+# One interpreter with the default thread count leaves most of a 4-core Pi idle.
+# The pool runs several interpreters, each with its own number of threads, on
+# worker threads or worker processes. Frames are handed out round-robin and the
+# results are put back in frame order, so the tracker and counter still see the
+# frames in the order they were captured.
+
+import importlib.util
+import multiprocessing
+import queue
+import threading
+
+# Job of InferencePool.reload(): the worker replaces its interpreter
+RELOAD = 'reload'
+
+def load_interpreter(model_path, num_threads=None, use_TPU=False):
+    """Create and allocate a TFLite interpreter.
+
+    If tflite_runtime is installed the interpreter is imported from there, else
+    from regular tensorflow. With use_TPU the model runs on the Coral Edge TPU.
+    """
+    if importlib.util.find_spec('tflite_runtime'):
+        from tflite_runtime.interpreter import Interpreter, load_delegate
+    else:
+        from tensorflow.lite.python.interpreter import Interpreter, load_delegate
+
+    if use_TPU:
+        interpreter = Interpreter(model_path=model_path, num_threads=num_threads,
+                                  experimental_delegates=[load_delegate('libedgetpu.so.1.0')])
+    else:
+        interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+    interpreter.allocate_tensors()
+    return interpreter
+
+def run_interpreter(interpreter, input_index, output_indices, input_data):
+    interpreter.set_tensor(input_index, input_data)
+    interpreter.invoke()
+    return [interpreter.get_tensor(index) for index in output_indices]
+
+def inference_worker(make_interpreter, inputs, results):
+    # Runs in a worker thread or process: input data in, every output tensor out.
+    # A list of inputs, such as the tiles of a frame, gives a list of outputs.
+    interpreter = make_interpreter()
+    input_index = interpreter.get_input_details()[0]['index']
+    output_indices = [output['index'] for output in interpreter.get_output_details()]
+
+    while True:
+        job = inputs.get()
+        if job is None:
+            break
+        seq, input_data = job
+        if seq == RELOAD:
+            # A new model, for the frames queued after this job
+            try:
+                interpreter = input_data()
+            except Exception as e:
+                results.put((seq, None, repr(e)))
+                continue
+            input_index = interpreter.get_input_details()[0]['index']
+            output_indices = [output['index'] for output in interpreter.get_output_details()]
+            continue
+        try:
+            if isinstance(input_data, list):
+                outputs = [run_interpreter(interpreter, input_index, output_indices, data) for data in input_data]
+            else:
+                outputs = run_interpreter(interpreter, input_index, output_indices, input_data)
+            results.put((seq, outputs, None))
+        except Exception as e:
+            results.put((seq, None, repr(e)))
+
+class InferencePool:
+    """Runs inference on workers interpreters, each created by make_interpreter().
+
+    submit() hands a frame to the next worker in turn and blocks while every
+    worker already has max_pending frames, skip() lets a frame through without
+    inference. ready() returns the finished frames
+    in submission order and drain() waits for all of them. With use_processes
+    every worker is a separate process (forked, so make_interpreter can be any
+    function), which avoids any GIL contention between the interpreters.
+    reload() switches the workers to another model without starting new ones.
+    """
+    def __init__(self, make_interpreter, workers=2, use_processes=False, max_pending=2):
+        self.workers = workers
+        self.max_in_flight = workers * max_pending
+
+        if use_processes:
+            context = multiprocessing.get_context('fork')
+            self.inputs = [context.Queue(maxsize=max_pending) for _ in range(workers)]
+            self.results = context.Queue()
+            self.handles = [context.Process(target=inference_worker, args=(make_interpreter, q, self.results), daemon=True)
+                            for q in self.inputs]
+        else:
+            self.inputs = [queue.Queue(maxsize=max_pending) for _ in range(workers)]
+            self.results = queue.Queue()
+            self.handles = [threading.Thread(target=inference_worker, args=(make_interpreter, q, self.results), daemon=True)
+                            for q in self.inputs]
+        for handle in self.handles:
+            handle.start()
+
+        self.next_worker = 0
+        self.pending = {}    # seq -> item, in submission order
+        self.finished = {}   # seq -> outputs that came back early
+
+    def submit(self, seq, input_data, item=None):
+        """Queue input_data for inference, item is handed back with its outputs"""
+        # Backpressure: never have more frames in flight than the workers can queue
+        while len(self.pending) - len(self.finished) >= self.max_in_flight:
+            self.collect(block=True)
+        self.pending[seq] = item
+        self.inputs[self.next_worker].put((seq, input_data))
+        self.next_worker = (self.next_worker + 1) % self.workers
+
+    def skip(self, seq, item=None):
+        """Pass a frame on in order without inference, its outputs are None"""
+        self.pending[seq] = item
+        self.finished[seq] = None
+
+    def collect(self, block):
+        # Move results from the result queue into finished
+        while True:
+            try:
+                seq, outputs, error = self.results.get(block=block)
+            except queue.Empty:
+                return
+            if error is not None:
+                raise RuntimeError(f"Inference failed on frame {seq}: {error}")
+            self.finished[seq] = outputs
+            block = False
+
+    def ready(self):
+        """(item, outputs) of every finished frame that is next in order, without waiting"""
+        self.collect(block=False)
+        done = []
+        while self.pending:
+            seq = next(iter(self.pending))
+            if seq not in self.finished:
+                break
+            done.append((self.pending.pop(seq), self.finished.pop(seq)))
+        return done
+
+    def drain(self):
+        # Wait for every frame still in flight
+        done = []
+        while self.pending:
+            self.collect(block=True)
+            done.extend(self.ready())
+        return done
+
+    def reload(self, make_interpreter):
+        """Have every worker create a new interpreter, the frames already submitted run on the old one.
+
+        With use_processes make_interpreter is sent to the workers, so it must
+        pickle, such as a functools.partial of load_interpreter.
+        """
+        for q in self.inputs:
+            q.put((RELOAD, make_interpreter))
+
+    def close(self):
+        for q in self.inputs:
+            q.put(None)
+        for handle in self.handles:
+            handle.join(timeout=5)
@@ -0,0 +1,201 @@
+######## Registry of the detection model versions #########
+#
+# Every model generation lives in its own folder (Machine Learning/v1 to v5 in
+# the repository, /home/russouw/vN on the Pi). The folder holds
+# detect_quant.tflite, from v2 on also edgetpu.tflite, plus labelmap.txt and the
+# pipeline_file.config the model was trained with. ModelVersion reads such a
+# folder once. DetectionModel loads a graph from it and resolves the input and
+# output tensors once, so the detection loop only does plain index lookups.
+#
+# TFLite memory-maps a .tflite opened by path, so the interpreters of an
+# InferencePool share one copy of the weights. The Edge TPU delegate is only
+# looked for when --edgetpu asks for it. If it cannot be loaded, the CPU graph
+# is used instead.
+
+import functools
+import glob
+import importlib.util
+import os
+import re
+import threading
+
+import numpy as np
+
+from inference_pool import load_interpreter
+
+CPU_GRAPHS = ('detect_quant.tflite', 'detect.tflite')
+EDGETPU_GRAPH = 'edgetpu.tflite'
+
+def read_labels(path):
+    with open(path, 'r') as f:
+        labels = [line.strip() for line in f if line.strip()]
+    # The COCO starter model's first label is '???', which has to be removed
+    if labels and labels[0] == '???':
+        del labels[0]
+    return labels
+
+def read_pipeline_config(path):
+    # Class count and fixed input size from a TensorFlow Object Detection API pipeline config
+    with open(path, 'r') as f:
+        text = f.read()
+    config = {}
+    classes = re.search(r'num_classes:\s*(\d+)', text)
+    if classes:
+        config['num_classes'] = int(classes.group(1))
+    resizer = re.search(r'fixed_shape_resizer\s*{\s*height:\s*(\d+)\s*width:\s*(\d+)', text)
+    if resizer:
+        config['input_size'] = (int(resizer.group(2)), int(resizer.group(1)))
+    return config
+
+class ModelVersion:
+    """The graphs, labels and training settings of one model folder"""
+    def __init__(self, folder, labelmap='labelmap.txt'):
+        self.folder = folder
+        self.name = os.path.basename(os.path.normpath(folder))
+        self.labels = read_labels(os.path.join(folder, labelmap))
+        config_path = os.path.join(folder, 'pipeline_file.config')
+        config = read_pipeline_config(config_path) if os.path.exists(config_path) else {}
+        self.num_classes = config.get('num_classes', len(self.labels))
+        self.input_size = config.get('input_size')
+        self.graphs = sorted(os.path.basename(path) for path in glob.glob(os.path.join(folder, '*.tflite')))
+
+    def graph_path(self, use_TPU=False, graph=None):
+        # An explicit graph wins, else the Edge TPU graph or the first CPU graph there is
+        if graph is None:
+            wanted = ((EDGETPU_GRAPH,) if use_TPU else ()) + CPU_GRAPHS
+            graph = next((name for name in wanted if name in self.graphs), None)
+        if graph is None or graph not in self.graphs:
+            raise FileNotFoundError(f"No {graph or ' or '.join(CPU_GRAPHS)} in {self.folder}")
+        return os.path.join(self.folder, graph)
+
+def version_key(name):
+    # v2 before v10
+    number = re.sub(r'\D', '', name)
+    return (int(number) if number else -1, name)
+
+def scan_models(root):
+    """{name: ModelVersion} of every folder in root with a .tflite and a labelmap, oldest first"""
+    versions = {}
+    for folder in sorted(glob.glob(os.path.join(root, '*')), key=lambda path: version_key(os.path.basename(path))):
+        if glob.glob(os.path.join(folder, '*.tflite')) and os.path.exists(os.path.join(folder, 'labelmap.txt')):
+            versions[os.path.basename(folder)] = ModelVersion(folder)
+    return versions
+
+def find_model(root, name):
+    # A version by name, 'latest' for the newest
+    versions = scan_models(root)
+    if not versions:
+        raise FileNotFoundError(f"No models in {root}")
+    if name == 'latest':
+        return versions[list(versions)[-1]]
+    if name not in versions:
+        raise FileNotFoundError(f"No model {name} in {root}, there are {', '.join(versions)}")
+    return versions[name]
+
+edgetpu_checked = None
+
+def edgetpu_available():
+    # Loading the delegate fails without a Coral or libedgetpu, tried once
+    global edgetpu_checked
+    if edgetpu_checked is None:
+        try:
+            if importlib.util.find_spec('tflite_runtime'):
+                from tflite_runtime.interpreter import load_delegate
+            else:
+                from tensorflow.lite.python.interpreter import load_delegate
+            load_delegate('libedgetpu.so.1.0')
+            edgetpu_checked = True
+        except (ValueError, OSError, RuntimeError) as e:
+            print(f"Edge TPU not available, running on the CPU: {e}")
+            edgetpu_checked = False
+    return edgetpu_checked
+
+def output_layout(interpreter, output_details):
+    """Positions of boxes, classes and scores in output_details.
+
+    The outputs of TFLite_Detection_PostProcess are boxes, classes, scores and
+    count, in that order. When the interpreter can list its ops, that order is
+    used. Otherwise the names decide: TF2 models ('StatefulPartitionedCall:n')
+    list the outputs in another order than TF1 models.
+    """
+    positions = {output['index']: i for i, output in enumerate(output_details)}
+    try:
+        for op in interpreter._get_ops_details():
+            if op['op_name'] == 'TFLite_Detection_PostProcess':
+                return tuple(positions[index] for index in op['outputs'][:3])
+    except (AttributeError, KeyError, ValueError):
+        pass
+    if 'StatefulPartitionedCall' in output_details[0]['name']:
+        return 1, 3, 0
+    return 0, 1, 2
+
+class DetectionModel:
+    """An SSD detection model with its tensors resolved once.
+
+    use_TPU falls back to the CPU graph if the Edge TPU cannot be used.
+    make_interpreter() creates more interpreters for the same graph, for an
+    InferencePool, and interpreter_factory() is a function that does the same
+    and can be sent to its worker processes. start_warm_up() runs the first, slow invoke in the background
+    while the camera and uploads start.
+    """
+    def __init__(self, version, use_TPU=False, num_threads=None, graph=None):
+        self.version = version
+        self.labels = version.labels
+        self.num_threads = num_threads
+        self.use_TPU = use_TPU and edgetpu_available()
+        if use_TPU and not self.use_TPU and graph == EDGETPU_GRAPH:
+            graph = None    # The Edge TPU graph cannot run on the CPU
+        self.path = version.graph_path(self.use_TPU, graph)
+        if self.use_TPU and os.path.basename(self.path) != EDGETPU_GRAPH:
+            print(f"{self.path} is not compiled for the Edge TPU, it runs mostly on the CPU")
+
+        self.interpreter = self.make_interpreter()
+        self.input_details = self.interpreter.get_input_details()
+        self.output_details = self.interpreter.get_output_details()
+        self.input_index = self.input_details[0]['index']
+        self.height, self.width = (int(value) for value in self.input_details[0]['shape'][1:3])
+        self.floating = self.input_details[0]['dtype'] == np.float32
+        self.boxes_idx, self.classes_idx, self.scores_idx = output_layout(self.interpreter, self.output_details)
+        self.output_indices = [output['index'] for output in self.output_details]
+
+        if version.input_size and version.input_size != (self.width, self.height):
+            print(f"{self.path} takes {self.width}x{self.height} frames, its pipeline config says "
+                  f"{version.input_size[0]}x{version.input_size[1]}")
+        if version.num_classes != len(self.labels):
+            print(f"{version.name} was trained on {version.num_classes} classes but its labelmap has {len(self.labels)}")
+
+        self.warm_up_thread = None
+
+    def make_interpreter(self):
+        return load_interpreter(self.path, self.num_threads, self.use_TPU)
+
+    def interpreter_factory(self):
+        return functools.partial(load_interpreter, self.path, self.num_threads, self.use_TPU)
+
+    def warm_up(self):
+        # The first invoke prepares the kernels and is several times slower than the rest
+        self.interpreter.set_tensor(self.input_index, np.zeros(self.input_details[0]['shape'], self.input_details[0]['dtype']))
+        self.interpreter.invoke()
+
+    def self_test(self):
+        # Warm up and check the outputs can be read as SSD detections, raises ValueError if not
+        self.warm_up()
+        outputs = self.outputs()
+        boxes, classes, scores = (outputs[i] for i in (self.boxes_idx, self.classes_idx, self.scores_idx))
+        if boxes.ndim != 3 or boxes.shape[-1] != 4 or classes.shape != scores.shape or classes.shape != boxes.shape[:2]:
+            raise ValueError(f"{self.path} outputs {[output.shape for output in outputs]} are not SSD detections")
+
+    def start_warm_up(self):
+        self.warm_up_thread = threading.Thread(target=self.warm_up, daemon=True)
+        self.warm_up_thread.start()
+
+    def wait_ready(self):
+        # Call before using the interpreter if start_warm_up() was called
+        if self.warm_up_thread is not None:
+            self.warm_up_thread.join()
+            self.warm_up_thread = None
+
+    def outputs(self, interpreter=None):
+        """Every output tensor, in the order of output_details"""
+        interpreter = interpreter or self.interpreter
+        return [interpreter.get_tensor(index) for index in self.output_indices]
@@ -0,0 +1,129 @@
+######## Switching models while the counter runs #########
+#
+# Restarting count_vehicles.py for a new model loses the running 5-minute count
+# and waits for the camera, the clock and the next interval all over again.
+# ModelSwapper watches a control file that names the model to run, and the graph
+# file of the running model. When either changes, the new model is loaded,
+# warmed up and tried on a blank frame on a background thread. The detection
+# loop takes it between two frames, so the tracker, the interval counts and the
+# uploads carry on as they are. A model that fails to load, has other labels or
+# gives unusable outputs is not taken, the running model keeps going.
+
+import os
+import threading
+
+from model_registry import ModelVersion, find_model
+
+class ModelSwapper:
+    """Loads the model named in control_path in the background when it changes.
+
+    The control file holds a version name in root (such as v5), 'latest' or a
+    model folder. make_model(version) loads a DetectionModel. prepare(model), if
+    given, returns what the detection loop runs the model with (such as its
+    preprocessor and buffers), else the model itself. take() hands that over once, in the
+    detection loop. A graph file that is replaced in place is reloaded as well,
+    after its modification time has stayed the same for one poll. prepare runs
+    on the swapper's thread, so it must not start worker processes: a fork
+    there copies whatever locks the other threads hold. A model that another one
+    replaces before take() is dropped with what prepare made for it.
+    """
+    def __init__(self, control_path, model, root, make_model, prepare=None, poll=5.0):
+        self.control_path = control_path
+        self.model = model
+        self.root = root
+        self.make_model = make_model
+        self.prepare = prepare
+        self.poll = poll
+
+        self.lock = threading.Lock()
+        self.pending = None
+        self.swaps = 0
+        self.failures = 0
+        self.last_error = None
+
+        # What is running now, so only changes trigger a load
+        self.control_seen = self.read_control()
+        self.graph_seen = self.mtime(model.path)
+        self.graph_last = self.graph_seen
+
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join(timeout=self.poll + 1)
+
+    def mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def read_control(self):
+        try:
+            with open(self.control_path, 'r') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def run(self):
+        while not self.stopping.wait(self.poll):
+            name = self.read_control()
+            if name is not None and name != self.control_seen:
+                self.control_seen = name
+                self.load(name)
+                continue
+
+            # A graph copied over the running one, once the copy has finished
+            graph = self.mtime(self.model.path)
+            settled = graph == self.graph_last
+            self.graph_last = graph
+            if graph is not None and graph != self.graph_seen and settled:
+                self.graph_seen = graph
+                self.load(self.model.version.folder)
+
+    def resolve(self, name):
+        if os.path.isdir(name):
+            return ModelVersion(name)
+        return find_model(self.root, name)
+
+    def load(self, name):
+        print(f"Loading model {name} in the background...")
+        try:
+            model = self.make_model(self.resolve(name))
+            if model.labels != self.model.labels:
+                raise ValueError(f"labels {model.labels} differ from the running {self.model.labels}, "
+                                 "the counts are kept per class")
+            model.self_test()
+            prepared = self.prepare(model) if self.prepare is not None else model
+        except Exception as e:
+            # Roll back: nothing was handed over, the running model carries on
+            self.failures += 1
+            self.last_error = f"{name}: {e!r}"
+            print(f"Model {name} not used, keeping {self.model.path}: {e!r}")
+            return
+        with self.lock:
+            replaced, self.pending = self.pending, (model, prepared)
+        if replaced is not None:
+            print(f"Model {replaced[0].path} was replaced by {model.path} before it was used")
+
+    def take(self):
+        """What the new model runs with, once after it is ready, else None"""
+        if self.pending is None:
+            return None
+        with self.lock:
+            model, prepared = self.pending
+            self.pending = None
+        self.model = model
+        self.graph_seen = self.graph_last = self.mtime(model.path)
+        self.swaps += 1
+        print(f"Switched to model {model.path}")
+        return prepared
+
+    def stats(self):
+        return {'model': self.model.path, 'swaps': self.swaps, 'failures': self.failures,
+                'last_error': self.last_error}
@@ -0,0 +1,83 @@
+######## Durable outbox for the interval counts #########
+#
+# Every interval count is written to a small SQLite database before it is
+# uploaded, so a WiFi or GSM outage, or a reboot, never loses a data point. Each
+# row gets an idempotency key when it is recorded. A retried upload sends the same
+# keys again, and the receiving side ignores keys it has already stored.
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+class Outbox:
+    """Append-only queue of counts waiting for upload, kept in an SQLite file.
+
+    add() records a count, with optional details such as per class counts, and
+    pending() returns the oldest unsent rows as (id, key, timestamp, value,
+    details) tuples. Once a batch has been accepted, mark_sent() marks it sent.
+    Sent rows are kept for keep_days and then pruned.
+    """
+    def __init__(self, path, keep_days=7):
+        self.path = path
+        self.keep_days = keep_days
+        self.lock = threading.Lock()
+        # Used from the detection loop and the upload thread, the lock serializes them
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS outbox (
+                               id INTEGER PRIMARY KEY,
+                               key TEXT UNIQUE NOT NULL,
+                               timestamp REAL NOT NULL,
+                               value INTEGER NOT NULL,
+                               attempts INTEGER NOT NULL DEFAULT 0,
+                               sent REAL,
+                               details TEXT)''')
+        # Outboxes from before details were kept
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(outbox)')]
+        if 'details' not in columns:
+            self.db.execute('ALTER TABLE outbox ADD COLUMN details TEXT')
+        self.db.execute('CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (sent, id)')
+        self.db.commit()
+
+    def add(self, value, timestamp=None, key=None, details=None):
+        """Record a count, returns its idempotency key"""
+        key = key or uuid.uuid4().hex
+        timestamp = timestamp if timestamp is not None else time.time()
+        details = json.dumps(details) if details is not None else None
+        with self.lock:
+            self.db.execute('INSERT OR IGNORE INTO outbox (key, timestamp, value, details) VALUES (?, ?, ?, ?)',
+                            (key, timestamp, int(value), details))
+            self.db.commit()
+        return key
+
+    def pending(self, limit=20):
+        with self.lock:
+            rows = self.db.execute('SELECT id, key, timestamp, value, details FROM outbox WHERE sent IS NULL ORDER BY id LIMIT ?',
+                                   (limit,)).fetchall()
+        return [(i, key, timestamp, value, json.loads(details) if details else None)
+                for i, key, timestamp, value, details in rows]
+
+    def mark_sent(self, ids):
+        now = time.time()
+        with self.lock:
+            self.db.executemany('UPDATE outbox SET sent = ? WHERE id = ?', [(now, i) for i in ids])
+            self.db.execute('DELETE FROM outbox WHERE sent < ?', (now - self.keep_days * 86400,))
+            self.db.commit()
+
+    def mark_failed(self, ids):
+        with self.lock:
+            self.db.executemany('UPDATE outbox SET attempts = attempts + 1 WHERE id = ?', [(i,) for i in ids])
+            self.db.commit()
+
+    def stats(self):
+        # Rows waiting and the age in seconds of the oldest one
+        with self.lock:
+            size, oldest = self.db.execute('SELECT COUNT(*), MIN(timestamp) FROM outbox WHERE sent IS NULL').fetchone()
+        return {'pending': size, 'oldest_pending_age': time.time() - oldest if oldest is not None else 0.0}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
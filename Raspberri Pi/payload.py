@@ -0,0 +1,149 @@
+######## Compact batch payload for GSM uploads #########
+#
+# Over GSM every byte is billed, so a batch of interval counts can be sent as a
+# small binary body instead of JSON. Timestamps are delta encoded, every number
+# is a varint, and the body is deflated when that makes it smaller. A row
+# carries the interval total and its counts per class and per direction of the
+# counting line (the lanes). decode_batch() is the matching decoder, and
+# decodeBatch() in google_sheet.gs the one of the sheet. Apps Script reads a
+# post body as text, so the SIM800 posts encode_body(), the payload in base64.
+#
+# Layout, version 2:
+#   b'VC', version, flags (bit 0: body is raw deflate, bit 1: body is gzip,
+#   which Apps Script can inflate, bit 2: keys are 32 hex digits)
+#   body: base timestamp, class count, row count, then per row the timestamp
+#         delta to the previous row, total, one count per class, count towards
+#         +1 and count towards -1, all unsigned varints except the delta
+#         (zigzag), and the row's key. Timestamps are whole seconds.
+#
+# The key is the outbox key, the same one a JSON row carries, so the sheet
+# deduplicates a row the same way whichever link it came over. Outbox keys are
+# uuid hex and go as their 16 bytes; any other key as its length and UTF-8
+# bytes. Version 1 is version 2 without keys; its rows are keyed by timestamp.
+
+import base64
+import zlib
+
+MAGIC = b'VC'
+VERSION = 2
+FLAG_DEFLATE = 1
+FLAG_GZIP = 2
+FLAG_HEX_KEYS = 4
+
+def write_varint(out, value):
+    value = int(value)
+    if value < 0:
+        raise ValueError(f"varint must not be negative, got {value}")
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data, position):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+def zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+def unzigzag(value):
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+def row_details(details, num_classes):
+    # Per class counts and (towards +1, towards -1) from a details dict
+    details = details or {}
+    classes = details.get('classes', {})
+    directions = details.get('directions', {})
+    class_counts = [int(classes.get(str(i), classes.get(i, 0))) for i in range(num_classes)]
+    lanes = [int(directions.get('1', directions.get(1, 0))), int(directions.get('-1', directions.get(-1, 0)))]
+    return class_counts, lanes
+
+def is_hex_key(key):
+    return len(key) == 32 and all(c in '0123456789abcdef' for c in key)
+
+def encode_batch(rows, num_classes=0, compress=True):
+    """Binary payload for rows of (key, timestamp, total, details).
+
+    details is a dict with 'classes' ({class_id: count}) and 'directions'
+    ({1: count, -1: count}), or None.
+    """
+    flags = FLAG_HEX_KEYS if all(is_hex_key(row[0]) for row in rows) else 0
+    body = bytearray()
+    base = int(rows[0][1]) if rows else 0
+    write_varint(body, base)
+    write_varint(body, num_classes)
+    write_varint(body, len(rows))
+    previous = base
+    for key, timestamp, total, details in rows:
+        timestamp = int(timestamp)
+        write_varint(body, zigzag(timestamp - previous))
+        previous = timestamp
+        write_varint(body, total)
+        class_counts, lanes = row_details(details, num_classes)
+        for count in class_counts + lanes:
+            write_varint(body, count)
+        if flags & FLAG_HEX_KEYS:
+            body += bytes.fromhex(key)
+        else:
+            key = key.encode()
+            write_varint(body, len(key))
+            body += key
+
+    if compress:
+        # Gzip, 18 bytes more than raw deflate, but Utilities.ungzip() reads it
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+        compressed = compressor.compress(bytes(body)) + compressor.flush()
+        if len(compressed) < len(body):
+            body = compressed
+            flags |= FLAG_GZIP
+    return MAGIC + bytes([VERSION, flags]) + bytes(body)
+
+def encode_body(rows, num_classes=0):
+    # encode_batch() as the base64 text the SIM800 posts
+    return base64.b64encode(encode_batch(rows, num_classes))
+
+def decode_batch(data):
+    """Rows of an encode_batch() payload as dicts with key, timestamp, total, classes and directions"""
+    if data[:2] != MAGIC:
+        raise ValueError("Not a vehicle count payload")
+    if data[2] not in (1, VERSION):
+        raise ValueError(f"Unsupported payload version {data[2]}")
+    body = data[4:]
+    if data[3] & FLAG_DEFLATE:
+        body = zlib.decompress(body, -15)
+    elif data[3] & FLAG_GZIP:
+        body = zlib.decompress(body, 31)
+
+    base, position = read_varint(body, 0)
+    num_classes, position = read_varint(body, position)
+    num_rows, position = read_varint(body, position)
+    rows = []
+    timestamp = base
+    for _ in range(num_rows):
+        delta, position = read_varint(body, position)
+        timestamp += unzigzag(delta)
+        total, position = read_varint(body, position)
+        counts = []
+        for _ in range(num_classes + 2):
+            count, position = read_varint(body, position)
+            counts.append(count)
+        if data[2] == 1:
+            key = str(timestamp)
+        elif data[3] & FLAG_HEX_KEYS:
+            key = body[position:position + 16].hex()
+            position += 16
+        else:
+            length, position = read_varint(body, position)
+            key = body[position:position + length].decode()
+            position += length
+        rows.append({'key': key, 'timestamp': timestamp, 'total': total,
+                     'classes': {i: count for i, count in enumerate(counts[:num_classes])},
+                     'directions': {1: counts[num_classes], -1: counts[num_classes + 1]}})
+    return rows
@@ -0,0 +1,195 @@
+######## Staged pipeline runner for the detection loop #########
+#
+# The detection loop is split into stages (capture, preprocess, inference,
+# post-processing). In threaded mode every stage runs on its own worker, connected
+# by small bounded queues: a slow stage makes the stages before it wait instead of
+# piling up frames (backpressure), and while the interpreter runs on one frame the
+# next frame is already being captured and preprocessed. OpenCV and the TFLite
+# interpreter release the GIL in their C code, so the stages really overlap on a
+# multi-core Pi. The same stages can also run one after the other on one thread.
+
+import queue
+import threading
+import time
+
+# Passed down the queues when the source has run out of items
+END = object()
+
+class Stage:
+    """One step of the pipeline with its own counters"""
+    def __init__(self, name, function, flush=None):
+        self.name = name
+        self.function = function
+        self.flush = flush
+        self.items = 0
+        self.busy_time = 0.0
+
+    def call(self, *args):
+        start = time.perf_counter()
+        result = self.function(*args)
+        self.busy_time += time.perf_counter() - start
+        self.items += 1
+        return result
+
+    def finish(self):
+        # Items the stage still holds once its input has ended
+        if self.flush is None:
+            return []
+        return self.flush()
+
+def as_items(result):
+    # A stage returns one item, a list of items or None
+    if result is None:
+        return []
+    if isinstance(result, list):
+        return result
+    return [result]
+
+class Pipeline:
+    """Runs a source stage followed by processing stages.
+
+    stages is a list of (name, function) or (name, function, flush) tuples. The
+    first function takes no arguments and returns the next item, or None when
+    there are no more. Every other function takes the item from the stage before
+    it and returns the item for the next stage, None to drop or hold it back, or a
+    list of items. A stage that holds items back (such as an inference pool) gives
+    them up through flush() once its input has ended.
+    """
+    def __init__(self, stages, queue_size=2, threaded=True):
+        self.stages = [Stage(*stage) for stage in stages]
+        self.queue_size = queue_size
+        self.threaded = threaded
+        self.stopping = threading.Event()
+        self.error = None
+        self.start_time = None
+        self.end_time = None
+
+    def stop(self):
+        # Safe to call from any stage, the pipeline winds down after the current items
+        self.stopping.set()
+
+    def run(self):
+        """Run until the source ends or stop() is called, re-raises any stage error"""
+        self.start_time = time.perf_counter()
+        try:
+            if self.threaded:
+                self.run_threaded()
+            else:
+                self.run_serial()
+        finally:
+            self.end_time = time.perf_counter()
+        if self.error is not None:
+            raise self.error
+
+    def run_serial(self):
+        source = self.stages[0]
+        while not self.stopping.is_set():
+            item = source.call()
+            if item is None:
+                break
+            self.push(1, [item])
+
+        # Pass on whatever the stages still hold, in stage order
+        for i, stage in enumerate(self.stages[1:], start=1):
+            self.push(i + 1, stage.finish())
+
+    def push(self, index, items):
+        # Run items through the stages from index on
+        if index >= len(self.stages):
+            return
+        stage = self.stages[index]
+        for item in items:
+            self.push(index + 1, as_items(stage.call(item)))
+
+    def run_threaded(self):
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages[1:]]
+        threads = [threading.Thread(target=self.source_worker, args=(self.stages[0], queues[0]), daemon=True)]
+        for i, stage in enumerate(self.stages[1:]):
+            output = queues[i + 1] if i + 1 < len(queues) else None
+            threads.append(threading.Thread(target=self.stage_worker, args=(stage, queues[i], output), daemon=True))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def put(self, output, item):
+        # Wait for room in the next queue, giving up once the pipeline is stopping
+        while True:
+            try:
+                output.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if self.stopping.is_set():
+                    return False
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.stop()
+
+    def source_worker(self, stage, output):
+        try:
+            while not self.stopping.is_set():
+                item = stage.call()
+                if item is None or not self.put(output, item):
+                    break
+        except Exception as e:
+            self.fail(e)
+        finally:
+            # Let the next stage drain what is queued and finish
+            self.put_end(output)
+
+    def stage_worker(self, stage, input_queue, output):
+        ended = False
+        try:
+            while True:
+                item = input_queue.get()
+                if item is END:
+                    ended = True
+                    break
+                if self.stopping.is_set() and self.error is not None:
+                    continue  # Drain the queue without doing the work
+                for result in as_items(stage.call(item)):
+                    if output is not None:
+                        self.put(output, result)
+            for result in stage.finish():
+                if output is not None:
+                    self.put(output, result)
+        except Exception as e:
+            self.fail(e)
+            # Keep draining so the stages before this one are not blocked
+            while not ended and input_queue.get() is not END:
+                pass
+        finally:
+            if output is not None:
+                self.put_end(output)
+
+    def put_end(self, output):
+        # END always gets through, the next stage keeps reading until it sees it
+        output.put(END)
+
+    def stats(self):
+        """Items handled and the share of the elapsed time every stage was busy.
+
+        The stage closest to 100% utilization is the bottleneck.
+        """
+        end = self.end_time if self.end_time is not None else time.perf_counter()
+        elapsed = max(end - self.start_time, 1e-9) if self.start_time is not None else 1e-9
+        last = self.stages[-1]
+        return {'fps': last.items / elapsed,
+                'stages': {stage.name: {'items': stage.items,
+                                        'ms_per_item': stage.busy_time / max(stage.items, 1) * 1000,
+                                        'utilization': stage.busy_time / elapsed}
+                           for stage in self.stages}}
+
+    def counters(self):
+        # (items, busy seconds) of every stage after the source, to measure the load while running
+        return {stage.name: (stage.items, stage.busy_time) for stage in self.stages[1:]}
+
+    def report(self):
+        # One line summary of stats() for the log
+        stats = self.stats()
+        stages = ', '.join(f"{name} {stage['ms_per_item']:.1f} ms ({stage['utilization'] * 100:.0f}%)"
+                           for name, stage in stats['stages'].items())
+        return f"{stats['fps']:.2f} FPS, {stages}"
@@ -0,0 +1,155 @@
+######## Detection post-processing with NumPy #########
+#
+# Turns the raw output tensors of a detector into a compact structured array of
+# detections in pixel coordinates, using masks over the whole tensor instead of
+# a Python loop over every candidate box.
+
+import numpy as np
+
+# One row per detection, boxes in pixels of the camera frame
+DETECTION_DTYPE = np.dtype([('xmin', np.int32), ('ymin', np.int32),
+                            ('xmax', np.int32), ('ymax', np.int32),
+                            ('score', np.float32), ('class_id', np.int32)])
+
+def make_detections(xmin, ymin, xmax, ymax, scores, class_ids):
+    detections = np.empty(len(scores), dtype=DETECTION_DTYPE)
+    detections['xmin'] = xmin
+    detections['ymin'] = ymin
+    detections['xmax'] = xmax
+    detections['ymax'] = ymax
+    detections['score'] = scores
+    detections['class_id'] = class_ids
+    return detections
+
+def filter_ssd_detections(boxes, classes, scores, threshold, imW, imH):
+    """Detections from TFLite SSD outputs.
+
+    boxes holds normalized [ymin, xmin, ymax, xmax] rows, classes and scores one
+    value per box. Boxes are clipped to the frame like the old per-box loop did.
+    """
+    keep = (scores > threshold) & (scores <= 1.0)
+    # In float64 like the old loop's scalar math, float32 can land one pixel off
+    boxes = boxes[keep].astype(np.float64)
+
+    # Truncated to whole pixels, like int() in the old loop
+    ymin = np.maximum(1, boxes[:, 0] * imH)
+    xmin = np.maximum(1, boxes[:, 1] * imW)
+    ymax = np.minimum(imH, boxes[:, 2] * imH)
+    xmax = np.minimum(imW, boxes[:, 3] * imW)
+    return make_detections(xmin, ymin, xmax, ymax, scores[keep], classes[keep])
+
+def nms(boxes, scores, iou_threshold, class_ids=None, max_detections=100, by_smaller=False):
+    """Greedy non-maximum suppression, returns the indices of the boxes to keep.
+
+    boxes holds [x1, y1, x2, y2] rows. With class_ids, boxes of different classes
+    never suppress each other. Every step compares one box against all remaining
+    boxes at once, so the cost is at most max_detections vectorized passes.
+    With by_smaller the overlap is the intersection over the smaller box instead
+    of the union, so the part of a vehicle seen by another tile is suppressed too.
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.intp)
+    if class_ids is not None:
+        # Shifting every class by more than the coordinate range keeps classes apart
+        boxes = boxes + (class_ids * (boxes.max() - boxes.min() + 1))[:, None]
+
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    order = np.argsort(-scores, kind='stable')
+
+    keep = []
+    while order.size and len(keep) < max_detections:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+
+        width = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        height = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        intersection = width * height
+        if by_smaller:
+            overlap = intersection / (np.minimum(areas[i], areas[rest]) + 1e-9)
+        else:
+            overlap = intersection / (areas[i] + areas[rest] - intersection + 1e-9)
+        order = rest[overlap <= iou_threshold]
+    return np.array(keep, dtype=np.intp)
+
+def guess_yolo_version(output, num_classes):
+    # YOLOv5 rows hold 5 + classes values (with objectness), YOLOv8 rows 4 + classes
+    rows, columns = output.shape
+    if columns == 5 + num_classes:
+        return 'v5'
+    if columns == 4 + num_classes or rows == 4 + num_classes:
+        return 'v8'
+    raise ValueError(f"Output shape {output.shape} does not fit YOLOv5 or YOLOv8 with {num_classes} classes")
+
+def decode_yolo(output, num_classes, conf_threshold, iou_threshold, frame_size, scale=1.0, pad=(0, 0),
+                output_size=None, version=None, max_candidates=512, max_detections=100):
+    """Detections from a raw YOLOv5 or YOLOv8 output head.
+
+    YOLOv5 gives [N, 5 + classes] rows of cx, cy, w, h, objectness and class
+    scores. YOLOv8 gives [4 + classes, N], the same without objectness. Boxes are
+    in model input pixels. They are mapped back through the letterbox (scale and
+    pad from the Preprocessor) to the frame of frame_size, and from there to
+    output_size, such as the full camera resolution when detecting on lores frames.
+
+    Only the max_candidates best boxes above the threshold go through class-aware
+    NMS, which bounds the cost for heads with thousands of anchors.
+    """
+    output = np.asarray(output, dtype=np.float32)
+    output = output.reshape(output.shape[-2:])  # Drop the batch axis, if any
+    if version is None:
+        version = guess_yolo_version(output, num_classes)
+
+    if version == 'v8':
+        # Channels first from most exporters, one row per anchor from here on
+        if output.shape[0] == 4 + num_classes and output.shape[1] != 4 + num_classes:
+            output = output.T
+        class_scores = output[:, 4:4 + num_classes]
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(output)), class_ids]
+    else:
+        # Cheap objectness test first, then the class scores of what is left
+        output = output[output[:, 4] > conf_threshold]
+        class_scores = output[:, 5:5 + num_classes]
+        class_ids = class_scores.argmax(axis=1)
+        scores = output[:, 4] * class_scores[np.arange(len(output)), class_ids]
+
+    keep = scores > conf_threshold
+    output, scores, class_ids = output[keep], scores[keep], class_ids[keep]
+
+    # Bound the cost of NMS to the best candidates
+    if len(scores) > max_candidates:
+        best = np.argpartition(-scores, max_candidates)[:max_candidates]
+        output, scores, class_ids = output[best], scores[best], class_ids[best]
+
+    # Centre and size to corners, then undo the letterbox
+    half_width = output[:, 2] / 2
+    half_height = output[:, 3] / 2
+    boxes = np.stack([output[:, 0] - half_width, output[:, 1] - half_height,
+                      output[:, 0] + half_width, output[:, 1] + half_height], axis=1)
+    boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad[0]) / scale
+    boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad[1]) / scale
+
+    keep = nms(boxes, scores, iou_threshold, class_ids, max_detections)
+    boxes, scores, class_ids = boxes[keep], scores[keep], class_ids[keep]
+
+    frame_width, frame_height = frame_size
+    if output_size is not None and tuple(output_size) != tuple(frame_size):
+        boxes[:, [0, 2]] *= output_size[0] / frame_width
+        boxes[:, [1, 3]] *= output_size[1] / frame_height
+        frame_width, frame_height = output_size
+
+    xmin = np.clip(boxes[:, 0], 0, frame_width)
+    ymin = np.clip(boxes[:, 1], 0, frame_height)
+    xmax = np.clip(boxes[:, 2], 0, frame_width)
+    ymax = np.clip(boxes[:, 3], 0, frame_height)
+    return make_detections(xmin, ymin, xmax, ymax, scores, class_ids)
+
+def label_names(detections, labels):
+    # Look up the object name of every detection, unknown class IDs get the last label
+    return np.asarray(labels)[np.clip(detections['class_id'], 0, len(labels) - 1)]
+
+def drawable(detections, labels):
+    # (xmin, ymin, xmax, ymax, object_name, score) tuples for annotate.draw_detections
+    return [(int(d['xmin']), int(d['ymin']), int(d['xmax']), int(d['ymax']), str(name), float(d['score']))
+            for d, name in zip(detections, label_names(detections, labels))]
@@ -0,0 +1,99 @@
+######## Camera frame to model input, without per-frame allocations #########
+#
+# The old path copied the full 1280x720 frame, converted its colours, resized it,
+# added a batch axis and (for float models) normalized it, allocating a new buffer
+# at every step. Resizing first and converting the colours of the small image
+# gives the same pixels, because the channel swap does not mix channels.
+# Both steps here write into buffers allocated once, or straight into the
+# interpreter's input tensor.
+
+import cv2
+import numpy as np
+
+class Preprocessor:
+    """Resizes and colour converts frames into a preallocated model input buffer.
+
+    With letterbox the frame keeps its aspect ratio and is padded to the model
+    size, as YOLO models expect. scale and pad then describe how to map boxes
+    back to the frame.
+    """
+    def __init__(self, width, height, floating_model=False, input_mean=127.5, input_std=127.5, swap_rb=True,
+                 letterbox=False, pad_value=114):
+        self.width = width
+        self.height = height
+        self.floating_model = floating_model
+        self.swap_rb = swap_rb
+        self.letterbox = letterbox
+        self.pad_value = pad_value
+
+        # Input data with the batch axis the model expects, [1xHxWx3]
+        self.input_data = np.empty((1, height, width, 3), dtype=np.float32 if floating_model else np.uint8)
+
+        # Normalization of every possible pixel value, computed once
+        if floating_model:
+            self.lut = ((np.arange(256, dtype=np.float32) - input_mean) / input_std).astype(np.float32)
+            self.pad_value = self.lut[pad_value]
+
+        # Resize target and padding, set up for the first frame size seen
+        self.frame_size = None
+        self.set_frame_size(width, height)
+
+    def set_frame_size(self, frame_width, frame_height):
+        # Work out the resize target and the intermediate buffers once per frame size
+        if self.frame_size == (frame_width, frame_height):
+            return
+        self.frame_size = (frame_width, frame_height)
+
+        if self.letterbox:
+            self.scale = min(self.width / frame_width, self.height / frame_height)
+            new_width = int(round(frame_width * self.scale))
+            new_height = int(round(frame_height * self.scale))
+        else:
+            self.scale = 1.0
+            new_width, new_height = self.width, self.height
+        self.pad = ((self.width - new_width) // 2, (self.height - new_height) // 2)
+
+        self.resized = np.empty((new_height, new_width, 3), dtype=np.uint8)
+        self.converted = np.empty((new_height, new_width, 3), dtype=np.uint8)
+
+    def run(self, frame, out=None):
+        """Fill out (a [HxWx3] or [1xHxWx3] array, such as the interpreter's input tensor)
+        or the internal input buffer from a camera frame, and return it"""
+        if out is None:
+            out = self.input_data
+        image = out[0] if out.ndim == 4 else out
+
+        self.set_frame_size(frame.shape[1], frame.shape[0])
+        new_height, new_width = self.resized.shape[:2]
+
+        # A frame that already has the target size needs no resize
+        if frame.shape[0] == new_height and frame.shape[1] == new_width:
+            resized = frame
+        else:
+            resized = cv2.resize(frame, (new_width, new_height), dst=self.resized)
+
+        if self.letterbox:
+            pad_x, pad_y = self.pad
+            target = image[pad_y:pad_y + new_height, pad_x:pad_x + new_width]
+            image[:pad_y] = self.pad_value
+            image[pad_y + new_height:] = self.pad_value
+            image[:, :pad_x] = self.pad_value
+            image[:, pad_x + new_width:] = self.pad_value
+        else:
+            target = image
+
+        if not self.floating_model and not self.letterbox:
+            # Fused path, the colour conversion writes straight into the input
+            if self.swap_rb:
+                cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=target)
+            else:
+                np.copyto(target, resized)
+            return out
+
+        if self.swap_rb:
+            resized = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=self.converted)
+        if self.floating_model:
+            np.take(self.lut, resized, out=target)
+        else:
+            target[...] = resized
+        return out
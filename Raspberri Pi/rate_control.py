@@ -0,0 +1,138 @@
+######## Adaptive frame rate for the detection loop #########
+#
+# Running the detector flat out costs the same on an empty road at night as in
+# rush hour, and on a hot Pi the firmware throttles the CPU, which then misses
+# vehicles in bursts. RateController holds the frame rate at active_fps while
+# there is traffic (tracked vehicles or motion) and drops to idle_fps once the
+# road has been empty for idle_after seconds. Once a second it measures what a
+# frame costs in the pipeline stages. When the frame rate cannot be held, it
+# steps down to fewer tiles and then to running the detector on every 2nd or
+# 3rd frame only, and steps back up once there is time to spare. A hot CPU
+# lowers the frame rate before the firmware throttles it.
+
+import threading
+import time
+
+def cpu_temperature(path='/sys/class/thermal/thermal_zone0/temp'):
+    # Degrees Celsius, None on a machine without this thermal zone
+    try:
+        with open(path, 'r') as f:
+            return int(f.read()) / 1000
+    except (OSError, ValueError):
+        return None
+
+class RateController:
+    """Chooses the frame rate, detector stride and tile level from the measured load.
+
+    update() is called after every frame with the pipeline's stage counters and
+    whether there is traffic. pace() waits until the next frame is due.
+    coarse_tiles says there is a level with fewer tiles (--tiles). With threaded
+    the stages run side by side and the slowest one sets the frame cost, else
+    their costs add up. temperature returns the CPU temperature or None.
+    """
+    def __init__(self, active_fps=10, idle_fps=1, idle_after=10.0, hot=75.0, critical=82.0, max_stride=3,
+                 coarse_tiles=False, threaded=False, period=1.0, headroom=0.9, temperature=cpu_temperature):
+        self.active_fps = active_fps
+        self.idle_fps = idle_fps
+        self.idle_after = idle_after
+        self.hot = hot
+        self.critical = critical
+        self.threaded = threaded
+        self.period = period
+        self.headroom = headroom
+        self.temperature = temperature
+
+        # From full quality to the least work per frame: (coarse tiles, detector stride)
+        self.levels = [(False, 1)] + ([(True, 1)] if coarse_tiles else [])
+        self.levels += [(coarse_tiles, stride) for stride in range(2, max_stride + 1)]
+        self.level = 0
+        self.coarse, self.stride = self.levels[0]
+        self.fps = active_fps
+
+        self.last_traffic = None
+        self.next_update = None
+        self.last_counters = None
+        self.frame_cost = None
+        self.last_temperature = None
+        self.changes = 0
+
+        self.last_frame = None
+        self.wakeup = threading.Event()
+
+    def should_detect(self, seq):
+        # With a stride the detector runs on every stride-th frame only
+        return seq % self.stride == 0
+
+    def pace(self):
+        """Wait until the next frame is due at the current frame rate"""
+        if self.last_frame is not None:
+            delay = self.last_frame + 1 / self.fps - time.monotonic()
+            if delay > 0:
+                self.wakeup.wait(delay)
+                self.wakeup.clear()
+        self.last_frame = time.monotonic()
+
+    def measure(self, counters):
+        # Seconds per frame of the stages since the last measurement, None without new frames
+        last, self.last_counters = self.last_counters, counters
+        if last is None:
+            return None
+        costs = []
+        for name, (items, busy) in counters.items():
+            done = items - last[name][0]
+            if done > 0:
+                costs.append((busy - last[name][1]) / done)
+        if not costs:
+            return None
+        return max(costs) if self.threaded else sum(costs)
+
+    def busy(self, now):
+        # Traffic within the last idle_after seconds
+        return self.last_traffic is not None and now - self.last_traffic < self.idle_after
+
+    def update(self, now, counters, traffic):
+        """counters holds (items, busy seconds) per stage, as Pipeline.counters() gives.
+        Returns True when the frame rate, stride or tiles have changed."""
+        if traffic:
+            if not self.busy(now):
+                # Traffic on an empty road: full speed now, not at the next update
+                self.next_update = now
+            self.last_traffic = now
+        if self.next_update is not None and now < self.next_update:
+            return False
+        self.next_update = now + self.period
+
+        cost = self.measure(counters)
+        if cost is not None:
+            self.frame_cost = cost
+        self.last_temperature = self.temperature() if self.temperature is not None else None
+
+        target = self.active_fps if self.busy(now) else self.idle_fps
+        if self.last_temperature is not None and self.last_temperature >= self.critical:
+            target = self.idle_fps
+        elif self.last_temperature is not None and self.last_temperature >= self.hot:
+            target = max(self.idle_fps, target / 2)
+
+        # One level a step: down when the target cannot be held, back up with time to spare
+        level = self.level
+        if self.frame_cost:
+            capacity = self.headroom / self.frame_cost
+            if capacity < target and level < len(self.levels) - 1:
+                level += 1
+            elif capacity > 2 * target and level > 0:
+                level -= 1
+
+        changed = target != self.fps or level != self.level
+        if changed:
+            if target > self.fps:
+                self.wakeup.set()
+            self.fps = target
+            self.level = level
+            self.coarse, self.stride = self.levels[level]
+            self.changes += 1
+        return changed
+
+    def stats(self):
+        return {'fps': self.fps, 'stride': self.stride, 'coarse': self.coarse,
+                'frame_ms': round(self.frame_cost * 1000, 1) if self.frame_cost else None,
+                'temperature': self.last_temperature, 'changes': self.changes}
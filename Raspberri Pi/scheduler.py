@@ -0,0 +1,133 @@
+######## Interval scheduler on the monotonic clock #########
+#
+# Counts are reported per 5-minute interval aligned to the wall clock (13:00,
+# 13:05, ...). The old loop polled the minute every 10 s before starting and
+# then compared time.time() with a start time once per frame, so intervals
+# started late, drifted by a frame time and jumped when the time setup scripts
+# changed the system clock.
+#
+# IntervalScheduler measures everything on time.monotonic(). The wall clock is
+# only used as an offset, to find where the boundaries are. The offset comes from
+# time_sync.ClockSync when given, or from the system clock otherwise. A timer thread
+# closes every interval at its exact deadline (plus a short grace period for
+# frames still in the pipeline), however slow the frames are. Every count event
+# carries the monotonic time its frame was captured, so it lands in the interval
+# it belongs to even if it is processed after the boundary.
+
+import threading
+import time
+from datetime import datetime
+
+class IntervalScheduler:
+    """Collects count events per interval and hands each closed interval to on_close.
+
+    on_close(start, end, events) is called from the timer thread with the start
+    and end of the interval as datetimes and the events recorded in it. Events
+    need a monotonic timestamp, such as tracker.CountEvent. grace is how long
+    after a boundary events for the interval are still accepted. offset is the
+    wall clock time minus time.monotonic(), by default taken from the system clock.
+    set_offset() ignores corrections of at most rebin_threshold seconds.
+    """
+    def __init__(self, interval=300, on_close=None, grace=2.0, offset=None, rebin_threshold=0.5):
+        self.interval = interval
+        self.on_close = on_close
+        self.grace = grace
+        self.rebin_threshold = rebin_threshold
+        # wall clock time = monotonic time + offset, fixed so clock steps cannot move the boundaries
+        self.offset = offset if offset is not None else time.time() - time.monotonic()
+
+        self.lock = threading.Lock()
+        self.bins = {}          # Interval index -> events
+        self.first_bin = None
+        self.next_close = None  # Index of the next interval to close
+        self.closed = 0
+        self.late_events = 0    # Events for intervals that were already closed
+        self.stopping = threading.Event()
+        self.wakeup = threading.Event()  # Set to make the timer recompute its deadline
+        self.thread = None
+
+    def wall_time(self, monotonic=None):
+        # Seconds since the epoch for a monotonic time
+        return (time.monotonic() if monotonic is None else monotonic) + self.offset
+
+    def bin_index(self, monotonic):
+        return int(self.wall_time(monotonic) // self.interval)
+
+    def bin_start(self, index):
+        # Monotonic time at which interval index starts
+        return index * self.interval - self.offset
+
+    def wait_for_boundary(self):
+        """Sleep until the next interval boundary, returns False if stopped first"""
+        deadline = self.bin_start(self.bin_index(time.monotonic()) + 1)
+        return not self.stopping.wait(max(deadline - time.monotonic(), 0))
+
+    def set_offset(self, offset):
+        """Follow a better measured clock from now on.
+
+        Counts recorded so far all stay in the interval running now, which is
+        closed at its boundary on the new clock. A time source that answers
+        again is a few milliseconds off, which moves no boundary worth that.
+        """
+        with self.lock:
+            if abs(offset - self.offset) <= self.rebin_threshold:
+                return
+            self.offset = offset
+            if self.next_close is not None:
+                events = [event for index in sorted(self.bins) for event in self.bins[index]]
+                index = self.bin_index(time.monotonic())
+                self.first_bin = self.next_close = index
+                self.bins = {index: events} if events else {}
+        self.wakeup.set()
+
+    def start(self):
+        # The interval running now is the first one counted
+        self.first_bin = self.next_close = self.bin_index(time.monotonic())
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def record(self, events):
+        """Add count events to the intervals their timestamps fall in"""
+        with self.lock:
+            for event in events:
+                index = max(self.bin_index(event.timestamp), self.first_bin)
+                if index < self.next_close:
+                    self.late_events += 1
+                    index = self.next_close
+                self.bins.setdefault(index, []).append(event)
+
+    def count(self):
+        # Events in the interval running now, for the overlay
+        with self.lock:
+            return len(self.bins.get(self.bin_index(time.monotonic()), []))
+
+    def run(self):
+        while not self.stopping.is_set():
+            deadline = self.bin_start(self.next_close + 1) + self.grace
+            if self.wakeup.wait(max(deadline - time.monotonic(), 0)):
+                self.wakeup.clear()
+                continue
+            self.close_bin(self.next_close, self.bin_start(self.next_close + 1))
+
+    def close_bin(self, index, end):
+        with self.lock:
+            events = self.bins.pop(index, [])
+            self.next_close = index + 1
+            self.closed += 1
+        if self.on_close is not None:
+            self.on_close(datetime.fromtimestamp(self.bin_start(index) + self.offset),
+                          datetime.fromtimestamp(end + self.offset), events)
+
+    def stop(self, flush=True):
+        """Stop the timer. With flush the interval running now is closed early, so its counts are not lost."""
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+        if flush and self.next_close is not None:
+            now = time.monotonic()
+            with self.lock:
+                # Late events for the running interval and anything after it go into one final report
+                events = [event for index in sorted(self.bins) for event in self.bins[index]]
+                self.bins = {self.next_close: events}
+            self.close_bin(self.next_close, now)
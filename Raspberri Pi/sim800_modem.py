@@ -0,0 +1,264 @@
+######## Long-lived SIM800 modem manager #########
+#
+# sim800_log.py used to power the module on, wait, open the GPRS bearer, start
+# the HTTP service, send one request, tear everything down and power off again,
+# every 5 minutes. SIM800Modem does the setup once and then keeps the module
+# registered, the bearer open and the HTTP service initialized, so an upload is
+# one HTTPACTION round trip. A health check now and then re-attaches only what
+# has dropped. Between uploads the module can sleep (AT+CSCLK) instead of being
+# powered off.
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from at_modem import ATModem
+
+# +HTTPACTION status codes that mean the bearer or network is gone, not the server
+NETWORK_ERRORS = ('601', '602', '603', '604')
+
+def parse_action(result):
+    # (status, body length) of a '+HTTPACTION: <method>,<status>,<length>' value, None if it is garbled
+    fields = [field.strip() for field in (result or '').split(',')]
+    if len(fields) != 3 or not fields[1].isdigit() or not fields[2].isdigit():
+        return None
+    return fields[1], int(fields[2])
+
+class SIM800Modem:
+    """Keeps a SIM800 ready for HTTP requests.
+
+    pwx_pin is the BCM pin wired to the power key, None if the module is always
+    on (or simulated). sleep_mode is passed to AT+CSCLK: 0 keeps the module
+    awake, 1 lets it sleep while DTR is high, 2 lets it sleep whenever the serial
+    line is idle. With health_interval, a background thread checks the link
+    every that many seconds.
+    """
+    def __init__(self, port='/dev/ttyS0', baudrate=115200, pwx_pin=18, apn=None, sleep_mode=2,
+                 health_interval=None, serial_port=None, verbose=False):
+        self.at = ATModem(port, baudrate, serial_port=serial_port, verbose=verbose)
+        self.pwx_pin = pwx_pin
+        self.apn = apn
+        self.sleep_mode = sleep_mode
+        self.lock = threading.RLock()   # An upload and a health check never interleave
+        self.bearer_open = False
+        self.http_ready = False
+
+        self.uploads = 0
+        self.failed = 0
+        self.attaches = 0
+        self.power_cycles = 0
+        self.signal = None
+        self.last_health_check = None
+
+        # The module tells us when the bearer drops or it powers itself down
+        self.at.on_urc('+SAPBR 1: DEACT', self.bearer_lost)
+        self.at.on_urc('NORMAL POWER DOWN', self.powered_down)
+        self.at.on_urc('UNDER-VOLTAGE POWER DOWN', self.powered_down)
+
+        if pwx_pin is not None:
+            import RPi.GPIO as GPIO
+            GPIO.setmode(GPIO.BCM)
+            GPIO.setwarnings(False)
+            GPIO.setup(pwx_pin, GPIO.OUT)
+
+        self.stopping = threading.Event()
+        if health_interval:
+            threading.Thread(target=self.monitor, args=(health_interval,), daemon=True).start()
+
+    def bearer_lost(self, line):
+        self.bearer_open = False
+        self.http_ready = False
+
+    def powered_down(self, line):
+        self.bearer_lost(line)
+
+    def toggle_power(self):
+        import RPi.GPIO as GPIO
+        GPIO.output(self.pwx_pin, GPIO.LOW)
+        time.sleep(2)
+        GPIO.output(self.pwx_pin, GPIO.HIGH)
+        self.power_cycles += 1
+
+    def command(self, command, timeout=5, expect=None, data=None):
+        return self.at.command(command, timeout, expect, data)
+
+    def wake(self):
+        # In sleep mode 2 the module wakes on the first characters, which it drops
+        if not self.sleep_mode:
+            return True
+        if self.sleep_mode == 1:
+            self.at.serial.dtr = False
+        for _ in range(3):
+            if self.command('AT', 1).ok:
+                return True
+        return False
+
+    def sleep(self):
+        # Mode 1 sleeps once DTR goes high, mode 2 by itself once the line is idle
+        if self.sleep_mode == 1:
+            self.at.serial.dtr = True
+
+    def power_on(self, timeout=15):
+        """Make sure the module answers, pressing the power key only if it does not"""
+        for _ in range(3):
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                if self.command('AT', 1).ok:
+                    self.command('ATE0', 1)   # No echo, less to read back
+                    return True
+            if self.pwx_pin is None:
+                return False
+            self.toggle_power()
+        return False
+
+    def wait_for_network(self, timeout=60):
+        # Registered on the home network (0,1) or roaming (0,5)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.command('AT+CREG?', 2).value('+CREG') in ('0,1', '0,5'):
+                return True
+            time.sleep(1)
+        return False
+
+    def network_time(self, timeout=60):
+        """Read the module clock (AT+CCLK?), returns (utc datetime, time.monotonic() of the answer) or None.
+
+        The clock only follows the network if AT+CLTS=1 was saved on the module.
+        """
+        with self.lock:
+            if not self.power_on() or not self.wait_for_network(timeout):
+                return None
+            response = self.command('AT+CCLK?', 2)
+            received = time.monotonic()
+            self.sleep()
+        value = response.value('+CCLK')
+        if not value:
+            return None
+        # "yy/MM/dd,hh:mm:ss+zz", zz being the local time zone in quarters of an hour
+        value = value.strip('"')
+        local = datetime.strptime(value[:17], '%y/%m/%d,%H:%M:%S')
+        zone = timedelta(minutes=15 * int(value[17:] or 0))
+        if local.year < 2020:
+            return None   # The clock was never set, the module starts at 2004
+        return (local - zone).replace(tzinfo=timezone.utc), received
+
+    def attach(self):
+        """Open the GPRS bearer and the HTTP service, skipping what is already up"""
+        with self.lock:
+            if not self.power_on() or not self.wait_for_network():
+                return False
+
+            status = self.command('AT+SAPBR=2,1', 5).value('+SAPBR')
+            self.bearer_open = status is not None and status.startswith('1,1')
+            if not self.bearer_open:
+                self.command('AT+SAPBR=3,1,"CONTYPE","GPRS"', 5)
+                if self.apn:
+                    self.command(f'AT+SAPBR=3,1,"APN","{self.apn}"', 5)
+                self.bearer_open = self.command('AT+SAPBR=1,1', 85).ok
+                if not self.bearer_open:
+                    return False
+                self.http_ready = False
+                self.attaches += 1
+
+            if not self.http_ready:
+                # HTTPINIT fails if a session is left over, so end it first
+                self.command('AT+HTTPTERM', 2)
+                # Apps Script answers a POST with a 302 to the page holding its answer
+                self.http_ready = (self.command('AT+HTTPINIT', 5).ok and
+                                   self.command('AT+HTTPPARA="CID",1', 2).ok and
+                                   self.command('AT+HTTPPARA="REDIR",1', 2).ok and
+                                   self.command('AT+HTTPSSL=1', 2).ok)
+            if self.sleep_mode:
+                self.command(f'AT+CSCLK={self.sleep_mode}', 2)
+            return self.http_ready
+
+    def request(self, url, data=None, content_type='application/json', timeout=60, read=False):
+        """GET url, or POST data to it, returns the HTTP status code (None if the link is down).
+
+        With read, returns (status, text of the answer) instead. A network
+        error re-attaches and retries once.
+        """
+        with self.lock:
+            for attempt in range(2):
+                self.wake()
+                if not (self.bearer_open and self.http_ready) and not self.attach():
+                    break
+                self.command(f'AT+HTTPPARA="URL","{url}"', 2)
+                if data is not None:
+                    self.command(f'AT+HTTPPARA="CONTENT","{content_type}"', 2)
+                    if not self.command(f'AT+HTTPDATA={len(data)},10000', 15, data=data).ok:
+                        self.http_ready = False
+                        continue
+                response = self.command(f'AT+HTTPACTION={0 if data is None else 1}', timeout, expect='+HTTPACTION:')
+                action = parse_action(response.value('+HTTPACTION'))
+                if action is None:
+                    # No answer, or a truncated one, the HTTP service needs a restart
+                    self.http_ready = False
+                    continue
+                status, length = action
+                if status in NETWORK_ERRORS:
+                    self.bearer_open = False
+                    continue
+                self.uploads += 1
+                answer = self.read_answer() if read and length else ''
+                self.sleep()
+                return (int(status), answer) if read else int(status)
+            self.failed += 1
+            self.sleep()
+            return (None, None) if read else None
+
+    def read_answer(self):
+        # The body of the last HTTPACTION: the lines after '+HTTPREAD: <length>'
+        lines = self.command('AT+HTTPREAD', 10).lines
+        start = next((i + 1 for i, line in enumerate(lines) if line.startswith('+HTTPREAD')), len(lines))
+        return '\n'.join(lines[start:])
+
+    def send_sms(self, phone_number, message, timeout=60):
+        """Send a text message, returns True once the network has taken it"""
+        with self.lock:
+            if not self.power_on() or not self.wait_for_network():
+                return False
+            self.command('AT+CMGF=1', 2)   # Text mode
+            # The message follows the '>' prompt and ends with Ctrl+Z
+            sent = self.command(f'AT+CMGS="{phone_number}"', timeout, data=(message + '\x1a').encode()).ok
+            self.sleep()
+            return sent
+
+    def check_health(self):
+        """Check registration, signal and bearer, and re-attach if anything dropped"""
+        with self.lock:
+            self.last_health_check = time.time()
+            if not self.wake():
+                self.bearer_open = self.http_ready = False
+            else:
+                signal = (self.command('AT+CSQ', 2).value('+CSQ') or '').split(',')[0].strip()
+                self.signal = int(signal) if signal.isdigit() else None
+                registered = self.command('AT+CREG?', 2).value('+CREG') in ('0,1', '0,5')
+                status = self.command('AT+SAPBR=2,1', 5).value('+SAPBR')
+                if not registered or status is None or not status.startswith('1,1'):
+                    self.bearer_open = self.http_ready = False
+            healthy = (self.bearer_open and self.http_ready) or self.attach()
+            self.sleep()
+            return healthy
+
+    def monitor(self, interval):
+        while not self.stopping.wait(interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                print(f"SIM800 health check failed: {e}")
+
+    def stats(self):
+        return {'uploads': self.uploads, 'failed': self.failed, 'attaches': self.attaches,
+                'power_cycles': self.power_cycles, 'signal': self.signal,
+                'bearer_open': self.bearer_open, 'http_ready': self.http_ready}
+
+    def close(self, power_off=False):
+        self.stopping.set()
+        with self.lock:
+            if power_off:
+                self.command('AT+HTTPTERM', 2)
+                self.command('AT+SAPBR=0,1', 5)
+                if self.pwx_pin is not None:
+                    self.toggle_power()
+            self.at.close()
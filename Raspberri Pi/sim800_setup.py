@@ -1,59 +1,66 @@
-import serial
 import time
 import RPi.GPIO as GPIO
 import subprocess
 
+from at_modem import ATModem
+
 PWX_PIN = 18
 GPIO.setmode(GPIO.BCM)
 GPIO.setwarnings(False)
 GPIO.setup(PWX_PIN, GPIO.OUT)
 
-ser = serial.Serial("/dev/ttyS0", 115200, timeout=3)
+modem = ATModem("/dev/ttyS0", 115200)
 
 def toggle_power():
     GPIO.output(PWX_PIN, GPIO.LOW)
     time.sleep(2)
     GPIO.output(PWX_PIN, GPIO.HIGH)
 
-def send_at_command(command, delay=5):
+# Returns as soon as the modem answers, timeout is only the limit
+def send_at_command(command, timeout=5, expect=None):
     print(f"Sending: {command}")
-    ser.write((command + "\r\n").encode())
-    time.sleep(delay)
-    response = ""
-    while ser.in_waiting > 0:
-        response += ser.read(ser.in_waiting).decode()
-    print(f"Response: {response}")
+    response = modem.command(command, timeout, expect)
+    print(f"Response: {response.text} ({response.status} after {response.elapsed:.2f} s)")
     return response
 
+def wait_for_module(timeout=15):
+    # Poll until the module answers AT, instead of sleeping a fixed time after power on
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if send_at_command("AT", 1).ok:
+            return True
+    return False
+
 def check_module_startup():
     max_retries = 3
     retries = 0
     while retries < max_retries:
-        response = send_at_command("AT", 2)
-        if "OK" in response:
+        if wait_for_module():
             print("Module started successfully.")
             return True
         else:
             print("Failed to start module, retrying...")
             toggle_power()
-            time.sleep(10)
             retries += 1
     print("Module failed to start after maximum retries.")
     return False
 
-def check_network_registration():
-    response = send_at_command("AT+CREG?", 2)
-    if "+CREG: 0,1" in response:
-        #print("Module is registered on the network.")
-        return True
-    else:
-        print("Module is not registered.")
-        return False
-    
+def check_network_registration(timeout=30):
+    # Registered on the home network (0,1) or roaming (0,5), polled until timeout
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if send_at_command("AT+CREG?", 2).value("+CREG") in ("0,1", "0,5"):
+            #print("Module is registered on the network.")
+            return True
+        time.sleep(1)
+    print("Module is not registered.")
+    return False
+
 def get_datetime_from_sim800():
     response = send_at_command("AT+CCLK?", 2)
-    if "+CCLK" in response:
-        date_time_str = response.split('"')[1]
+    value = response.value("+CCLK")
+    if value:
+        date_time_str = value.strip('"')
         print(f"SIM800 Date-Time: {date_time_str}")
         return date_time_str
     return None
@@ -71,7 +78,6 @@ def set_rpi_datetime(date_time_str):
 
 def main():
     toggle_power()
-    time.sleep(10)
 
     if check_module_startup():
         print("Module is up and running!")
@@ -86,7 +92,7 @@ def main():
             print("SIM800 is not registered on the network.")
     else:
         print("Exiting, module could not be started.")
-        
+
     toggle_power()
 
 if __name__ == "__main__":
@@ -0,0 +1,222 @@
+######## Road regions and tiles cut from the full frame #########
+#
+# Squashing the whole 1280x720 frame into the 320x320 model input distorts the
+# vehicles and leaves a distant car only a few pixels, while the sky and the
+# verges never hold a vehicle. Tiles are rectangles of the frame, grown to the
+# aspect ratio of the model input, that are each resized into their own model
+# input: one per road region, or a grid of overlapping tiles over every region
+# for small, distant vehicles. A region too wide (or tall) to grow to that
+# aspect inside the frame, such as a road across a 16:9 frame for a square
+# model, is split into as few overlapping tiles as fit. A vehicle larger than
+# the overlap is cut in pieces by the tiles, the pieces that meet across a
+# shared tile edge are joined into one box again. With region_pass a grid also
+# runs on its whole region, which finds the large, close vehicles whole, at the
+# cost of the region's own invokes. The SSD models take one image per invoke,
+# so the tiles of a frame run one after the other. Their detections are mapped
+# back to the frame, stitched and merged with class-aware NMS across the tiles.
+
+import math
+
+import numpy as np
+
+from postprocess import nms
+from preprocess import Preprocessor
+
+def grid_tiles(region, columns=1, rows=1, overlap=0.0):
+    """columns x rows rectangles covering region (x1, y1, x2, y2), each sharing
+    overlap of its width and height with its neighbours"""
+    x1, y1, x2, y2 = region
+    # Tile size such that the tiles with their overlaps just cover the region
+    width = (x2 - x1) / (columns - (columns - 1) * overlap)
+    height = (y2 - y1) / (rows - (rows - 1) * overlap)
+    tiles = []
+    for row in range(rows):
+        for column in range(columns):
+            left = x1 + column * width * (1 - overlap)
+            top = y1 + row * height * (1 - overlap)
+            tiles.append((left, top, left + width, top + height))
+    return tiles
+
+def pieces(length, longest, overlap):
+    # Fewest tiles sharing overlap that cover length, none longer than longest
+    return max(1, math.ceil((length / longest - overlap) / (1 - overlap) - 1e-9))
+
+def split_to_fit(tile, aspect, frame_size, overlap=0.0):
+    """tile (x1, y1, x2, y2) as a grid of as few overlapping tiles as can each
+    grow to aspect inside the frame, the tile itself if it can"""
+    x1, y1, x2, y2 = tile
+    frame_width, frame_height = frame_size
+    # The widest and tallest tile that still fits the frame at aspect
+    longest_x = min(frame_width, frame_height * aspect)
+    longest_y = min(frame_height, frame_width / aspect)
+    return grid_tiles(tile, pieces(x2 - x1, longest_x, overlap), pieces(y2 - y1, longest_y, overlap), overlap)
+
+def fit_aspect(tile, aspect, frame_size):
+    """Grow tile (x1, y1, x2, y2) to width / height = aspect around its centre,
+    kept inside the frame, so the model sees the vehicles undistorted. A tile
+    that split_to_fit() would split is clamped to the frame, which distorts it."""
+    x1, y1, x2, y2 = tile
+    frame_width, frame_height = frame_size
+    width, height = x2 - x1, y2 - y1
+    if width / height < aspect:
+        width = min(height * aspect, frame_width)
+    else:
+        height = min(width / aspect, frame_height)
+    centre_x = min(max((x1 + x2) / 2, width / 2), frame_width - width / 2)
+    centre_y = min(max((y1 + y2) / 2, height / 2), frame_height - height / 2)
+    return (centre_x - width / 2, centre_y - height / 2, centre_x + width / 2, centre_y + height / 2)
+
+def make_tiles(regions, frame_size, model_size, columns=1, rows=1, overlap=0.0, region_pass=False):
+    """Tiles in fractions of the frame for regions (x1, y1, x2, y2) in pixels of
+    frame_size, the whole frame if there are none. Tiles that do not fit the
+    frame at the model's aspect are split with overlap. With region_pass and
+    more than one tile per region, the region itself comes first, its boxes win
+    ties in the merge."""
+    frame_width, frame_height = frame_size
+    regions = regions or [(0, 0, frame_width, frame_height)]
+    aspect = model_size[0] / model_size[1]
+    tiles = []
+    for region in regions:
+        grid = grid_tiles(region, columns, rows, overlap)
+        if region_pass and len(grid) > 1:
+            grid.insert(0, region)
+        for tile in grid:
+            for piece in split_to_fit(tile, aspect, frame_size, overlap):
+                x1, y1, x2, y2 = fit_aspect(piece, aspect, frame_size)
+                tiles.append((x1 / frame_width, y1 / frame_height, x2 / frame_width, y2 / frame_height))
+    return tiles
+
+def span_iou(start1, end1, start2, end2):
+    # IoU of two ranges on one axis
+    intersection = np.clip(np.minimum(end1, end2) - np.maximum(start1, start2), 0, None)
+    return intersection / (np.maximum(end1, end2) - np.minimum(start1, start2) + 1e-9)
+
+def edge_cuts(ymin, xmin, ymax, xmax, tiles, margin):
+    # Sides (left, right, top, bottom) of boxes that end on an edge of their tiles
+    # inside the frame, within margin of the tile's size
+    left, top, right, bottom = tiles[:, 0], tiles[:, 1], tiles[:, 2], tiles[:, 3]
+    return (((np.abs(xmin - left) < margin * (right - left)) & (left > 1e-6)),
+            ((np.abs(right - xmax) < margin * (right - left)) & (right < 1 - 1e-6)),
+            ((np.abs(ymin - top) < margin * (bottom - top)) & (top > 1e-6)),
+            ((np.abs(bottom - ymax) < margin * (bottom - top)) & (bottom < 1 - 1e-6)))
+
+def stitch(boxes, classes, scores, owners, tiles, margin=0.02, agreement=0.5):
+    """Join the pieces of vehicles that tile edges cut apart.
+
+    boxes are [ymin, xmin, ymax, xmax] in fractions of the frame and owners the
+    index in tiles of the tile each box came from. Two boxes of one class from
+    different tiles are pieces of one vehicle when each ends at its tile's edge
+    facing the other tile (within margin of the tile's size), and they agree
+    (IoU of at least agreement) on their extent along the edge and on the part
+    of the strip where the two tiles overlap that they cover. Edges on the
+    frame border cut nothing. The pieces become one box with the best score.
+    Returns boxes, classes, scores and whether each box is still cut by an edge.
+    """
+    if len(boxes) == 0:
+        return boxes, classes, scores, np.zeros(0, dtype=bool)
+    left, top, right, bottom = (tiles[owners, i] for i in range(4))
+    ymin, xmin, ymax, xmax = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    cut_left, cut_right, cut_top, cut_bottom = edge_cuts(ymin, xmin, ymax, xmax, tiles[owners], margin)
+
+    # [i, j]: box i is cut by the right (bottom) edge of its tile and box j by the
+    # left (top) edge of a tile further right (down). In the strip from j's tile
+    # edge to i's, the pieces of one vehicle cover the same part.
+    same = (classes[:, None] == classes[None, :]) & (owners[:, None] != owners[None, :])
+    strip_x = span_iou(np.maximum(xmin[:, None], left), np.minimum(xmax[:, None], right[:, None]),
+                       np.maximum(xmin, left), np.minimum(xmax, right[:, None]))
+    across_x = (cut_right[:, None] & cut_left[None, :] & (left[None, :] > left[:, None]) & (strip_x >= agreement) &
+                (span_iou(ymin[:, None], ymax[:, None], ymin, ymax) >= agreement))
+    strip_y = span_iou(np.maximum(ymin[:, None], top), np.minimum(ymax[:, None], bottom[:, None]),
+                       np.maximum(ymin, top), np.minimum(ymax, bottom[:, None]))
+    across_y = (cut_bottom[:, None] & cut_top[None, :] & (top[None, :] > top[:, None]) & (strip_y >= agreement) &
+                (span_iou(xmin[:, None], xmax[:, None], xmin, xmax) >= agreement))
+    pairs = np.argwhere(same & (across_x | across_y))
+    cut = cut_left | cut_right | cut_top | cut_bottom
+    if not len(pairs):
+        return boxes, classes, scores, cut
+
+    # Pieces of pieces, such as a vehicle on the corner of four tiles, end up in one group
+    group = np.arange(len(boxes))
+    def find(i):
+        while group[i] != i:
+            group[i] = group[group[i]]
+            i = group[i]
+        return i
+    for i, j in pairs:
+        group[find(i)] = find(j)
+    roots = np.array([find(i) for i in range(len(boxes))])
+
+    joined_boxes, joined_classes, joined_scores, joined_cut = [], [], [], []
+    for root in np.unique(roots):
+        members = roots == root
+        box = [ymin[members].min(), xmin[members].min(), ymax[members].max(), xmax[members].max()]
+        joined_boxes.append(box)
+        joined_classes.append(classes[members][0])
+        joined_scores.append(scores[members].max())
+        # A side is still cut if every piece that reaches it ends there on its tile's
+        # edge, such as the bottom of the top half of a vehicle on the corner of four tiles
+        ends = (xmin[members] <= box[1] + 0.01, xmax[members] >= box[3] - 0.01,
+                ymin[members] <= box[0] + 0.01, ymax[members] >= box[2] - 0.01)
+        sides = (cut_left[members], cut_right[members], cut_top[members], cut_bottom[members])
+        joined_cut.append(any(side[end].all() for side, end in zip(sides, ends)))
+    return (np.array(joined_boxes, dtype=boxes.dtype), np.array(joined_classes, dtype=classes.dtype),
+            np.array(joined_scores, dtype=scores.dtype), np.array(joined_cut))
+
+class Tiler:
+    """Cuts tiles out of frames into model inputs and merges their detections.
+
+    tiles are (x1, y1, x2, y2) in fractions of the frame, so they fit frames of
+    any size. Every tile has its own Preprocessor, which keeps its buffers for
+    the tile's size in pixels. merge() gives boxes, classes and scores for the
+    whole frame in the layout of the SSD outputs, for filter_ssd_detections().
+    coarse_tiles, such as the regions without their grid, are used instead of
+    tiles by run() and merge() with coarse, when there is no time for all tiles.
+    """
+    def __init__(self, tiles, width, height, floating_model=False, input_mean=127.5, input_std=127.5,
+                 iou_threshold=0.5, coarse_tiles=None):
+        self.tiles = np.asarray(tiles, dtype=np.float32)
+        self.coarse_tiles = self.tiles if coarse_tiles is None else np.asarray(coarse_tiles, dtype=np.float32)
+        self.iou_threshold = iou_threshold
+        self.preprocessors = [Preprocessor(width, height, floating_model, input_mean, input_std) for _ in tiles]
+        self.coarse_preprocessors = [Preprocessor(width, height, floating_model, input_mean, input_std)
+                                     for _ in self.coarse_tiles]
+        slots = max(len(self.tiles), len(self.coarse_tiles))
+        self.input_data = np.empty((slots, 1, height, width, 3), dtype=np.float32 if floating_model else np.uint8)
+
+    def crops(self, frame, tiles):
+        frame_height, frame_width = frame.shape[:2]
+        pixels = np.round(tiles * [frame_width, frame_height, frame_width, frame_height]).astype(int)
+        return [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in pixels]
+
+    def run(self, frame, out=None, coarse=False):
+        """Fill out (shaped like input_data, one [1xHxWx3] input per tile) from a
+        frame and return the part of it that holds the tiles"""
+        if out is None:
+            out = self.input_data
+        tiles, preprocessors = (self.coarse_tiles, self.coarse_preprocessors) if coarse else (self.tiles, self.preprocessors)
+        for preprocessor, crop, tile_input in zip(preprocessors, self.crops(frame, tiles), out):
+            preprocessor.run(crop, tile_input)
+        return out[:len(tiles)]
+
+    def merge(self, results, threshold, coarse=False):
+        """results holds (boxes, classes, scores) per tile, boxes normalized
+        [ymin, xmin, ymax, xmax] in the tile. Only boxes above threshold are merged."""
+        boxes, classes, scores, owners = [], [], [], []
+        tiles = self.coarse_tiles if coarse else self.tiles
+        for index, ((x1, y1, x2, y2), (tile_boxes, tile_classes, tile_scores)) in enumerate(zip(tiles, results)):
+            keep = tile_scores > threshold
+            # From the tile to the frame, still normalized
+            boxes.append(tile_boxes[keep] * [y2 - y1, x2 - x1, y2 - y1, x2 - x1] + [y1, x1, y1, x1])
+            classes.append(tile_classes[keep])
+            scores.append(tile_scores[keep])
+            owners.append(np.full(int(keep.sum()), index))
+        boxes, classes, scores = np.concatenate(boxes), np.concatenate(classes), np.concatenate(scores)
+
+        # A vehicle across a tile edge is found in pieces, one per tile
+        boxes, classes, scores, cut = stitch(boxes, classes, scores, np.concatenate(owners), tiles)
+
+        # A vehicle in the overlap of two tiles is found twice, or once whole and once cut
+        # off. A box cut by a tile edge ranks after every whole one, the whole vehicle wins.
+        keep = nms(boxes[:, [1, 0, 3, 2]], scores - cut, self.iou_threshold, classes.astype(np.int64),
+                   by_smaller=True)
+        return boxes[keep], classes[keep], scores[keep]
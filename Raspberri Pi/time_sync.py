@@ -0,0 +1,139 @@
+######## Clock offset measurement for the counters #########
+#
+# The Pi has no real-time clock, so it can boot with the wrong time. The count
+# scripts used to wait for wifi_setup.py (worldtimeapi.org without a timeout, then
+# `sudo date -s`) or sim800_setup.py (power cycling the modem to read AT+CCLK?)
+# to finish before loading anything. Stepping the clock also moved the intervals.
+#
+# ClockSync asks all time sources at once, in background threads, while the model
+# loads and the camera warms up. It never changes the system clock. It measures
+# the offset between the real time and time.monotonic(), and the scheduler turns
+# monotonic timestamps into wall clock times with that offset.
+
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+import requests
+
+WORLDTIME_URL = "http://worldtimeapi.org/api/ip"
+HTTP_DATE_URL = "https://www.google.com"   # Not the upload URL, a HEAD there runs the Apps Script
+NTP_SERVER = "pool.ntp.org"
+NTP_EPOCH = 2208988800  # Seconds from 1900, where NTP time starts, to 1970
+
+# offset is the real time minus time.monotonic(), uncertainty how far off it can be, both in seconds
+ClockSample = namedtuple('ClockSample', ['source', 'offset', 'uncertainty'])
+
+def ntp_time(server=NTP_SERVER, timeout=2, port=123):
+    # One SNTP exchange, the offset is taken halfway through the round trip
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.settimeout(timeout)
+        sent = time.monotonic()
+        s.sendto(b'\x1b' + 47 * b'\0', (socket.gethostbyname(server), port))  # Version 3, client
+        data = s.recvfrom(48)[0]
+        received = time.monotonic()
+    if len(data) < 48 or data[1] == 0:
+        raise ValueError(f"{server} sent no time")  # Stratum 0 is a kiss-o'-death
+    seconds, fraction, sent_seconds, sent_fraction = struct.unpack('!IIII', data[32:48])
+    server_received = seconds - NTP_EPOCH + fraction / 2 ** 32
+    server_sent = sent_seconds - NTP_EPOCH + sent_fraction / 2 ** 32
+    offset = ((server_received - sent) + (server_sent - received)) / 2
+    delay = (received - sent) - (server_sent - server_received)
+    return ClockSample(f"ntp {server}", offset, delay / 2)
+
+def worldtime_time(url=WORLDTIME_URL, timeout=5):
+    sent = time.monotonic()
+    response = requests.get(url, timeout=timeout)
+    received = time.monotonic()
+    response.raise_for_status()
+    now = datetime.fromisoformat(response.json()['datetime']).timestamp()
+    return ClockSample('worldtimeapi', now - (sent + received) / 2, (received - sent) / 2)
+
+def http_date_time(url=HTTP_DATE_URL, timeout=5):
+    # Any web server sends its time in the Date header, to the second
+    sent = time.monotonic()
+    response = requests.head(url, timeout=timeout)
+    received = time.monotonic()
+    now = parsedate_to_datetime(response.headers['Date']).timestamp() + 0.5
+    return ClockSample(f"http {url.split('/')[2]}", now - (sent + received) / 2, (received - sent) / 2 + 0.5)
+
+def modem_time(modem):
+    # The network time of a SIM800Modem, to the second
+    answer = modem.network_time()
+    if answer is None:
+        raise ValueError("SIM800 has no network time")
+    now, received = answer
+    return ClockSample('sim800', now.timestamp() + 0.5 - received, 1.0)
+
+class ClockSync:
+    """Measures the offset of the real time from time.monotonic() with several sources at once.
+
+    Every source is a function returning a ClockSample, or a (name, function)
+    pair, and runs in its own thread. The sample with the smallest uncertainty
+    wins. offset() gives the best offset so far, or the system clock's while no
+    source has answered. Functions passed to subscribe() are called with every
+    better offset.
+    """
+    def __init__(self, sources=()):
+        self.lock = threading.Lock()
+        self.best = None
+        self.failures = {}
+        self.subscribers = []
+        self.running = 0
+        self.answered = threading.Event()  # Set by the first sample, or once every source has failed
+        for source in sources:
+            self.add(*(source if isinstance(source, tuple) else (source.__name__, source)))
+
+    def add(self, name, source):
+        with self.lock:
+            self.running += 1
+            if self.best is None:
+                self.answered.clear()
+        threading.Thread(target=self.measure, args=(name, source), daemon=True).start()
+
+    def measure(self, name, source):
+        sample = None
+        try:
+            sample = source()
+        except Exception as e:
+            with self.lock:
+                self.failures[name] = repr(e)
+        with self.lock:
+            self.running -= 1
+            better = sample is not None and (self.best is None or sample.uncertainty < self.best.uncertainty)
+            if better:
+                self.best = sample
+            subscribers = list(self.subscribers) if better else []
+            if self.best is not None or self.running == 0:
+                self.answered.set()
+        for subscriber in subscribers:
+            subscriber(sample.offset)
+
+    def subscribe(self, subscriber):
+        # Called at once if a source has already answered
+        with self.lock:
+            self.subscribers.append(subscriber)
+            best = self.best
+        if best is not None:
+            subscriber(best.offset)
+
+    def wait(self, timeout=None):
+        """Wait for the first sample, returns False if none came (the system clock is used then)"""
+        self.answered.wait(timeout)
+        return self.best is not None
+
+    def offset(self):
+        best = self.best
+        return best.offset if best is not None else time.time() - time.monotonic()
+
+    def stats(self):
+        best = self.best
+        if best is None:
+            return {'source': 'system clock', 'failures': self.failures}
+        return {'source': best.source, 'uncertainty_ms': round(best.uncertainty * 1000, 1),
+                'system_clock_error': round(time.time() - time.monotonic() - best.offset, 3),
+                'failures': self.failures}
@@ -0,0 +1,189 @@
+######## Multi-object tracker for counting vehicles #########
+#
+# A small SORT-style tracker: every track predicts its next box with a constant
+# velocity, detections are associated to tracks by IoU, and each vehicle gets a
+# stable track ID. A vehicle is counted once, when its track crosses the counting
+# line, or when it leaves the counting zone (the whole frame if no zone is given).
+#
+# Track state is kept in NumPy arrays, so association and counting work on all
+# tracks at once instead of looping over them in Python.
+
+from collections import namedtuple
+
+import numpy as np
+
+# direction is +1 or -1 for the side of the line the vehicle crossed to, 0 for zone exits
+CountEvent = namedtuple('CountEvent', ['track_id', 'class_id', 'direction', 'timestamp'])
+
+def iou_matrix(boxes_a, boxes_b):
+    # IoU of every box in boxes_a with every box in boxes_b, boxes as [x1, y1, x2, y2]
+    a = boxes_a[:, None, :]
+    b = boxes_b[None, :, :]
+    width = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    height = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    intersection = width * height
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    return intersection / (area_a[:, None] + area_b[None, :] - intersection + 1e-9)
+
+def match(scores, threshold):
+    """Pair rows with columns that are each other's best match, greedily by score.
+
+    Each round takes every mutual best pair above the threshold at once and
+    removes them, so a few rounds settle even crowded scenes.
+    """
+    scores = scores.copy()
+    rows, columns = [], []
+    while scores.size:
+        best_column = scores.argmax(axis=1)
+        best_row = scores.argmax(axis=0)
+        all_rows = np.arange(scores.shape[0])
+        mutual = (best_row[best_column] == all_rows) & (scores[all_rows, best_column] >= threshold)
+        if not mutual.any():
+            break
+        matched_rows = all_rows[mutual]
+        matched_columns = best_column[mutual]
+        rows.append(matched_rows)
+        columns.append(matched_columns)
+        scores[matched_rows, :] = -1
+        scores[:, matched_columns] = -1
+    if not rows:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    return np.concatenate(rows), np.concatenate(columns)
+
+def points_in_polygon(points, polygon):
+    # Ray casting for many points against one polygon given as [[x, y], ...]
+    x, y = points[:, 0][:, None], points[:, 1][:, None]
+    x1, y1 = polygon[:, 0][None, :], polygon[:, 1][None, :]
+    x2, y2 = np.roll(polygon[:, 0], -1)[None, :], np.roll(polygon[:, 1], -1)[None, :]
+    crosses = ((y1 > y) != (y2 > y)) & (x < (x2 - x1) * (y - y1) / (y2 - y1 + 1e-12) + x1)
+    return crosses.sum(axis=1) % 2 == 1
+
+class IoUTracker:
+    """Tracks detections across frames and counts every vehicle once.
+
+    line is ((x1, y1), (x2, y2)) in frame pixels and zone a polygon of (x, y)
+    points. Without either, a vehicle is counted when its track is lost, which is
+    when it has left the view.
+    """
+    def __init__(self, iou_threshold=0.3, max_age=10, min_hits=2, line=None, zone=None):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age      # Frames a track survives without a detection
+        self.min_hits = min_hits    # Detections before a track can be counted
+        self.line = None if line is None else np.asarray(line, dtype=np.float32)
+        self.zone = None if zone is None else np.asarray(zone, dtype=np.float32)
+
+        self.next_id = 1
+        self.total_count = 0
+
+        # One entry per track
+        self.boxes = np.empty((0, 4), dtype=np.float32)
+        self.velocity = np.empty((0, 4), dtype=np.float32)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.class_ids = np.empty(0, dtype=np.int32)
+        self.hits = np.empty(0, dtype=np.int32)
+        self.misses = np.empty(0, dtype=np.int32)
+        self.counted = np.empty(0, dtype=bool)
+        self.side = np.empty(0, dtype=np.float32)
+        self.inside = np.empty(0, dtype=bool)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def centres(self, boxes):
+        return np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2], axis=1)
+
+    def line_side(self, points):
+        # Sign of the side of the counting line, 0 where the point is beyond the segment ends
+        start, end = self.line
+        direction = end - start
+        offset = points - start
+        side = np.sign(direction[0] * offset[:, 1] - direction[1] * offset[:, 0])
+        along = (offset @ direction) / (direction @ direction)
+        side[(along < 0) | (along > 1)] = 0
+        return side
+
+    def in_zone(self, points):
+        if self.zone is None:
+            return np.ones(len(points), dtype=bool)
+        return points_in_polygon(points, self.zone)
+
+    def update(self, detections, timestamp=None):
+        """Update the tracks with this frame's detections (a postprocess structured array).
+
+        Returns a CountEvent for every vehicle counted in this frame.
+        """
+        detection_boxes = np.stack([detections['xmin'], detections['ymin'],
+                                    detections['xmax'], detections['ymax']], axis=1).astype(np.float32)
+
+        # Predict where every track is now and associate the detections with them
+        predicted = self.boxes + self.velocity
+        track_rows, detection_rows = match(iou_matrix(predicted, detection_boxes), self.iou_threshold)
+
+        # Matched tracks follow their detection, the rest coast on their prediction
+        self.boxes = predicted
+        self.misses += 1
+        if len(track_rows):
+            previous = self.boxes[track_rows] - self.velocity[track_rows]
+            new_boxes = detection_boxes[detection_rows]
+            self.velocity[track_rows] = 0.5 * self.velocity[track_rows] + 0.5 * (new_boxes - previous)
+            self.boxes[track_rows] = new_boxes
+            self.class_ids[track_rows] = detections['class_id'][detection_rows]
+            self.hits[track_rows] += 1
+            self.misses[track_rows] = 0
+
+        # Start a track for every detection that was not matched
+        unmatched = np.ones(len(detections), dtype=bool)
+        unmatched[detection_rows] = False
+        new_count = int(unmatched.sum())
+        if new_count:
+            new_boxes = detection_boxes[unmatched]
+            new_centres = self.centres(new_boxes)
+            self.boxes = np.concatenate([self.boxes, new_boxes])
+            self.velocity = np.concatenate([self.velocity, np.zeros((new_count, 4), dtype=np.float32)])
+            self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + new_count)])
+            self.class_ids = np.concatenate([self.class_ids, detections['class_id'][unmatched]])
+            self.hits = np.concatenate([self.hits, np.ones(new_count, dtype=np.int32)])
+            self.misses = np.concatenate([self.misses, np.zeros(new_count, dtype=np.int32)])
+            self.counted = np.concatenate([self.counted, np.zeros(new_count, dtype=bool)])
+            new_side = self.line_side(new_centres) if self.line is not None else np.zeros(new_count)
+            self.side = np.concatenate([self.side, new_side.astype(np.float32)])
+            self.inside = np.concatenate([self.inside, self.in_zone(new_centres)])
+            self.next_id += new_count
+
+        events = []
+        confirmed = (self.hits >= self.min_hits) & ~self.counted
+        seen = self.misses == 0
+        centres = self.centres(self.boxes)
+
+        if self.line is not None:
+            # Count tracks whose centre moved from one side of the line to the other
+            side = self.line_side(centres)
+            crossed = confirmed & seen & (side != 0) & (self.side != 0) & (side != self.side)
+            for i in np.flatnonzero(crossed):
+                events.append(CountEvent(int(self.ids[i]), int(self.class_ids[i]), int(side[i]), timestamp))
+            self.counted |= crossed
+            # Remember the last known side, ignoring frames spent beyond the segment ends
+            self.side = np.where(seen & (side != 0), side, self.side).astype(np.float32)
+        else:
+            # Count tracks that were in the zone and have now left it
+            inside = self.in_zone(centres)
+            left = confirmed & seen & self.inside & ~inside
+            for i in np.flatnonzero(left):
+                events.append(CountEvent(int(self.ids[i]), int(self.class_ids[i]), 0, timestamp))
+            self.counted |= left
+            self.inside = np.where(seen, inside, self.inside)
+
+        # Drop lost tracks, a vehicle lost inside the zone has left the view
+        lost = self.misses > self.max_age
+        if self.line is None:
+            lost_inside = lost & self.inside & ~self.counted & (self.hits >= self.min_hits)
+            for i in np.flatnonzero(lost_inside):
+                events.append(CountEvent(int(self.ids[i]), int(self.class_ids[i]), 0, timestamp))
+        if lost.any():
+            keep = ~lost
+            for name in ('boxes', 'velocity', 'ids', 'class_ids', 'hits', 'misses', 'counted', 'side', 'inside'):
+                setattr(self, name, getattr(self, name)[keep])
+
+        self.total_count += len(events)
+        return events
@@ -0,0 +1,274 @@
+######## Upload transports with automatic WiFi/GSM failover #########
+#
+# Each transport sends a batch of outbox rows to the sheet over one kind of
+# link: WiFi (requests) or GSM (a SIM800Modem). A TransportRouter holds several
+# of them in order of cost. It sends every batch over the cheapest link that is
+# healthy and fails over to the next one when a send fails. It probes links
+# that are down now and then, so a link that comes back is used again.
+#
+# Every transport keeps its success rate and latency percentiles, so the logs
+# show how each link is doing.
+
+import json
+import socket
+import time
+from collections import deque
+from datetime import datetime
+from urllib.parse import urlparse
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from payload import encode_body
+from wifi_log import UPLOAD_URL, acknowledged_keys, answer_keys, batch_body, get_rpi_datetime, send_batch, send_http_request
+
+class TransportError(Exception):
+    pass
+
+class Transport:
+    """Base class: send(rows) raises TransportError when the batch did not go through.
+
+    rows holds (key, timestamp, value, details) tuples from the outbox.
+    Lower cost is preferred. Subclasses implement deliver() and check().
+    """
+    name = 'transport'
+
+    def __init__(self, cost=1, window=100):
+        self.cost = cost
+        self.healthy = True
+        self.successes = 0
+        self.failures = 0
+        self.latencies = deque(maxlen=window)   # Seconds of the last successful sends
+        self.probe_latency = None
+        self.last_probe = None
+
+    def send(self, rows):
+        start = time.perf_counter()
+        try:
+            self.deliver(rows)
+        except TransportError:
+            self.failures += 1
+            self.healthy = False
+            raise
+        self.latencies.append(time.perf_counter() - start)
+        self.successes += 1
+        self.healthy = True
+
+    def probe(self):
+        """Check the link, returns True if it is up. Sets probe_latency."""
+        self.last_probe = time.monotonic()
+        start = time.perf_counter()
+        self.healthy = self.check()
+        self.probe_latency = time.perf_counter() - start if self.healthy else None
+        return self.healthy
+
+    def deliver(self, rows):
+        raise NotImplementedError
+
+    def check(self):
+        raise NotImplementedError
+
+    def stats(self):
+        attempts = self.successes + self.failures
+        latencies = np.array(self.latencies) * 1000
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (None, None, None)
+        return {'healthy': self.healthy, 'sent': self.successes, 'failed': self.failures,
+                'success_rate': self.successes / attempts if attempts else None,
+                'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+                'probe_ms': self.probe_latency * 1000 if self.probe_latency is not None else None}
+
+    def close(self):
+        pass
+
+def sheet_rows(rows):
+    # Outbox rows to the (key, date, time, value, details) rows of wifi_log.send_batch
+    return [(key, *get_rpi_datetime(datetime.fromtimestamp(timestamp)), value, details)
+            for key, timestamp, value, details in rows]
+
+def check_acknowledged(rows, keys):
+    # Raises TransportError unless the sheet acknowledged every row's key
+    missing = [key for key, *_ in rows if str(key) not in keys]
+    if missing:
+        raise TransportError(f"{len(missing)} of {len(rows)} rows not acknowledged by the sheet")
+
+class WiFiTransport(Transport):
+    """HTTPS over whatever network interface is up, with a kept-alive session.
+
+    Batches are posted to the doPost of google_sheet.gs. A sheet deployed
+    without it answers the post with an error page; then every row is sent
+    with the old GET, until a GET is answered by google_sheet.gs again.
+    """
+    name = 'wifi'
+
+    def __init__(self, url=UPLOAD_URL, cost=1):
+        super().__init__(cost)
+        self.url = url
+        self.session = requests.Session()
+        # One kept-alive connection is all a single upload worker needs
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.batches = None     # True once a batch was acknowledged, False for a sheet without doPost
+
+    def deliver(self, rows):
+        rows = sheet_rows(rows)
+        try:
+            if self.batches is not False:
+                response = send_batch(rows, self.session, self.url)
+                response.raise_for_status()
+                keys = acknowledged_keys(response)
+                if keys is not None:
+                    self.batches = True
+                    check_acknowledged(rows, keys)
+                    return
+                if self.batches:
+                    raise TransportError(f"No acknowledgement from the sheet: {response.text[:100]!r}")
+                print("The sheet does not take batches, sending every row with GET")
+                self.batches = False
+            for key, date, rpi_time, value, _ in rows:
+                response = send_http_request(value, date, rpi_time, self.session, self.url, key)
+                response.raise_for_status()
+                keys = acknowledged_keys(response)
+                if keys is not None:
+                    self.batches = None
+                    check_acknowledged([(key,)], keys)
+                elif 'html' in response.headers.get('Content-Type', ''):
+                    # The old doGet answers with text, an error page is HTML
+                    raise TransportError(f"Error page from the sheet: {response.text[:100]!r}")
+        except requests.RequestException as e:
+            raise TransportError(repr(e))
+
+    def check(self):
+        # A TCP connect to the upload host, which costs no Apps Script quota
+        address = urlparse(self.url)
+        port = address.port or (443 if address.scheme == 'https' else 80)
+        try:
+            socket.create_connection((address.hostname, port), timeout=5).close()
+            return True
+        except OSError:
+            return False
+
+    def close(self):
+        self.session.close()
+
+class SIM800Transport(Transport):
+    """HTTPS through a SIM800 that is kept attached between uploads.
+
+    payload is 'json', the body WiFi sends, or 'binary', the compact format of
+    payload.py with num_classes counts per row, which google_sheet.gs decodes.
+    Both carry the outbox keys the sheet acknowledges. A 302 the module did
+    not follow still counts as sent, Apps Script only redirects once doPost has
+    run, but the answer cannot be checked; unconfirmed counts those. Errors
+    of the serial port come out of send() as TransportError like any other.
+    """
+    name = 'gsm'
+
+    def __init__(self, modem, url=UPLOAD_URL, cost=10, payload='json', num_classes=0):
+        super().__init__(cost)
+        self.modem = modem
+        self.url = url
+        self.payload = payload
+        self.num_classes = num_classes
+        self.bytes_sent = 0
+        self.unconfirmed = 0
+
+    def deliver(self, rows):
+        if self.payload == 'binary':
+            body = encode_body(rows, self.num_classes)
+            content_type = 'text/plain'
+        else:
+            body = json.dumps(batch_body(sheet_rows(rows)), separators=(',', ':')).encode()
+            content_type = 'application/json'
+        self.bytes_sent += len(body)
+        try:
+            status, answer = self.modem.request(self.url, data=body, content_type=content_type, read=True)
+        except (OSError, ValueError) as e:
+            # serial.SerialException is an OSError
+            raise TransportError(f"Modem error: {e!r}") from e
+        if status == 302:
+            self.unconfirmed += 1
+            return
+        if status != 200:
+            raise TransportError(f"HTTP status {status}")
+        acknowledged = answer_keys(answer)
+        if acknowledged is None:
+            raise TransportError(f"No acknowledgement from the sheet: {answer[:100]!r}")
+        check_acknowledged(rows, acknowledged)
+
+    def check(self):
+        try:
+            return self.modem.check_health()
+        except (OSError, ValueError) as e:
+            print(f"SIM800 check failed: {e!r}")
+            return False
+
+    def stats(self):
+        stats = super().stats()
+        stats['bytes_sent'] = self.bytes_sent
+        stats['unconfirmed'] = self.unconfirmed
+        return stats
+
+    def close(self):
+        self.modem.close()
+
+class TransportRouter:
+    """Sends each batch over the cheapest healthy transport, failing over in cost order.
+
+    Between transports of the same cost, the one with the lowest probe latency goes first.
+
+    Transports that are down are probed again after probe_interval seconds. A
+    probe is also what brings a cheaper link back into use after a failover.
+    """
+    def __init__(self, transports, probe_interval=60):
+        self.transports = list(transports)
+        self.probe_interval = probe_interval
+        self.last_used = None
+        self.failovers = 0
+
+    def reprobe(self):
+        now = time.monotonic()
+        for transport in self.transports:
+            if not transport.healthy and (transport.last_probe is None or now - transport.last_probe >= self.probe_interval):
+                transport.probe()
+
+    def send(self, rows):
+        """Send rows over the best link, raises TransportError if every link failed"""
+        self.reprobe()
+        candidates = sorted([t for t in self.transports if t.healthy] or self.transports,
+                            key=lambda t: (t.cost, t.probe_latency if t.probe_latency is not None else float('inf')))
+        errors = []
+        for transport in candidates:
+            try:
+                transport.send(rows)
+            except TransportError as e:
+                errors.append(f"{transport.name}: {e}")
+                continue
+            if errors:
+                self.failovers += 1
+            self.last_used = transport.name
+            return transport.name
+        raise TransportError('; '.join(errors))
+
+    def stats(self):
+        stats = {transport.name: transport.stats() for transport in self.transports}
+        stats['last_used'] = self.last_used
+        stats['failovers'] = self.failovers
+        return stats
+
+    def close(self):
+        for transport in self.transports:
+            transport.close()
+
+def open_transports(kind, url=UPLOAD_URL, apn=None, payload='json', num_classes=0):
+    """TransportRouter for --transport: 'wifi', 'gsm' or 'auto' (WiFi first, GSM as fallback)"""
+    transports = []
+    if kind in ('wifi', 'auto'):
+        transports.append(WiFiTransport(url))
+    if kind in ('gsm', 'auto'):
+        from sim800_modem import SIM800Modem
+        transports.append(SIM800Transport(SIM800Modem(apn=apn, health_interval=300), url,
+                                          payload=payload, num_classes=num_classes))
+    if not transports:
+        raise ValueError(f"Unknown transport {kind!r}, use wifi, gsm or auto")
+    return TransportRouter(transports)
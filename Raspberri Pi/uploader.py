@@ -0,0 +1,128 @@
+######## In-process uploader for the interval counts #########
+#
+# Starting `python3 wifi_log.py` every 5 minutes costs a new interpreter, a
+# `requests` import, a shell for `date` and a new TLS connection per upload.
+# The Uploader instead lives as long as the detector: one worker thread sends
+# the counts over a keep-alive requests.Session, so after the first upload the
+# connection to the Apps Script is already open.
+#
+# Counts go through a durable outbox (outbox.py) first. The worker sends what is
+# pending in batches, and after a failure it waits with exponential backoff. The
+# counts stay on disk until the sheet has accepted them, so an outage or a
+# restart only delays them. Which link a batch goes over (WiFi or GSM) is up to
+# the transport, see transports.py.
+
+import random
+import threading
+import time
+from datetime import datetime
+
+from outbox import Outbox
+from transports import TransportRouter, WiFiTransport
+from wifi_log import UPLOAD_URL
+
+class Uploader:
+    """Sends vehicle counts to the sheet from a background thread.
+
+    submit() records the count in the outbox with the time it was taken and
+    never waits for the network. transport is a TransportRouter or a single
+    Transport, by default WiFi to url, which can point at a local stand-in for
+    the Apps Script. Up to max_batch counts go in one request. With batch_delay,
+    counts wait until the oldest is that many seconds old (or max_batch are
+    pending), so a metered link sends several intervals per request. A failed
+    request is retried after retry_min seconds, doubling up to retry_max.
+    """
+    def __init__(self, url=UPLOAD_URL, outbox_path='/home/russouw/outbox.db', max_batch=20,
+                 retry_min=5, retry_max=600, transport=None, batch_delay=0):
+        self.max_batch = max_batch
+        self.batch_delay = batch_delay
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self.outbox = Outbox(outbox_path)
+        self.transport = transport or TransportRouter([WiFiTransport(url)])
+
+        self.sent = 0          # Rows accepted by the sheet
+        self.batches = 0
+        self.failed = 0        # Failed requests
+        self.send_time = 0.0   # Seconds spent in successful requests
+        self.backoff = 0
+        self.last_latency = None
+        self.last_error = None
+
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def submit(self, vehicle_count, when=None, details=None):
+        # The sheet gets the time of the count, not the time of the upload
+        when = when or datetime.now()
+        self.outbox.add(vehicle_count, when.timestamp(), details=details)
+        self.wake.set()
+
+    def worker(self):
+        while True:
+            self.wake.clear()
+            rows = self.outbox.pending(self.max_batch)
+            if not rows:
+                if self.stopping.is_set():
+                    break
+                self.wake.wait()
+                continue
+
+            # Let a batch fill up, but never hold counts back when stopping
+            wait = self.batch_delay - (time.time() - rows[0][2])
+            if len(rows) < self.max_batch and wait > 0 and not self.stopping.is_set():
+                self.stopping.wait(wait)
+                continue
+
+            if self.flush(rows):
+                self.backoff = 0
+                continue
+
+            # Back off, with some jitter, before the same rows are tried again
+            self.backoff = min(self.retry_max, max(self.retry_min, self.backoff * 2))
+            if self.stopping.wait(self.backoff * random.uniform(0.8, 1.2)):
+                break
+
+    def flush(self, rows):
+        # Send one batch, True once the sheet has accepted it
+        batch = [row[1:] for row in rows]
+        ids = [row[0] for row in rows]
+        start = time.perf_counter()
+        try:
+            self.transport.send(batch)
+        except Exception as e:
+            # Not only TransportError: an error the transport did not expect, such as the
+            # serial port of the modem going away, must not end the only upload thread
+            self.last_latency = time.perf_counter() - start
+            self.failed += 1
+            self.last_error = repr(e)
+            self.outbox.mark_failed(ids)
+            print(f"Upload of {len(rows)} counts failed, retrying later: {e}")
+            return False
+        self.last_latency = time.perf_counter() - start
+        self.send_time += self.last_latency
+        self.outbox.mark_sent(ids)
+        self.sent += len(rows)
+        self.batches += 1
+        return True
+
+    def stats(self):
+        stats = self.outbox.stats()
+        stats.update({'sent': self.sent, 'batches': self.batches, 'failed': self.failed,
+                      'rows_per_second': self.sent / self.send_time if self.send_time else 0.0,
+                      'backoff': self.backoff, 'last_latency': self.last_latency,
+                      'last_error': self.last_error})
+        if hasattr(self.transport, 'stats'):
+            stats['transports'] = self.transport.stats()
+        return stats
+
+    def close(self, timeout=15):
+        # Send what is pending unless the link is down, anything left is sent after the next start
+        self.stopping.set()
+        self.wake.set()
+        self.thread.join(timeout=timeout)
+        self.transport.close()
+        if not self.thread.is_alive():
+            self.outbox.close()
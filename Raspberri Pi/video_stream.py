@@ -0,0 +1,243 @@
+######## Threaded camera capture for the vehicle counters #########
+#
+# The Picamera2 capture runs on its own thread and fills a small ring buffer of
+# preallocated frames, so that the detector never has to wait for the camera.
+# Both count_vehicles.py and count_vehicles_yolo.py use this module.
+#
+# FrameSource is the interface every frame backend implements. The backends for
+# recorded video, image folders and the ESP32 MJPEG stream are in frame_sources.py.
+
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+
+# Buffer policies when the detector falls behind the camera
+DROP_OLDEST = 'drop'  # Overwrite the oldest unread frame, the camera never waits
+BLOCK = 'block'       # The camera waits for a free slot, no frame is ever lost
+
+class FrameRingBuffer:
+    """Bounded ring buffer of preallocated frames shared by one writer and one reader"""
+    def __init__(self, shape, dtype=np.uint8, size=3, policy=DROP_OLDEST):
+        if size < 2:
+            raise ValueError("The ring buffer needs at least 2 slots")
+        if policy not in (DROP_OLDEST, BLOCK):
+            raise ValueError(f"Unknown buffer policy: {policy}")
+
+        self.slots = [np.empty(shape, dtype=dtype) for _ in range(size)]
+        self.policy = policy
+
+        self.free = deque(range(size))  # Slots that may be written to
+        self.ready = deque()            # Slots holding unread frames, oldest first
+        self.writing = None             # Slot currently being filled by the writer
+        self.held = None                # Slot handed out to the reader by the last get()
+
+        self.condition = threading.Condition()
+        self.closed = False
+
+        # Counters
+        self.frames_written = 0
+        self.frames_read = 0
+        self.frames_dropped = 0
+
+    def acquire(self):
+        """Return an empty slot for the writer to fill in place, or None once closed"""
+        with self.condition:
+            while not self.free and not self.closed:
+                if self.policy == DROP_OLDEST:
+                    self.free.append(self.ready.popleft())
+                    self.frames_dropped += 1
+                else:
+                    self.condition.wait()
+            if self.closed:
+                return None
+            self.writing = self.free.popleft()
+            return self.slots[self.writing]
+
+    def commit(self):
+        """Publish the slot returned by the last acquire()"""
+        with self.condition:
+            if self.writing is None:
+                return
+            self.ready.append(self.writing)
+            self.writing = None
+            self.frames_written += 1
+            self.condition.notify_all()
+
+    def put(self, frame):
+        """Copy a frame into the buffer, returns False once the buffer is closed"""
+        slot = self.acquire()
+        if slot is None:
+            return False
+        np.copyto(slot, frame)
+        self.commit()
+        return True
+
+    def get(self, timeout=None):
+        """Return the next frame for the reader, or None on timeout or once closed.
+
+        With DROP_OLDEST the newest frame is returned and any older unread frames
+        are counted as dropped. With BLOCK frames are returned in capture order.
+        The returned array stays valid until the next call to get().
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.ready or self.closed, timeout):
+                return None
+            if not self.ready:
+                return None
+
+            # Hand the previously held slot back to the writer
+            if self.held is not None:
+                self.free.append(self.held)
+
+            if self.policy == DROP_OLDEST:
+                self.held = self.ready.pop()
+                self.frames_dropped += len(self.ready)
+                self.free.extend(self.ready)
+                self.ready.clear()
+            else:
+                self.held = self.ready.popleft()
+
+            self.frames_read += 1
+            self.condition.notify_all()
+            return self.slots[self.held]
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {'written': self.frames_written,
+                    'read': self.frames_read,
+                    'dropped': self.frames_dropped,
+                    'pending': len(self.ready)}
+
+class FrameSource:
+    """Base class for anything that produces frames for the detector.
+
+    Subclasses open their device in __init__, pass the first frame to
+    init_buffer() and implement capture(), which returns the next frame or None
+    once the source is exhausted. Frames are read on a background thread.
+    """
+    # Live sources keep running forever, recorded sources end
+    live = True
+
+    def init_buffer(self, frame, buffer_size=3, policy=None):
+        if policy is None:
+            policy = DROP_OLDEST if self.live else BLOCK
+        self.frame = frame
+        self.buffer = FrameRingBuffer(frame.shape, frame.dtype, buffer_size, policy)
+        self.buffer.put(frame)
+        self.thread = None
+        self.stopped = False
+
+    def capture(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def start(self):
+        # Start the thread that keeps reading frames from the source
+        self.thread = threading.Thread(target=self.update, daemon=True)
+        self.thread.start()
+        return self
+
+    def update(self):
+        # Keep capturing until the source is stopped or runs out of frames
+        while not self.stopped:
+            try:
+                frame = self.capture()
+            except Exception as e:
+                if not self.stopped:
+                    print(f"Frame capture failed: {e}")
+                break
+            if frame is None or not self.buffer.put(frame):
+                break
+        self.buffer.close()
+
+    def read(self):
+        # Return the next frame, or None once the source has ended
+        self.frame = self.buffer.get()
+        return self.frame
+
+    def read_full(self):
+        # Full resolution version of the last frame, for drawing and snapshots.
+        # Only sources that read a smaller stream for detection need to override this.
+        return self.frame
+
+    def stats(self):
+        return self.buffer.stats()
+
+    def set_frame_rate(self, fps):
+        # Sources that can capture less often to save power override this
+        pass
+
+    def stop(self):
+        self.stopped = True
+        self.buffer.close()
+        # A source stuck on a slow read is closed anyway, its thread is a daemon
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        self.close()
+
+class VideoStream(FrameSource):
+    """Camera object that controls video streaming from the Picamera
+
+    With lores_size the camera also produces a low resolution stream, normally at
+    the model's input size, which is what read() returns. The full resolution main
+    stream is then only captured when read_full() asks for it. Any object with the
+    Picamera2 methods used here can be passed as camera, such as a simulated camera.
+    """
+    def __init__(self,resolution=(640,480),framerate=30,buffer_size=3,policy=None,lores_size=None,camera=None):
+        if camera is None:
+            # Imported here so that other sources also work on machines without a Pi camera
+            from picamera2 import Picamera2
+            from libcamera import Transform
+            camera = Picamera2()
+            transform = Transform(vflip=False)
+        else:
+            transform = None
+        self.camera = camera
+        self.lores_size = lores_size
+
+        if lores_size is None:
+            config = self.camera.create_still_configuration(main={"size": resolution},transform=transform)
+        else:
+            # The lores stream is YUV420 on every Pi model, it is converted in capture()
+            config = self.camera.create_video_configuration(main={"size": resolution, "format": "BGR888"},
+                                                            lores={"size": tuple(lores_size), "format": "YUV420"},
+                                                            transform=transform)
+        self.camera.configure(config)
+
+        self.camera.start()
+
+        #self.camera.set_controls({"AfMode": 1})\
+        self.camera.set_controls({"LensPosition": 0.0})
+
+        # Capture one frame up front to size the ring buffer
+        self.init_buffer(self.capture(), buffer_size, policy)
+
+    def capture(self):
+        if self.lores_size is None:
+            return self.camera.capture_array()
+
+        # Converted to the same channel order as the BGR888 main stream
+        yuv = self.camera.capture_array("lores")
+        return cv2.cvtColor(yuv, cv2.COLOR_YUV2RGB_I420)
+
+    def read_full(self):
+        if self.lores_size is None:
+            return self.frame
+        return self.camera.capture_array("main")
+
+    def set_frame_rate(self, fps):
+        # The sensor only exposes as many frames as are used, in microseconds per frame
+        frame_duration = int(1000000 / fps)
+        self.camera.set_controls({"FrameDurationLimits": (frame_duration, frame_duration)})
+
+    def close(self):
+        self.camera.stop()
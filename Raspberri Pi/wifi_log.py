@@ -1,12 +1,20 @@
+import json
 import requests
-import subprocess
 import sys
-import time
+from datetime import datetime
+
+# Google Apps Script that appends a row to the vehicle count sheet, google_sheet.gs
+UPLOAD_URL = "https://script.google.com/macros/s/AKfycbzToJ2en2NCraeKdaipUhHWLWZhr3tF5hQb_dFUu3ZCz6hJoeg8u_5fSUJFEDqrkEs/exec"
 
 # Function to send HTTP request using WiFi
-def send_http_request(vehicles_counted, date, rpi_time):
-    url = f"https://script.google.com/macros/s/AKfycbzToJ2en2NCraeKdaipUhHWLWZhr3tF5hQb_dFUu3ZCz6hJoeg8u_5fSUJFEDqrkEs/exec?date={date}&time={rpi_time}&value={vehicles_counted}"
-    response = requests.get(url, timeout=10)
+# Pass a requests.Session to reuse its connection instead of opening a new one,
+# and a key to have the sheet store the count only once
+def send_http_request(vehicles_counted, date, rpi_time, session=None, url=UPLOAD_URL, key=None):
+    params = {'date': date, 'time': rpi_time, 'value': vehicles_counted}
+    if key:
+        params['key'] = key
+    response = (session or requests).get(url, params=params, timeout=10)
+    return response
     #try:
         #response = requests.get(url, timeout=10)
         #if response.status_code == 200:
@@ -16,9 +24,49 @@ def send_http_request(vehicles_counted, date, rpi_time):
     #except requests.RequestException as e:
         #print(f"Error sending HTTP request: {e}")
 
+# Function to send several counts in one HTTP request
+# rows holds (key, date, time, value, details) tuples, details being None or a
+# dict of per class and per direction counts. The doPost of google_sheet.gs
+# appends every row whose key it has not stored yet, so sending a batch twice
+# is harmless. Check the answer with acknowledged_keys().
+def send_batch(rows, session=None, url=UPLOAD_URL):
+    response = (session or requests).post(url, json=batch_body(rows), timeout=10)
+    return response
+
+def batch_body(rows):
+    body = {'rows': []}
+    for key, date, rpi_time, value, details in rows:
+        row = {'key': key, 'date': date, 'time': rpi_time, 'value': value}
+        if details:
+            row.update(details)
+        body['rows'].append(row)
+    return body
+
+# Function to read the keys the sheet says it has stored from its answer
+# None if the answer is not from google_sheet.gs: a deployment without doPost,
+# or an error page, which Apps Script serves with status 200
+def acknowledged_keys(response):
+    if 'json' not in response.headers.get('Content-Type', ''):
+        return None
+    return answer_keys(response.text)
+
+# Function to read the keys from the text of an answer, such as the SIM800 reads
+def answer_keys(text):
+    try:
+        answer = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(answer, dict):
+        return None
+    if not answer.get('ok'):
+        print(f"Sheet error: {answer.get('error')}")
+        return set()
+    return set(str(key) for key in answer.get('keys', []))
+
 # Function to get the current Raspberry Pi date and time
-def get_rpi_datetime():
-    current_time = subprocess.check_output("date +'%d/%m/%Y %H:%M'", shell=True).decode().strip()
+def get_rpi_datetime(when=None):
+    # Same format as `date +'%d/%m/%Y %H:%M'`, without starting a shell
+    current_time = (when or datetime.now()).strftime('%d/%m/%Y %H:%M')
     date, rpi_time = current_time.split(" ")
     #print(f"Raspberry Pi Date: {date}, Time: {rpi_time}")
     return date, rpi_time
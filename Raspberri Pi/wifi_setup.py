@@ -5,7 +5,7 @@ import time
 def fetch_time_from_api():
     try:
         # Send a request to the World Time API
-        response = requests.get("http://worldtimeapi.org/api/ip")
+        response = requests.get("http://worldtimeapi.org/api/ip", timeout=10)
         if response.status_code == 200:
             data = response.json()
             datetime_str = data['datetime']